@@ -0,0 +1,272 @@
+"""Аналітика продажів по історії залишків.
+
+Історія завантажується в щільну матрицю товар x день (NumPy), і всі метрики рахуються
+для всього каталогу одним векторизованим проходом, без циклів по товарах:
+  - продажі - сума від'ємних змін залишку, поповнення (додатні зміни) рахуються окремо;
+  - швидкість продажів - ковзне середнє продажів за день у вікні window днів,
+    що закінчується останнім заміром товару;
+  - днів до нуля - поточний залишок / швидкість продажів.
+
+HistoryBuckets зводить ту ж матрицю до тижнів або місяців (залишок на кінець, мін, макс, продано),
+щоб довга історія давала вузьку таблицю.
+"""
+import sqlite3
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Вікно ковзного середнього, днів
+DEFAULT_WINDOW = 14
+# Скільки днів історії завантажувати для статистики
+DEFAULT_HISTORY_DAYS = 90
+# Періоди зведення історії для HistoryBuckets
+HISTORY_PERIODS = ("week", "month")
+# Значення кожного періоду, в порядку колонок
+BUCKET_FIELDS = ("last", "min", "max", "sold")
+
+
+def forward_fill(values: np.ndarray) -> np.ndarray:
+    """Заповнює NaN останнім відомим значенням уздовж рядка (NaN до першого заміру лишаються)"""
+    observed = ~np.isnan(values)
+    index = np.where(observed, np.arange(values.shape[1]), 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    return np.take_along_axis(values, index, axis=1)
+
+
+def cumulative_sum(values: np.ndarray) -> np.ndarray:
+    """Кумулятивна сума по рядку з нульовою колонкою попереду: cumulative[:, j] = sum(values[:, :j])"""
+    cumulative = np.zeros((values.shape[0], values.shape[1] + 1), dtype=np.float64)
+    np.cumsum(values, axis=1, out=cumulative[:, 1:])
+    return cumulative
+
+
+def window_sum(cumulative: np.ndarray, end: np.ndarray, window: int) -> np.ndarray:
+    """Сума за window колонок, що закінчуються колонкою end[i], для кожного рядка i"""
+    rows = np.arange(cumulative.shape[0])
+    return cumulative[rows, end + 1] - cumulative[rows, np.maximum(end + 1 - window, 0)]
+
+
+def period_starts(dates: np.ndarray, period: str) -> np.ndarray:
+    """Перший день тижня (понеділок) або місяця для кожної дати"""
+    if period == "week":
+        # 1970-01-01 - четвер, тож понеділок тижня = дата - (дні від епохи + 3) % 7
+        return dates - (dates.astype(np.int64) + 3) % 7
+    if period == "month":
+        return dates.astype('datetime64[M]').astype('datetime64[D]')
+    raise ValueError(f"Невідомий період: {period}")
+
+
+class StockMatrix:
+    """Залишки товарів по днях: stock[i, j] - залишок товару product_ids[i] на dates[j] (NaN - немає заміру)"""
+
+    def __init__(self, product_ids: np.ndarray, names: List[str], urls: List[str],
+                 dates: np.ndarray, stock: np.ndarray):
+        self.product_ids = product_ids
+        self.names = names
+        self.urls = urls
+        self.dates = dates
+        self.stock = stock
+
+    @classmethod
+    def from_db(cls, conn: sqlite3.Connection, days: Optional[int] = DEFAULT_HISTORY_DAYS) -> "StockMatrix":
+        """Завантажує stock_history за останні days днів (None - всю історію)"""
+        products = conn.execute("SELECT id, name, url FROM products ORDER BY id").fetchall()
+        product_ids = np.array([row[0] for row in products], dtype=np.int64)
+        names = [row[1] or '' for row in products]
+        urls = [row[2] for row in products]
+
+        since = (date.today() - timedelta(days=days)).isoformat() if days else ''
+        rows = conn.execute("""
+            SELECT product_id, check_date, stock_count FROM stock_history
+            WHERE check_date >= ? AND stock_count IS NOT NULL
+        """, (since,)).fetchall()
+        return cls.from_readings(product_ids, names, urls, rows)
+
+    @classmethod
+    def from_histories(cls, names: List[str], urls: List[str], histories: List[Dict]) -> "StockMatrix":
+        """Матриця з історій {дата: залишок} (наприклад, з Excel); id товару - його позиція в списку"""
+        rows = []
+        for i, history in enumerate(histories):
+            for check_date, stock in history.items():
+                try:
+                    rows.append((i, check_date, float(stock)))
+                except (TypeError, ValueError):
+                    continue
+        return cls.from_readings(np.arange(len(urls), dtype=np.int64), names, urls, rows)
+
+    @classmethod
+    def from_readings(cls, product_ids: np.ndarray, names: List[str], urls: List[str], rows) -> "StockMatrix":
+        """Матриця із замірів (product_id, 'YYYY-MM-DD', залишок); product_ids - відсортовані"""
+        if not rows or not len(product_ids):
+            return cls(product_ids, names, urls, np.array([], dtype='datetime64[D]'),
+                       np.full((len(product_ids), 0), np.nan))
+
+        row_products, row_dates, row_stock = zip(*rows)
+        row_dates = np.array(row_dates, dtype='datetime64[D]')
+        first_date = row_dates.min()
+        dates = np.arange(first_date, row_dates.max() + 1)
+
+        # Товари без запису в products (видалені) відкидаються
+        row_products = np.array(row_products, dtype=np.int64)
+        position = np.searchsorted(product_ids, row_products)
+        position = np.minimum(position, len(product_ids) - 1)
+        known = product_ids[position] == row_products
+
+        stock = np.full((len(product_ids), len(dates)), np.nan)
+        stock[position[known], (row_dates - first_date).astype(np.int64)[known]] = \
+            np.array(row_stock, dtype=np.float64)[known]
+        return cls(product_ids, names, urls, dates, stock)
+
+
+class SalesStats:
+    """Метрики продажів для всього каталогу; масиви вирівняні з matrix.product_ids"""
+
+    def __init__(self, matrix: StockMatrix, window: int = DEFAULT_WINDOW):
+        self.matrix = matrix
+        self.window = window
+        stock = matrix.stock
+        if stock.shape[1] < 2:
+            # Щоб була хоча б одна зміна між днями (NaN-колонки не впливають на результат)
+            stock = np.hstack([stock, np.full((stock.shape[0], 2 - stock.shape[1]), np.nan)])
+        count, days = stock.shape
+
+        observed = ~np.isnan(stock)
+        has_data = observed.any(axis=1)
+        # Індекс останнього заміру кожного товару
+        last_index = days - 1 - np.argmax(observed[:, ::-1], axis=1)
+        self._has_data = has_data
+        self._last_index = last_index
+
+        self.current_stock = stock[np.arange(count), last_index]
+
+        # Зміни між сусідніми днями; пропуски в замірах заповнюються попереднім значенням,
+        # а дні після останнього заміру товару не враховуються
+        filled = forward_fill(stock)
+        delta = np.diff(filled, axis=1)
+        step_day = np.arange(1, days)
+        valid = ~np.isnan(delta) & (step_day[None, :] <= last_index[:, None])
+        delta = np.where(valid, delta, 0.0)
+
+        sold = np.clip(-delta, 0, None)
+        restocked = np.clip(delta, 0, None)
+
+        sold_total = cumulative_sum(sold)
+        valid_total = cumulative_sum(valid)
+
+        # Вікно, що закінчується останнім заміром товару (крок last_index - 1); швидкість -
+        # ковзне середнє продажів за день у ньому (лише по днях з даними)
+        has_steps = has_data & (last_index > 0)
+        last_step = np.clip(last_index - 1, 0, None)
+        steps = window_sum(valid_total, last_step, window)
+        self.sold = np.where(has_steps, window_sum(sold_total, last_step, window), 0.0)
+        self.restocked = np.where(has_steps, window_sum(cumulative_sum(restocked), last_step, window), 0.0)
+        self.restocks = np.where(has_steps, window_sum(cumulative_sum(restocked > 0), last_step, window), 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.velocity = np.where(has_steps & (steps > 0), self.sold / steps, np.nan)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.days_to_stockout = np.where(self.velocity > 0, self.current_stock / self.velocity, np.nan)
+
+        self._index = {int(product_id): i for i, product_id in enumerate(matrix.product_ids)}
+
+    def row(self, i: int) -> Dict:
+        """Метрики i-го товару як словник (NaN -> None)"""
+        def value(x, digits=None):
+            if np.isnan(x):
+                return None
+            return round(float(x), digits) if digits is not None else int(x)
+
+        return {
+            'id': int(self.matrix.product_ids[i]),
+            'name': self.matrix.names[i],
+            'url': self.matrix.urls[i],
+            'stock': value(self.current_stock[i]),
+            'last_date': str(self.matrix.dates[self._last_index[i]]) if self._has_data[i] else None,
+            'velocity': value(self.velocity[i], 2),
+            'sold': value(self.sold[i]),
+            'restocked': value(self.restocked[i]),
+            'restocks': value(self.restocks[i]),
+            'days_to_stockout': value(self.days_to_stockout[i], 1),
+        }
+
+    def for_product(self, product_id: int) -> Optional[Dict]:
+        i = self._index.get(product_id)
+        return self.row(i) if i is not None else None
+
+    def soonest_stockouts(self, limit: int = 10) -> List[Dict]:
+        """Товари, що закінчаться найшвидше (з ненульовою швидкістю продажів)"""
+        candidates = np.flatnonzero(~np.isnan(self.days_to_stockout))
+        order = candidates[np.argsort(self.days_to_stockout[candidates], kind='stable')]
+        return [self.row(i) for i in order[:limit]]
+
+    def summary(self) -> Dict:
+        """Підсумки по каталогу"""
+        return {
+            'products': len(self.matrix.product_ids),
+            'tracked': int(np.count_nonzero(~np.isnan(self.current_stock))),
+            'selling': int(np.count_nonzero(self.velocity > 0)),
+            'out_of_stock': int(np.count_nonzero(self.current_stock == 0)),
+            'velocity': float(np.nansum(self.velocity)),
+            'sold': int(self.sold.sum()),
+            'restocked': int(self.restocked.sum()),
+            'restocks': int(self.restocks.sum()),
+            'window': self.window,
+            'days': len(self.matrix.dates),
+        }
+
+
+class HistoryBuckets:
+    """Історія, зведена по тижнях або місяцях: на кожен період залишок на кінець, мінімум, максимум
+    і продано (сума падінь залишку, як у SalesStats). NaN - у періоді не було замірів.
+
+    values[i] - значення товару matrix.product_ids[i], по BUCKET_FIELDS для кожного періоду підряд.
+    """
+
+    def __init__(self, matrix: StockMatrix, period: str):
+        self.matrix = matrix
+        self.period = period
+        stock = matrix.stock
+        count, days = stock.shape
+
+        keys = period_starts(matrix.dates, period)
+        # Дати матриці йдуть підряд, тож кожен період - суцільний діапазон колонок
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if days else np.array([], dtype=np.int64)
+        self.starts = keys[starts]
+        self.labels = [self._label(start) for start in self.starts.tolist()]
+
+        if not days:
+            self.values = np.full((count, 0), np.nan)
+            self._index = {int(product_id): i for i, product_id in enumerate(matrix.product_ids)}
+            return
+
+        observed = np.add.reduceat(~np.isnan(stock), starts, axis=1) > 0
+        # fmin/fmax пропускають NaN, тож дні без замірів не впливають
+        minimum = np.fmin.reduceat(stock, starts, axis=1)
+        maximum = np.fmax.reduceat(stock, starts, axis=1)
+
+        filled = forward_fill(stock)
+        ends = np.r_[starts[1:], days] - 1
+        last = np.where(observed, filled[:, ends], np.nan)
+
+        # Падіння між сусідніми замірами зараховується дню пізнішого заміру
+        delta = np.diff(filled, axis=1, prepend=np.nan)
+        sold = np.where(delta < 0, -np.nan_to_num(delta), 0.0)
+        sold = np.where(observed, np.add.reduceat(sold, starts, axis=1), np.nan)
+
+        self.values = np.stack([last, minimum, maximum, sold], axis=2).reshape(count, -1)
+        self._index = {int(product_id): i for i, product_id in enumerate(matrix.product_ids)}
+
+    def _label(self, start: date) -> str:
+        if self.period == "week":
+            year, week, _ = start.isocalendar()
+            return f"{year}-W{week:02d}"
+        return start.strftime("%Y-%m")
+
+    def row(self, i: int) -> List[Optional[int]]:
+        """Значення i-го товару для клітинок (NaN -> None)"""
+        return [None if value != value else int(value) for value in self.values[i].tolist()]
+
+    def for_product(self, product_id: int) -> Optional[List[Optional[int]]]:
+        i = self._index.get(product_id)
+        return self.row(i) if i is not None else None
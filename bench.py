@@ -0,0 +1,487 @@
+"""Бенчмарки бази даних і експорту бота на синтетичних даних.
+
+Приклад:
+    python bench.py latest --products 10000 --days 365
+    python bench.py excel --products 5000 --days 180
+    python bench.py excel --impl update-rebuild --impl update-db
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import openpyxl
+from openpyxl import Workbook
+from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
+
+from main import DatabaseManager, EXPORT_STATS_HEADERS, write_history_workbook
+from tg import ExcelHistory, excel_rows, save_excel_with_formatting
+
+# Запит get_products до появи таблиці latest_stock (два корельовані підзапити на товар)
+LEGACY_GET_PRODUCTS_SQL = """
+    SELECT p.id, p.url, p.name, p.category,
+        (SELECT stock_count FROM stock_history sh
+            WHERE sh.product_id = p.id
+            ORDER BY sh.check_date DESC LIMIT 1) as last_stock,
+        (SELECT check_date FROM stock_history sh
+            WHERE sh.product_id = p.id
+            ORDER BY sh.check_date DESC LIMIT 1) as last_check
+    FROM products p
+    ORDER BY p.name
+"""
+
+
+def build_database(path: str, products: int, days: int) -> DatabaseManager:
+    """Створює базу з products товарів і days днями історії для кожного"""
+    db = DatabaseManager(path)
+    conn = db._connection()
+    start = date.today() - timedelta(days=days - 1)
+    dates = [(start + timedelta(days=d)).isoformat() for d in range(days)]
+
+    with conn:
+        conn.executemany(
+            "INSERT INTO products (url, name, category) VALUES (?, ?, ?)",
+            ((f"https://rozetka.com.ua/ua/bench/p{i}/", f"Товар {i:06d}", f"Категорія {i % 50}")
+             for i in range(1, products + 1))
+        )
+
+    rng = random.Random(42)
+    for product_id in range(1, products + 1):
+        stock = rng.randint(0, 500)
+        rows = []
+        for check_date in dates:
+            stock = max(0, stock + rng.randint(-5, 3))
+            rows.append((product_id, check_date, stock))
+        conn.executemany(
+            "INSERT INTO stock_history (product_id, check_date, stock_count) VALUES (?, ?, ?)", rows
+        )
+        if product_id % 500 == 0:
+            conn.commit()
+    conn.commit()
+    return db
+
+
+def timed(fn, repeat: int):
+    """Найкращий і середній час виконання fn у мілісекундах"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings), sum(timings) / len(timings)
+
+
+def bench_latest(args):
+    workdir = tempfile.mkdtemp(prefix="rozetka_bench_")
+    try:
+        path = os.path.join(workdir, "bench.db")
+        print(f"Створюємо базу: {args.products} товарів x {args.days} днів "
+              f"({args.products * args.days} записів історії)...")
+        started = time.perf_counter()
+        db = build_database(path, args.products, args.days)
+        print(f"  готово за {time.perf_counter() - started:.1f} с")
+
+        conn = db._connection()
+        legacy = timed(lambda: conn.execute(LEGACY_GET_PRODUCTS_SQL).fetchall(), args.repeat)
+        current = timed(db.get_products, args.repeat)
+
+        print(f"get_products (корельовані підзапити): найкраще {legacy[0]:.1f} мс, середнє {legacy[1]:.1f} мс")
+        print(f"get_products (latest_stock):          найкраще {current[0]:.1f} мс, середнє {current[1]:.1f} мс")
+        print(f"Прискорення: x{legacy[0] / current[0]:.1f}")
+        db.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def legacy_history_workbook(db: DatabaseManager, filepath: str) -> int:
+    """generate_excel до переходу на write-only режим"""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Історія залишків"
+
+    # Определяем все даты
+    sorted_dates = db.get_history_dates()
+    stats = db.load_sales_stats()
+
+    # Создаем заголовки с колонками изменений
+    headers = ["Товар", "URL", "Категорія"] + list(EXPORT_STATS_HEADERS)
+    first_date_col = len(headers) + 1
+    for date in sorted_dates:
+        headers.extend([f"{date}\nкількість", f"{date}\nзміни"])
+
+    # Заполняем заголовки
+    for col, header in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col, value=header)
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+        cell.border = Border(
+            left=Side(style='thin'),
+            right=Side(style='thin'),
+            top=Side(style='thin'),
+            bottom=Side(style='thin')
+        )
+
+    # Заполняем данные
+    products_count = 0
+    for row_idx, product in enumerate(db.iter_products_with_history(), 2):
+        products_count += 1
+        # Основная информация о товаре
+        ws.cell(row=row_idx, column=1, value=product['name'])
+        ws.cell(row=row_idx, column=2, value=product['url'])
+        ws.cell(row=row_idx, column=3, value=product['category'])
+
+        # Метрики продажів
+        product_stats = stats.for_product(product['id']) or {}
+        for col, key in enumerate(EXPORT_STATS_HEADERS.values(), 4):
+            value = product_stats.get(key)
+            cell = ws.cell(row=row_idx, column=col, value=value if value is not None else '')
+            cell.alignment = Alignment(horizontal="center", vertical="center")
+
+        # Заполняем данные по датам
+        previous_stock = None
+        col_idx = first_date_col
+
+        for date in sorted_dates:
+            current_stock = product['history'].get(date, '')
+
+            # Колонка количества
+            stock_cell = ws.cell(row=row_idx, column=col_idx, value=current_stock)
+            stock_cell.alignment = Alignment(horizontal="center", vertical="center")
+            stock_cell.border = Border(
+                left=Side(style='thin'),
+                right=Side(style='thin'),
+                top=Side(style='thin'),
+                bottom=Side(style='thin')
+            )
+
+            # Цветовое кодирование для количества
+            if current_stock and current_stock > 0:
+                stock_cell.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
+            elif current_stock == 0:
+                stock_cell.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+
+            # Колонка изменений
+            change_cell = ws.cell(row=row_idx, column=col_idx + 1)
+            change_cell.alignment = Alignment(horizontal="center", vertical="center")
+            change_cell.border = Border(
+                left=Side(style='thin'),
+                right=Side(style='thin'),
+                top=Side(style='thin'),
+                bottom=Side(style='thin')
+            )
+
+            # Вычисляем изменения
+            if previous_stock is not None and current_stock != '' and previous_stock != '':
+                try:
+                    change = int(current_stock) - int(previous_stock)
+                    if change != 0:
+                        change_cell.value = change
+                        # Цветовое кодирование для изменений
+                        if change > 0:
+                            change_cell.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
+                            change_cell.font = Font(color="006100", bold=True)
+                        else:
+                            change_cell.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+                            change_cell.font = Font(color="9C0006", bold=True)
+                except (ValueError, TypeError):
+                    pass
+
+            # Обновляем previous_stock для следующей итерации
+            if current_stock != '':
+                previous_stock = current_stock
+
+            col_idx += 2
+
+    # Настройка ширины столбцов
+    ws.column_dimensions['A'].width = 40  # Товар
+    ws.column_dimensions['B'].width = 60  # URL
+    ws.column_dimensions['C'].width = 25  # Категория
+    for col in range(4, first_date_col):
+        ws.column_dimensions[openpyxl.utils.get_column_letter(col)].width = 14  # Метрики
+
+    # Для колонок с датами и изменениями
+    col_idx = first_date_col
+    for _ in sorted_dates:
+        col_letter_qty = openpyxl.utils.get_column_letter(col_idx)
+        col_letter_change = openpyxl.utils.get_column_letter(col_idx + 1)
+        ws.column_dimensions[col_letter_qty].width = 12    # Количество
+        ws.column_dimensions[col_letter_change].width = 10  # Изменения
+        col_idx += 2
+
+    # Высота строк
+    ws.row_dimensions[1].height = 30  # Заголовок
+    for row in range(2, products_count + 2):
+        ws.row_dimensions[row].height = 25
+
+    # Закрепляем первые строки и столбцы
+    ws.freeze_panes = f"{openpyxl.utils.get_column_letter(first_date_col)}2"
+
+    # Автофильтр
+    max_row = products_count + 1
+    max_col = len(headers)
+    ws.auto_filter.ref = f"A1:{openpyxl.utils.get_column_letter(max_col)}{max_row}"
+
+    wb.save(filepath)
+    return products_count
+
+
+def legacy_save_excel(path: str, data_list):
+    """tg.save_excel_with_formatting до переходу на write-only режим"""
+    if not data_list:
+        print("[ПОПЕРЕДЖЕННЯ] Список даних порожній, створюємо файл тільки з заголовками")
+        data_list = []
+    
+    products_history = {}
+    all_dates = set()
+    
+    for row in data_list:
+        url = row.get('url', '')
+        if url not in products_history:
+            products_history[url] = {
+                'name': row.get('name', ''),
+                'category': row.get('category', ''),
+                'url': url,
+                'dates': {}
+            }
+        
+        date = row.get('last_checked', '')
+        if date:
+            date_only = date.split(' ')[0] if ' ' in date else date
+            products_history[url]['dates'][date_only] = row.get('max_stock', 0)
+            all_dates.add(date_only)
+    
+    sorted_dates = sorted(list(all_dates))
+    
+    from openpyxl import Workbook
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Істория залишків"
+
+    headers = ["Назва", "URL", "Категорія"] + sorted_dates
+    for col_num, header in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col_num, value=header)
+        
+        cell.font = Font(name='Arial', size=12, bold=True, color='FFFFFF')
+        cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
+        cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
+        cell.border = Border(
+            left=Side(style='thin'),
+            right=Side(style='thin'),
+            top=Side(style='thin'),
+            bottom=Side(style='thin')
+        )
+
+    row_num = 2
+    for product_data in products_history.values():
+        cell = ws.cell(row=row_num, column=1, value=product_data['name'])
+        cell.font = Font(name='Arial', size=11)
+        cell.alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
+        cell.border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+        
+        cell = ws.cell(row=row_num, column=2, value=product_data['url'])
+        cell.font = Font(name='Arial', size=11)
+        cell.alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
+        cell.border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+        
+        cell = ws.cell(row=row_num, column=3, value=product_data['category'])
+        cell.font = Font(name='Arial', size=11)
+        cell.alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
+        cell.border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+        
+        for col_idx, date in enumerate(sorted_dates, 4):
+            stock_value = product_data['dates'].get(date, '')
+            cell = ws.cell(row=row_num, column=col_idx, value=stock_value)
+            
+            cell.font = Font(name='Arial', size=11)
+            cell.alignment = Alignment(horizontal='center', vertical='center')
+            cell.border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+            
+            if stock_value and stock_value > 0:
+                cell.fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
+            elif stock_value == 0:
+                cell.fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
+            
+            if row_num % 2 == 0:
+                if not cell.fill.start_color or cell.fill.start_color.rgb == '00000000':
+                    cell.fill = PatternFill(start_color='F2F2F2', end_color='F2F2F2', fill_type='solid')
+        
+        row_num += 1
+
+    ws.column_dimensions['A'].width = 40
+    ws.column_dimensions['B'].width = 60
+    ws.column_dimensions['C'].width = 25
+    
+    for col_idx in range(4, len(headers) + 1):
+        col_letter = openpyxl.utils.get_column_letter(col_idx)
+        ws.column_dimensions[col_letter].width = 12
+
+    for row in ws.iter_rows():
+        ws.row_dimensions[row[0].row].height = 25
+
+    ws.freeze_panes = 'A2'
+    
+    max_row = len(products_history) + 1
+    max_col = len(headers)
+    ws.auto_filter.ref = f"A1:{openpyxl.utils.get_column_letter(max_col)}{max_row}"
+
+    try:
+        wb.save(path)
+    except Exception as e:
+        print(f"[ОШИБКА] Не удалось сохранить Excel файл: {e}")
+        raise
+
+
+def history_rows(db: DatabaseManager):
+    """Історія у форматі рядків save_excel_with_formatting (по рядку на замір)"""
+    cursor = db._connection().execute("""
+        SELECT p.name, p.url, p.category, sh.check_date, sh.stock_count
+        FROM stock_history sh JOIN products p ON p.id = sh.product_id
+        ORDER BY p.name, p.id, sh.check_date
+    """)
+    return [{'name': name, 'url': url, 'category': category or '', 'last_checked': check_date, 'max_stock': stock}
+            for name, url, category, check_date, stock in cursor]
+
+
+def prepare_update(db: DatabaseManager, path: str, new_check: bool = True):
+    """Стан перед export_to_excel: файл історії з індексом і (new_check) в базі - нова перевірка всіх товарів"""
+    ExcelHistory(path).rebuild(history_rows(db))
+    if not new_check:
+        return
+    checked_at = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+    db.save_check_results(stocks=[(product['id'], product['last_stock'] + 1, checked_at)
+                                  for product in db.get_products()])
+
+
+def update_items(db: DatabaseManager):
+    """Результати останньої перевірки у форматі export_to_excel"""
+    return [{'title': product['name'], 'url': product['url'], 'category': product['category'],
+             'last_checked': product['last_check'], 'max_stock': product['last_stock']}
+            for product in db.get_products()]
+
+
+# Реалізації, що порівнюються: назва -> функція побудови (rows - історія для history-*,
+# результати перевірки для update-*)
+EXCEL_IMPLEMENTATIONS = {
+    'export-legacy': lambda db, path, rows: legacy_history_workbook(db, path),
+    'export-streaming': lambda db, path, rows: write_history_workbook(db, path),
+    'history-legacy': lambda db, path, rows: legacy_save_excel(path, rows),
+    'history-streaming': lambda db, path, rows: save_excel_with_formatting(path, rows),
+    # Оновлення існуючого файлу після перевірки: злиття з існуючим файлом (ExcelHistory.rebuild) проти запису з бази (ExcelHistory.update з source)
+    'update-rebuild': lambda db, path, rows: ExcelHistory(path).rebuild(excel_rows(rows)),
+    'update-db': lambda db, path, rows: ExcelHistory(path).update(rows, source=db.excel_history_source),
+    # Повторний експорт без нових замірів (наприклад, після /export): індекс бачить, що змін немає
+    'update-unchanged': lambda db, path, rows: ExcelHistory(path).update(rows, source=db.excel_history_source),
+}
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_excel_run(args):
+    """Одна реалізація в окремому процесі, щоб пік RSS не змішувався між реалізаціями"""
+    db = DatabaseManager(args.db)
+    rows = None
+    if args.impl.startswith('history'):
+        rows = history_rows(db)
+    elif args.impl.startswith('update'):
+        rows = update_items(db)
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    EXCEL_IMPLEMENTATIONS[args.impl](db, args.out, rows)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        'impl': args.impl,
+        'seconds': elapsed,
+        'peak_rss_mb': peak_rss_mb(),
+        'build_rss_mb': peak_rss_mb() - baseline,
+        'size_mb': os.path.getsize(args.out) / 1024 / 1024,
+    }))
+
+
+def bench_excel_prepare(args):
+    db = DatabaseManager(args.db)
+    prepare_update(db, args.out, new_check=args.impl != 'update-unchanged')
+    db.close()
+
+
+def bench_excel(args):
+    workdir = tempfile.mkdtemp(prefix="rozetka_bench_")
+    try:
+        path = os.path.join(workdir, "bench.db")
+        print(f"Створюємо базу: {args.products} товарів x {args.days} днів...")
+        build_database(path, args.products, args.days).close()
+
+        results = {}
+        for impl in args.impl or EXCEL_IMPLEMENTATIONS:
+            out = os.path.join(workdir, f"{impl}.xlsx")
+            impl_db = path
+            if impl.startswith('update'):
+                # Підготовка - окремим процесом: пік RSS (ru_maxrss) успадковується через exec
+                impl_db = os.path.join(workdir, f"{impl}.db")
+                shutil.copy(path, impl_db)
+                subprocess.run([sys.executable, os.path.abspath(__file__), "excel-prepare", impl, impl_db, out],
+                               check=True, capture_output=True)
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "excel-run", impl, impl_db, out],
+                capture_output=True, text=True, check=True
+            )
+            results[impl] = json.loads(completed.stdout.strip().splitlines()[-1])
+            r = results[impl]
+            print(f"{impl:18} {r['seconds']:7.1f} с  пік RSS {r['peak_rss_mb']:7.0f} МБ "
+                  f"(+{r['build_rss_mb']:.0f} МБ на побудову)  файл {r['size_mb']:.1f} МБ")
+
+        for kind, old, new in (('export', 'legacy', 'streaming'), ('history', 'legacy', 'streaming'),
+                               ('update', 'rebuild', 'db')):
+            legacy, streaming = results.get(f"{kind}-{old}"), results.get(f"{kind}-{new}")
+            if legacy and streaming:
+                print(f"{kind}: швидше у x{legacy['seconds'] / streaming['seconds']:.1f}, "
+                      f"пам'ять на побудову {legacy['build_rss_mb']:.0f} -> {streaming['build_rss_mb']:.0f} МБ")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_cli():
+    p = argparse.ArgumentParser(description="Бенчмарки Rozetka stock bot")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    latest = sub.add_parser("latest", help="Останні залишки товарів: get_products")
+    latest.add_argument("--products", type=int, default=10000)
+    latest.add_argument("--days", type=int, default=365)
+    latest.add_argument("--repeat", type=int, default=5)
+    latest.set_defaults(func=bench_latest)
+
+    excel = sub.add_parser("excel", help="Excel-експорт: write-only режим проти старої реалізації (час і RSS)")
+    excel.add_argument("--products", type=int, default=2000)
+    excel.add_argument("--days", type=int, default=180)
+    excel.add_argument("--impl", action="append", choices=list(EXCEL_IMPLEMENTATIONS),
+                       help="Реалізація для запуску (можна кілька разів, за замовчуванням усі)")
+    excel.set_defaults(func=bench_excel)
+
+    # Внутрішня команда: одна реалізація в окремому процесі
+    excel_run = sub.add_parser("excel-run")
+    excel_run.add_argument("impl", choices=list(EXCEL_IMPLEMENTATIONS))
+    excel_run.add_argument("db")
+    excel_run.add_argument("out")
+    excel_run.set_defaults(func=bench_excel_run)
+
+    excel_prepare = sub.add_parser("excel-prepare")
+    excel_prepare.add_argument("impl", choices=list(EXCEL_IMPLEMENTATIONS))
+    excel_prepare.add_argument("db")
+    excel_prepare.add_argument("out")
+    excel_prepare.set_defaults(func=bench_excel_prepare)
+
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_cli()
+    args.func(args)
@@ -1,10 +1,15 @@
 import asyncio
+import hashlib
+import html
 import logging
+import multiprocessing
 import os
 import re
 import sqlite3
-from datetime import datetime, time
-from typing import List, Dict, Optional
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+from typing import List, Dict, Iterator, Optional, Tuple
 import tempfile
 import openpyxl.utils
 
@@ -16,14 +21,15 @@ from aiogram import Bot, Dispatcher, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.types import FSInputFile
 
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.storage.memory import MemoryStorage
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
 
-from tg import RozetkaStockChecker, load_existing_excel, save_excel_with_formatting, upsert_rows, EXCEL_FILENAME
+from analytics import StockMatrix, SalesStats, HistoryBuckets, DEFAULT_WINDOW, DEFAULT_HISTORY_DAYS, HISTORY_PERIODS
+from tg import RozetkaStockChecker, SessionPool, StockCheckEngine, CategoryIndex, RateLimiter, SESSION_FILENAME, CATEGORY_INDEX_FILENAME, load_existing_excel, ExcelHistory, EXCEL_FILENAME, export_history_stream, HISTORY_EXPORT_FORMATS, create_streaming_workbook, excel_cell, excel_stock_style, setup_excel_sheet, bucket_headers, bucket_cells
 
 # Налаштування логування
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +38,38 @@ logger = logging.getLogger(__name__)
 # Токен бота (завантажується з .env)
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Кількість паралельних воркерів перевірки (кожен зі своєю сесією корзини)
+CHECK_WORKERS = int(os.getenv("CHECK_WORKERS", "4"))
+# Кількість товарів, що перевіряються разом в одній корзині
+CHECK_BATCH_SIZE = int(os.getenv("CHECK_BATCH_SIZE", "1"))
+# Скільки результатів перевірки записувати в базу однією транзакцією
+SAVE_BATCH_SIZE = int(os.getenv("SAVE_BATCH_SIZE", "200"))
+
+# Процеси для побудови Excel-файлів (поза event loop) і як часто показувати прогрес, с
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_PROGRESS_INTERVAL = 5
+# Готові файли /export, підписані версією даних (підкаталог на кожну базу); скільки останніх версій тримати
+EXPORT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "rozetka_export_cache")
+EXPORT_CACHE_KEEP = 2
+
+# Товарів на сторінці /list і /remove; дані кнопок навігації: page:<вид>:<напрям>:<id товару>
+PRODUCTS_PAGE_SIZE = 10
+PAGE_CALLBACK_RE = re.compile(r'page:(list|remove):(prev|next):(\d+)')
+
+# /stats <id>: за скільки годин і скільки останніх змін залишку показувати
+SAMPLES_HOURS = 24
+SAMPLES_SHOWN = 30
+
+# Довжина одного повідомлення з HTML-розміткою (ліміт Telegram 4096)
+MESSAGE_LIMIT = 4000
+
+# Колонки метрик продажів у /export: заголовок -> ключ SalesStats.row
+EXPORT_STATS_HEADERS = {
+    "Продажі\nшт./день": 'velocity',
+    "Поповнень\nза вікно": 'restocks',
+    "Днів\nдо нуля": 'days_to_stockout',
+}
+
 
 # Визначення станів для FSM
 class BotStates(StatesGroup):
@@ -40,17 +78,111 @@ class BotStates(StatesGroup):
 
 # Покращений клас для роботи з Rozetka
 class ImprovedRozetkaChecker(RozetkaStockChecker):
-    def __init__(self, debug=False, delay=2):
-        super().__init__(debug, delay)
+    def __init__(self, debug=False, delay=2, session_pool=None, db: Optional["DatabaseManager"] = None,
+                 category_index=None, rate_limiter=None, breakers=None):
+        super().__init__(debug, delay, session_pool, category_index, rate_limiter, breakers)
+        self.db = db
+
+    def get_cached_category(self, category_id):
+        """Назва категорії з кешу в пам'яті, а потім з бази даних"""
+        name = super().get_cached_category(category_id)
+        if name is None and self.db is not None:
+            name = self.db.get_category_name(category_id)
+            if name:
+                self.category_names[category_id] = name
+        return name
+
+    def cache_category(self, category_id, name):
+        super().cache_category(category_id, name)
+        if self.db is not None:
+            self.db.save_category_name(category_id, name)
 
 # Виправлений клас для роботи з базою даних
 class DatabaseManager:
-    def __init__(self, db_path: str = "rozetka_bot.db"):
+    # Справжній upsert: існуючі рядки оновлюються на місці, id не змінюються, а незмінені
+    # не чіпаються (інакше тригер збільшить data_version). Назва не буває NULL - сторінки /list
+    # порівнюють пари (name, id)
+    UPSERT_PRODUCT_SQL = """
+        INSERT INTO products (url, name, category, added_date)
+        VALUES (?1, COALESCE(?2, ''), ?3, CURRENT_DATE)
+        ON CONFLICT(url) DO UPDATE SET
+            name = excluded.name,
+            category = excluded.category
+        WHERE name IS NOT excluded.name OR category IS NOT excluded.category
+    """
+    # Оновлення назви/категорії після перевірки - лише за id: видалений під час прогону товар
+    # не створюється заново
+    UPDATE_PRODUCT_SQL = """
+        UPDATE products SET name = COALESCE(?2, ''), category = ?3
+        WHERE id = ?1 AND (name IS NOT COALESCE(?2, '') OR category IS NOT ?3)
+    """
+    # Денний підсумок: stock_count - останній замір дня, min/max - межі за день
+    # (NULL у записах до появи колонок означає "дорівнює stock_count").
+    # Заміри товарів, видалених під час прогону, відкидаються
+    UPSERT_STOCK_SQL = """
+        INSERT INTO stock_history (product_id, check_date, stock_count, min_stock, max_stock)
+        SELECT ?1, ?2, ?3, ?3, ?3
+        WHERE EXISTS (SELECT 1 FROM products WHERE id = ?1)
+        ON CONFLICT(product_id, check_date) DO UPDATE SET
+            stock_count = excluded.stock_count,
+            min_stock = MIN(COALESCE(min_stock, stock_count), excluded.stock_count),
+            max_stock = MAX(COALESCE(max_stock, stock_count), excluded.stock_count)
+        WHERE stock_count IS NOT excluded.stock_count OR min_stock IS NULL OR max_stock IS NULL
+    """
+    # Внутрішньоденні заміри: зберігаються лише ті, що відрізняються від попереднього
+    INSERT_SAMPLE_SQL = """
+        INSERT INTO stock_samples (product_id, checked_at, stock_count)
+        SELECT ?1, ?2, ?3
+        WHERE ?3 IS NOT (SELECT stock_count FROM stock_samples
+                         WHERE product_id = ?1 AND checked_at <= ?2
+                         ORDER BY checked_at DESC LIMIT 1)
+          AND EXISTS (SELECT 1 FROM products WHERE id = ?1)
+        ON CONFLICT(product_id, checked_at) DO UPDATE SET stock_count = excluded.stock_count
+    """
+
+    def __init__(self, db_path: str = "rozetka_bot.db", init_schema: bool = True):
         self.db_path = db_path
-        self.init_database()
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # Процеси експорту працюють з уже створеною схемою і лише читають
+        if init_schema:
+            self.init_database()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Довготривале з'єднання поточного потоку (event loop і воркери мають власні).
+
+        WAL дозволяє читати (/list, /export) паралельно із записом результатів перевірки.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-16000")
+            conn.execute("PRAGMA busy_timeout=30000")
+            # lower() SQLite змінює лише латиницю, для пошуку по назвах потрібен повний Unicode
+            conn.create_function("casefold", 1, lambda value: value.casefold() if value else value,
+                                 deterministic=True)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """Закриває з'єднання всіх потоків"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
 
     def init_database(self):
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connection()
         cursor = conn.cursor()
 
         # Таблица продуктов (убираем last_stock и last_check)
@@ -76,6 +208,108 @@ class DatabaseManager:
             )
         """)
 
+        # Колонки min/max з'явилися разом з stock_samples - додаємо в старі бази
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(stock_history)")}
+        for column in ("min_stock", "max_stock"):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE stock_history ADD COLUMN {column} INTEGER")
+
+        # Заміри протягом дня (unix-час), тільки зміни залишку
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stock_samples (
+                product_id INTEGER NOT NULL,
+                checked_at INTEGER NOT NULL,
+                stock_count INTEGER,
+                PRIMARY KEY (product_id, checked_at)
+            ) WITHOUT ROWID
+        """)
+
+        # Останній замір кожного товару, підтримується тригерами на stock_history
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS latest_stock (
+                product_id INTEGER PRIMARY KEY,
+                check_date DATE,
+                stock_count INTEGER
+            )
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS stock_history_latest_insert
+            AFTER INSERT ON stock_history
+            BEGIN
+                INSERT INTO latest_stock (product_id, check_date, stock_count)
+                VALUES (NEW.product_id, NEW.check_date, NEW.stock_count)
+                ON CONFLICT(product_id) DO UPDATE SET
+                    check_date = excluded.check_date,
+                    stock_count = excluded.stock_count
+                WHERE excluded.check_date >= latest_stock.check_date;
+            END
+        """)
+        # Без OR REPLACE: у тригері його перекриває ON CONFLICT зовнішнього upsert
+        cursor.execute("DROP TRIGGER IF EXISTS stock_history_latest_update")
+        cursor.execute("""
+            CREATE TRIGGER stock_history_latest_update
+            AFTER UPDATE ON stock_history
+            BEGIN
+                DELETE FROM latest_stock WHERE product_id IN (OLD.product_id, NEW.product_id);
+                INSERT INTO latest_stock (product_id, check_date, stock_count)
+                SELECT product_id, check_date, stock_count FROM stock_history
+                WHERE product_id = OLD.product_id ORDER BY check_date DESC LIMIT 1;
+                INSERT INTO latest_stock (product_id, check_date, stock_count)
+                SELECT product_id, check_date, stock_count FROM stock_history
+                WHERE product_id = NEW.product_id AND NEW.product_id != OLD.product_id
+                ORDER BY check_date DESC LIMIT 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS stock_history_latest_delete
+            AFTER DELETE ON stock_history
+            BEGIN
+                DELETE FROM latest_stock WHERE product_id = OLD.product_id;
+                INSERT INTO latest_stock (product_id, check_date, stock_count)
+                SELECT product_id, check_date, stock_count FROM stock_history
+                WHERE product_id = OLD.product_id ORDER BY check_date DESC LIMIT 1;
+            END
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_name ON products (name, id)")
+        cursor.execute("UPDATE products SET name = '' WHERE name IS NULL")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_history_date ON stock_history (check_date)")
+
+        # Лічильник версії даних: збільшується тригерами при кожній зміні товарів чи історії,
+        # ним підписуються кешовані файли /export
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS data_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        """)
+        cursor.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+        for table in ("products", "stock_history"):
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()}
+                    AFTER {event} ON {table}
+                    BEGIN
+                        UPDATE data_version SET version = version + 1 WHERE id = 1;
+                    END
+                """)
+
+        # Заповнюємо latest_stock для бази, створеної до появи таблиці
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM latest_stock)")
+        if not cursor.fetchone()[0]:
+            cursor.execute("""
+                INSERT INTO latest_stock (product_id, check_date, stock_count)
+                SELECT product_id, MAX(check_date), stock_count FROM stock_history GROUP BY product_id
+            """)
+
+        # Кеш назв категорій (category_id Rozetka -> назва)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS categories (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                updated_date DATE DEFAULT CURRENT_DATE
+            )
+        """)
+
         # Таблица настроек
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS settings (
@@ -85,233 +319,357 @@ class DatabaseManager:
         """)
 
         conn.commit()
-        conn.close()
 
     def add_product(self, url: str, name: str = "", category: str = "") -> bool:
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT OR REPLACE INTO products (url, name, category, added_date) 
-                VALUES (?, ?, ?, CURRENT_DATE)
-            """, (url, name, category))
-            conn.commit()
-            conn.close()
+            with self._connection() as conn:
+                conn.execute(self.UPSERT_PRODUCT_SQL, (url, name, category))
             return True
         except Exception as e:
             logger.error(f"Помилка додавання товару: {e}")
             return False
 
+    def get_data_version(self) -> int:
+        """Номер версії даних products/stock_history (змінюється при кожному записі)"""
+        return self._connection().execute("SELECT version FROM data_version WHERE id = 1").fetchone()[0]
+
+    def count_products(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
     def get_product_id_by_url(self, url: str) -> Optional[int]:
         """Отримати ID товару по URL"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM products WHERE url = ?", (url,))
+        cursor = self._connection().execute("SELECT id FROM products WHERE url = ?", (url,))
         result = cursor.fetchone()
-        conn.close()
         return result[0] if result else None
 
     def update_product_stock(self, product_id: int, stock_count: int):
         """Обновить остатки товара на текущую дату"""
-        try:
-            logger.info(f"[DB] Начинаем обновление остатков: product_id={product_id}, stock_count={stock_count}")
-
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+        return self.save_check_results(stocks=[(product_id, stock_count, datetime.now())])
 
-            # Проверяем, существует ли товар
-            cursor.execute("SELECT id, name FROM products WHERE id = ?", (product_id,))
-            product = cursor.fetchone()
-            if not product:
-                logger.error(f"[DB] Товар с ID {product_id} не найден в базе данных")
-                conn.close()
-                return False
-
-            logger.info(f"[DB] Товар найден: ID={product[0]}, Name='{product[1]}'")
-
-            today = datetime.now().strftime('%Y-%m-%d')
-            logger.info(f"[DB] Текущая дата: {today}")
-
-            # Проверяем, есть ли уже запись на сегодня
-            cursor.execute("SELECT stock_count FROM stock_history WHERE product_id = ? AND check_date = ?",
-                           (product_id, today))
-            existing = cursor.fetchone()
-
-            if existing:
-                logger.info(
-                    f"[DB] Найдена существующая запись на {today}: old_stock={existing[0]}, new_stock={stock_count}")
-            else:
-                logger.info(f"[DB] Новая запись на {today}: stock={stock_count}")
-
-            # Добавляем или обновляем запись в истории
-            cursor.execute("""
-                INSERT OR REPLACE INTO stock_history (product_id, check_date, stock_count) 
-                VALUES (?, ?, ?)
-            """, (product_id, today, stock_count))
+    def save_check_results(self, products=(), stocks=()) -> bool:
+        """Записати результати перевірки однією транзакцією.
 
-            affected_rows = cursor.rowcount
-            logger.info(f"[DB] Затронуто строк: {affected_rows}")
-
-            conn.commit()
-            conn.close()
-
-            logger.info(f"[DB] ✅ УСПЕШНО обновлены остатки для товара {product_id}: {stock_count}")
+        products - кортежі (product_id, name, category), stocks - кортежі (product_id, stock_count, checked_at),
+        де checked_at - datetime заміру. Кожен замір оновлює денний підсумок у stock_history
+        і, якщо залишок змінився, додається в stock_samples. Записи товарів, яких уже немає
+        в products (видалені під час перевірки), пропускаються.
+        """
+        try:
+            with self._connection() as conn:
+                if products:
+                    conn.executemany(self.UPDATE_PRODUCT_SQL, products)
+                if stocks:
+                    conn.executemany(self.UPSERT_STOCK_SQL,
+                                     ((product_id, checked_at.strftime('%Y-%m-%d'), stock)
+                                      for product_id, stock, checked_at in stocks))
+                    conn.executemany(self.INSERT_SAMPLE_SQL,
+                                     ((product_id, int(checked_at.timestamp()), stock)
+                                      for product_id, stock, checked_at in stocks))
+            logger.debug(f"[DB] Збережено: товарів {len(products)}, залишків {len(stocks)}")
             return True
-
         except Exception as e:
-            logger.error(f"[DB] ❌ ОШИБКА обновления остатков для товара {product_id}: {e}")
-            import traceback
-            logger.error(f"[DB] Полный traceback: {traceback.format_exc()}")
-            try:
-                conn.close()
-            except:
-                pass
+            logger.error(f"[DB] Помилка збереження результатів перевірки: {e}")
             return False
 
+    PRODUCTS_SELECT_SQL = """
+        SELECT p.id, p.url, p.name, p.category, ls.stock_count, ls.check_date
+        FROM products p
+        LEFT JOIN latest_stock ls ON ls.product_id = p.id
+    """
+
+    @staticmethod
+    def _product_row(row) -> Dict:
+        return {
+            "id": row[0], 
+            "url": row[1], 
+            "name": row[2] or "Без названия", 
+            "category": row[3] or "Без категории",
+            "last_stock": row[4] or 0,
+            "last_check": row[5] or "Никогда"
+        }
+
     def get_products(self) -> List[Dict]:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT p.id, p.url, p.name, p.category,
-                (SELECT stock_count FROM stock_history sh 
-                    WHERE sh.product_id = p.id 
-                    ORDER BY sh.check_date DESC LIMIT 1) as last_stock,
-                (SELECT check_date FROM stock_history sh 
-                    WHERE sh.product_id = p.id 
-                    ORDER BY sh.check_date DESC LIMIT 1) as last_check
-            FROM products p
-            ORDER BY p.name
-        """)
-        products = []
-        for row in cursor.fetchall():
-            products.append({
-                "id": row[0], 
-                "url": row[1], 
-                "name": row[2] or "Без названия", 
-                "category": row[3] or "Без категории",
-                "last_stock": row[4] or 0,
-                "last_check": row[5] or "Никогда"
-            })
-        conn.close()
-        return products
+        cursor = self._connection().execute(self.PRODUCTS_SELECT_SQL + " ORDER BY p.name")
+        return [self._product_row(row) for row in cursor.fetchall()]
+
+    def get_products_page(self, after_id: Optional[int] = None, before_id: Optional[int] = None,
+                          search: Optional[str] = None,
+                          limit: int = PRODUCTS_PAGE_SIZE) -> Tuple[List[Dict], bool, bool]:
+        """Сторінка товарів у порядку (назва, id): наступна після after_id або попередня перед before_id.
+
+        Keyset-пагінація по idx_products_name - читається лише сторінка, без OFFSET.
+        search - підрядок назви без урахування регістру. Якщо товар-курсор уже видалено,
+        повертається перша сторінка. Повертає (товари, є попередня, є наступна).
+        """
+        conn = self._connection()
+        cursor_id = after_id if after_id is not None else before_id
+        cursor_row = None
+        if cursor_id is not None:
+            cursor_row = conn.execute("SELECT name, id FROM products WHERE id = ?", (cursor_id,)).fetchone()
+
+        conditions, params = [], []
+        if search:
+            conditions.append("instr(casefold(p.name), ?) > 0")
+            params.append(search.casefold())
+        backward = cursor_row is not None and after_id is None
+        if cursor_row is not None:
+            conditions.append("(p.name, p.id) < (?, ?)" if backward else "(p.name, p.id) > (?, ?)")
+            params.extend(cursor_row)
+
+        sql = self.PRODUCTS_SELECT_SQL
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY p.name DESC, p.id DESC" if backward else " ORDER BY p.name, p.id"
+        rows = conn.execute(sql + " LIMIT ?", params + [limit + 1]).fetchall()
+
+        if not rows and cursor_row is not None:
+            return self.get_products_page(search=search, limit=limit)
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+            return [self._product_row(row) for row in rows], more, True
+        return [self._product_row(row) for row in rows], cursor_row is not None, more
+
+    def count_products_matching(self, search: str) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM products WHERE instr(casefold(name), ?) > 0", (search.casefold(),)
+        ).fetchone()[0]
 
     def remove_product_by_id(self, product_id: int) -> bool:
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM stock_history WHERE product_id = ?", (product_id,))
-            cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
-            conn.commit()
-            conn.close()
+            with self._connection() as conn:
+                conn.execute("DELETE FROM stock_samples WHERE product_id = ?", (product_id,))
+                conn.execute("DELETE FROM stock_history WHERE product_id = ?", (product_id,))
+                conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
             return True
         except Exception as e:
             logger.error(f"Помилка видалення товару: {e}")
             return False
 
 
-    def get_products_with_history(self) -> List[Dict]:
-        """Получить товары с историей по всем датам"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Получаем все уникальные даты
-        cursor.execute("SELECT DISTINCT check_date FROM stock_history ORDER BY check_date")
-        all_dates = [row[0] for row in cursor.fetchall()]
-        
-        # Получаем товары с историей
-        cursor.execute("""
-            SELECT p.id, p.name, p.url, p.category
+    def get_stock_samples(self, product_id: int, since: Optional[datetime] = None) -> List[tuple]:
+        """Внутрішньоденні зміни залишку товару: [(datetime, stock_count), ...] за зростанням часу"""
+        since_ts = int(since.timestamp()) if since else 0
+        cursor = self._connection().execute("""
+            SELECT checked_at, stock_count FROM stock_samples
+            WHERE product_id = ? AND checked_at >= ?
+            ORDER BY checked_at
+        """, (product_id, since_ts))
+        return [(datetime.fromtimestamp(checked_at), stock) for checked_at, stock in cursor]
+
+    def load_sales_stats(self, window: int = DEFAULT_WINDOW, days: Optional[int] = DEFAULT_HISTORY_DAYS) -> SalesStats:
+        """Метрики продажів по всьому каталогу (див. analytics)"""
+        return SalesStats(StockMatrix.from_db(self._connection(), days), window)
+
+    def load_history_buckets(self, period: str) -> HistoryBuckets:
+        """Вся історія, зведена по тижнях або місяцях (див. analytics)"""
+        return HistoryBuckets(StockMatrix.from_db(self._connection(), days=None), period)
+
+    def iter_products(self) -> Iterator[Dict]:
+        """Товари без історії в порядку таблиць (назва, id)"""
+        cursor = self._connection().execute("SELECT id, name, url, category FROM products ORDER BY name, id")
+        for product_id, name, url, category in cursor:
+            yield {'id': product_id, 'name': name or 'Без названия', 'url': url, 'category': category or 'Без категории'}
+
+    def get_history_dates(self) -> List[str]:
+        """Усі дати, на які є заміри, за зростанням"""
+        cursor = self._connection().execute("SELECT DISTINCT check_date FROM stock_history ORDER BY check_date")
+        return [row[0] for row in cursor]
+
+    def iter_products_with_history(self) -> Iterator[Dict]:
+        """Товари з історією по всім датам - по одному товару за раз.
+
+        Одне впорядковане читання products JOIN stock_history по індексах, тож пам'ять
+        не залежить від розміру каталогу.
+        """
+        cursor = self._connection().execute("""
+            SELECT p.id, p.name, p.url, p.category, sh.check_date, sh.stock_count
             FROM products p
-            ORDER BY p.name
+            LEFT JOIN stock_history sh ON sh.product_id = p.id
+            ORDER BY p.name, p.id, sh.check_date
         """)
-        
-        products_data = []
-        for product_row in cursor.fetchall():
-            product_id, name, url, category = product_row
-            
-            # Получаем историю остатков для этого товара
-            cursor.execute("""
-                SELECT check_date, stock_count 
-                FROM stock_history 
-                WHERE product_id = ? 
-                ORDER BY check_date
-            """, (product_id,))
-            
-            history = dict(cursor.fetchall())
-            
-            product_data = {
-                'name': name or 'Без названия',
-                'url': url,
-                'category': category or 'Без категории',
-                'history': history,
-                'all_dates': all_dates
-            }
-            products_data.append(product_data)
-        
-        conn.close()
-        return products_data
-
 
+        current_id = None
+        product_data = None
+        for product_id, name, url, category, check_date, stock_count in cursor:
+            if product_id != current_id:
+                if product_data is not None:
+                    yield product_data
+                current_id = product_id
+                product_data = {
+                    'id': product_id,
+                    'name': name or 'Без названия',
+                    'url': url,
+                    'category': category or 'Без категории',
+                    'history': {}
+                }
+            if check_date is not None:
+                product_data['history'][check_date] = stock_count
+
+        if product_data is not None:
+            yield product_data
 
     def get_product_by_id(self, product_id: int) -> Optional[Dict]:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, url, name, category FROM products WHERE id = ?", (product_id,))
+        cursor = self._connection().execute("SELECT id, url, name, category FROM products WHERE id = ?", (product_id,))
         result = cursor.fetchone()
-        conn.close()
         
         if result:
             return {"id": result[0], "url": result[1], "name": result[2], "category": result[3]}
         return None
 
-    def get_schedule_time(self) -> Optional[str]:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT value FROM settings WHERE key = 'schedule_time'")
+    def get_category_name(self, category_id: int) -> Optional[str]:
+        """Назва категорії з кешу categories"""
+        cursor = self._connection().execute("SELECT name FROM categories WHERE id = ?", (category_id,))
         result = cursor.fetchone()
-        conn.close()
         return result[0] if result else None
 
-    def set_schedule_time(self, time_str: str):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('schedule_time', ?)", (time_str,))
-        conn.commit()
-        conn.close()
+    def save_category_name(self, category_id: int, name: str):
+        try:
+            with self._connection() as conn:
+                conn.execute("""
+                    INSERT INTO categories (id, name, updated_date) VALUES (?, ?, CURRENT_DATE)
+                    ON CONFLICT(id) DO UPDATE SET name = excluded.name, updated_date = excluded.updated_date
+                """, (category_id, name))
+        except Exception as e:
+            logger.error(f"Помилка збереження категорії {category_id}: {e}")
 
-    def sync_with_excel(self):
-        """Синхронізація з Excel файлом"""
+    def get_setting(self, key: str) -> Optional[str]:
+        cursor = self._connection().execute("SELECT value FROM settings WHERE key = ?", (key,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    def set_setting(self, key: str, value: str):
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+
+    def get_schedule_time(self) -> Optional[str]:
+        return self.get_setting('schedule_time')
+
+    def set_schedule_time(self, time_str: str):
+        self.set_setting('schedule_time', time_str)
+
+    @staticmethod
+    def parse_schedule_times(time_str: str) -> List[time]:
+        """'09:00, 13:30' -> [time(9, 0), time(13, 30)]; ValueError при неправильному форматі"""
+        times = set()
+        for part in re.split(r'[,\s]+', time_str.strip()):
+            if not part:
+                continue
+            if not re.match(r'^\d{1,2}:\d{2}$', part):
+                raise ValueError(part)
+            hour, minute = map(int, part.split(':'))
+            times.add(time(hour, minute))
+        if not times:
+            raise ValueError(time_str)
+        return sorted(times)
+
+    # Upsert'и синхронізації з Excel: рядки без змін не переписуються
+    SYNC_PRODUCT_SQL = """
+        INSERT INTO products (url, name, category, added_date)
+        VALUES (?, ?, ?, CURRENT_DATE)
+        ON CONFLICT(url) DO UPDATE SET
+            name = COALESCE(NULLIF(excluded.name, ''), name),
+            category = COALESCE(NULLIF(excluded.category, ''), category)
+        WHERE COALESCE(NULLIF(excluded.name, ''), name) IS NOT name
+            OR COALESCE(NULLIF(excluded.category, ''), category) IS NOT category
+    """
+    SYNC_STOCK_SQL = """
+        INSERT INTO stock_history (product_id, check_date, stock_count)
+        SELECT id, ?, ? FROM products WHERE url = ?
+        ON CONFLICT(product_id, check_date) DO UPDATE SET
+            stock_count = excluded.stock_count,
+            min_stock = MIN(COALESCE(min_stock, stock_count), excluded.stock_count),
+            max_stock = MAX(COALESCE(max_stock, stock_count), excluded.stock_count)
+        WHERE stock_count IS NOT excluded.stock_count
+    """
+
+    @staticmethod
+    def _file_stat(path: str) -> str:
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    @staticmethod
+    def _file_hash(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def remember_excel_state(self, path: str = EXCEL_FILENAME):
+        """Запам'ятати розмір/mtime/хеш файлу, щоб наступна синхронізація його пропустила"""
+        self.set_setting('excel_sync_stat', self._file_stat(path))
+        self.set_setting('excel_sync_hash', self._file_hash(path))
+
+    @staticmethod
+    def _excel_readings(data_list):
+        """Рядки Excel -> (товари, заміри) для SYNC_*_SQL; заміри без дати пропускаються"""
+        products = {}
+        readings = {}
+        for row in data_list:
+            url = str(row.get('url') or '').strip()
+            if not url:
+                continue
+            products[url] = (url, str(row.get('name') or ''), str(row.get('category') or ''))
+
+            check_date = str(row.get('last_checked') or '').split(' ')[0]
+            max_stock = row.get('max_stock')
+            if not check_date or max_stock is None or max_stock == '':
+                continue
+            try:
+                readings[(url, check_date)] = int(max_stock)
+            except (ValueError, TypeError):
+                pass  # Пропускаем некорректные значения
+        stocks = [(check_date, stock, url) for (url, check_date), stock in readings.items()]
+        return list(products.values()), stocks
+
+    def sync_with_excel(self, force: bool = False) -> Optional[int]:
+        """Синхронізація з Excel файлом.
+
+        Файл пропускається, якщо його розмір/mtime або хеш не змінилися з минулої синхронізації
+        чи експорту. Інакше змінені товари і заміри (зі своїми датами) пишуться однією транзакцією
+        разом з розміром/mtime і хешем - лише після успішного читання файлу, щоб файл, який
+        не вдалося прочитати, синхронізувався наступного разу.
+        Повертає кількість змінених рядків або None, якщо синхронізацію пропущено.
+        """
         try:
-            if os.path.exists(EXCEL_FILENAME):
-                data_list = load_existing_excel(EXCEL_FILENAME)
-                logger.info(f"Завантажено {len(data_list)} записів з Excel")
-                
-                for row in data_list:
-                    url = row.get('url', '')
-                    if url:  # Проверяем, что URL не пустой
-                        # Додаємо товар в базу даних
-                        self.add_product(
-                            url=str(url),
-                            name=str(row.get('name', '')),
-                            category=str(row.get('category', ''))
-                        )
-                        
-                        # Оновлюємо залишки якщо є дані
-                        max_stock = row.get('max_stock')
-                        if max_stock is not None and max_stock != '':
-                            product_id = self.get_product_id_by_url(str(url))
-                            if product_id:
-                                try:
-                                    stock = int(max_stock)
-                                    self.update_product_stock(product_id, stock)
-                                except (ValueError, TypeError):
-                                    pass  # Пропускаем некорректные значения
-                
-                logger.info("Синхронізація з Excel завершена")
+            if not os.path.exists(EXCEL_FILENAME):
+                return None
+
+            file_stat = self._file_stat(EXCEL_FILENAME)
+            if not force and file_stat == self.get_setting('excel_sync_stat'):
+                logger.info("Excel не змінився з останньої синхронізації, пропускаємо")
+                return None
+
+            file_hash = self._file_hash(EXCEL_FILENAME)
+            if not force and file_hash == self.get_setting('excel_sync_hash'):
+                self.set_setting('excel_sync_stat', file_stat)
+                logger.info("Вміст Excel не змінився з останньої синхронізації, пропускаємо")
+                return None
+
+            data_list = load_existing_excel(EXCEL_FILENAME, raise_errors=True)
+            products, stocks = self._excel_readings(data_list)
+            logger.info(f"Завантажено {len(data_list)} записів з Excel: товарів {len(products)}, замірів {len(stocks)}")
+
+            with self._connection() as conn:
+                changed = conn.executemany(self.SYNC_PRODUCT_SQL, products).rowcount
+                changed += conn.executemany(self.SYNC_STOCK_SQL, stocks).rowcount
+                conn.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                                 [('excel_sync_stat', file_stat), ('excel_sync_hash', file_hash)])
+
+            logger.info(f"Синхронізація з Excel завершена, змінено рядків: {changed}")
+            return changed
         except Exception as e:
             logger.error(f"Помилка синхронізації з Excel: {e}")
+            return None
 
-
+    def excel_history_source(self):
+        """Історія для ExcelHistory: (дати, товари з {дата: залишок}) прямо з курсора бази"""
+        products = ({'name': product['name'], 'url': product['url'], 'category': product['category'],
+                     'dates': product['history']} for product in self.iter_products_with_history())
+        return self.get_history_dates(), products
 
     def export_to_excel(self):
         """Експорт даних в Excel для main.py"""
@@ -320,34 +678,201 @@ class DatabaseManager:
             excel_data = []
             
             for product in products:
+                # Дата - день останнього заміру, щоб повторна синхронізація не створила замір "на сьогодні"
+                checked = product['last_check'] != 'Никогда'
                 excel_data.append({
-                    'name': product['name'],
+                    'title': product['name'],
                     'url': product['url'],
                     'category': product['category'],
-                    'last_checked': product['last_check'],
-                    'max_stock': product['last_stock']
+                    'last_checked': product['last_check'] if checked else '',
+                    'max_stock': product['last_stock'] if checked else ''
                 })
             
             if excel_data:
-                # Завантажуємо існуючий Excel
-                existing_data = load_existing_excel(EXCEL_FILENAME)
-                
-                # Оновлюємо дані
-                updated_data = upsert_rows(existing_data, excel_data)
-                
-                # Зберігаємо
-                save_excel_with_formatting(EXCEL_FILENAME, updated_data)
-                logger.info(f"Експортовано {len(excel_data)} товарів в Excel")
+                # Файл переписується лише коли індекс бачить зміни, і тоді - потоково з бази
+                changed = ExcelHistory(EXCEL_FILENAME).update(excel_data, source=self.excel_history_source)
+                if changed:
+                    self.remember_excel_state(EXCEL_FILENAME)
+                logger.info(f"Експортовано {len(excel_data)} товарів в Excel, змінено рядків: {changed}")
                 
         except Exception as e:
             logger.error(f"Помилка експорту в Excel: {e}")
 
+def write_history_workbook(db: DatabaseManager, filepath: str, period: Optional[str] = None) -> int:
+    """Таблиця /export: товари x дати (кількість і зміни) плюс метрики продажів.
+
+    Workbook пишеться в write-only режимі зі спільними іменованими стилями, товари читаються
+    з бази по одному, тож пам'ять не залежить від кількості товарів і дат.
+    period ("week"/"month") замінює денні колонки зведеними по періодах.
+    Повертає кількість товарів.
+    """
+    if period:
+        return write_period_workbook(db, filepath, period)
+    
+    sorted_dates = db.get_history_dates()
+    stats = db.load_sales_stats()
+
+    wb = create_streaming_workbook()
+    ws = wb.create_sheet("Історія залишків")
+
+    # Создаем заголовки с колонками изменений
+    headers = ["Товар", "URL", "Категорія"] + list(EXPORT_STATS_HEADERS)
+    first_date_col = len(headers) + 1
+    for date in sorted_dates:
+        headers.extend([f"{date}\nкількість", f"{date}\nзміни"])
+
+    setup_excel_sheet(
+        ws,
+        [40, 60, 25] + [14] * len(EXPORT_STATS_HEADERS) + [12, 10] * len(sorted_dates),
+        freeze=f"{openpyxl.utils.get_column_letter(first_date_col)}2",
+        header_height=30
+    )
+    ws.append([excel_cell(ws, header, 'rz_header') for header in headers])
+
+    products_count = 0
+    for product in db.iter_products_with_history():
+        products_count += 1
+        row = [
+            excel_cell(ws, product['name'], 'rz_text'),
+            excel_cell(ws, product['url'], 'rz_text'),
+            excel_cell(ws, product['category'], 'rz_text'),
+        ]
+
+        # Метрики продажів
+        product_stats = stats.for_product(product['id']) or {}
+        for key in EXPORT_STATS_HEADERS.values():
+            value = product_stats.get(key)
+            row.append(excel_cell(ws, value if value is not None else '', 'rz_value'))
+
+        # Кількість і зміна відносно попереднього заміру по кожній даті
+        previous_stock = None
+        for date in sorted_dates:
+            current_stock = product['history'].get(date, '')
+            row.append(excel_cell(ws, current_stock, excel_stock_style(current_stock)))
+
+            change = None
+            if previous_stock is not None and current_stock != '':
+                try:
+                    change = int(current_stock) - int(previous_stock)
+                except (ValueError, TypeError):
+                    pass
+            if change:
+                row.append(excel_cell(ws, change, 'rz_increase' if change > 0 else 'rz_decrease'))
+            else:
+                row.append(excel_cell(ws, None, 'rz_value'))
+
+            if current_stock != '':
+                previous_stock = current_stock
+
+        ws.append(row)
+
+    ws.auto_filter.ref = f"A1:{openpyxl.utils.get_column_letter(len(headers))}{products_count + 1}"
+    wb.save(filepath)
+    return products_count
+
+def write_period_workbook(db: DatabaseManager, filepath: str, period: str) -> int:
+    """Таблиця /export week|month: метрики продажів і по 4 колонки (залишок, мін, макс, продано) на період.
+
+    Історія зводиться NumPy одним проходом до запису клітинок (HistoryBuckets).
+    """
+    buckets = db.load_history_buckets(period)
+    stats = db.load_sales_stats()
+
+    wb = create_streaming_workbook()
+    ws = wb.create_sheet("Історія по тижнях" if period == "week" else "Історія по місяцях")
+
+    headers = ["Товар", "URL", "Категорія"] + list(EXPORT_STATS_HEADERS)
+    first_period_col = len(headers) + 1
+    headers.extend(bucket_headers(buckets))
+
+    setup_excel_sheet(
+        ws,
+        [40, 60, 25] + [14] * len(EXPORT_STATS_HEADERS) + [10] * (len(headers) - first_period_col + 1),
+        freeze=f"{openpyxl.utils.get_column_letter(first_period_col)}2",
+        header_height=30
+    )
+    ws.append([excel_cell(ws, header, 'rz_header') for header in headers])
+
+    products_count = 0
+    for product in db.iter_products():
+        products_count += 1
+        row = [
+            excel_cell(ws, product['name'], 'rz_text'),
+            excel_cell(ws, product['url'], 'rz_text'),
+            excel_cell(ws, product['category'], 'rz_text'),
+        ]
+
+        product_stats = stats.for_product(product['id']) or {}
+        for key in EXPORT_STATS_HEADERS.values():
+            value = product_stats.get(key)
+            row.append(excel_cell(ws, value if value is not None else '', 'rz_value'))
+
+        row.extend(bucket_cells(ws, buckets.for_product(product['id']) or [None] * buckets.values.shape[1]))
+        ws.append(row)
+
+    ws.auto_filter.ref = f"A1:{openpyxl.utils.get_column_letter(len(headers))}{products_count + 1}"
+    wb.save(filepath)
+    return products_count
+
+def build_export_file(db_path: str, filepath: str, period: Optional[str] = None) -> int:
+    """Точка входу процесу експорту: таблиця /export у filepath через власне з'єднання з базою"""
+    db = DatabaseManager(db_path, init_schema=False)
+    try:
+        return write_history_workbook(db, filepath, period)
+    finally:
+        db.close()
+
+def build_history_file(db_path: str):
+    """Точка входу процесу експорту: оновлення основного файлу EXCEL_FILENAME"""
+    db = DatabaseManager(db_path, init_schema=False)
+    try:
+        db.export_to_excel()
+    finally:
+        db.close()
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Ділить текст на повідомлення по цілих рядках, щоб не розрізати HTML-теги"""
+    chunks, current = [], ""
+    for line in text.splitlines(keepends=True):
+        if current and len(current) + len(line) > limit:
+            chunks.append(current)
+            current = ""
+        current += line
+    if current:
+        chunks.append(current)
+    return chunks
+
 class RozetkaTelegramBot:
     def __init__(self):
         self.bot = Bot(token=BOT_TOKEN)
         self.dp = Dispatcher(storage=MemoryStorage())
         self.db = DatabaseManager()
-        self.checker = ImprovedRozetkaChecker(debug=True, delay=0.7)  # Enable debug
+        # Весь скрапінг виконується у власному пулі потоків, щоб не блокувати polling
+        self.session_pool = SessionPool(max_idle=CHECK_WORKERS, store_path=SESSION_FILENAME)
+        self.category_index = CategoryIndex(store_path=CATEGORY_INDEX_FILENAME)
+        self.rate_limiter = RateLimiter(rate=CHECK_WORKERS / 0.7)
+        self.breakers = ImprovedRozetkaChecker.create_breakers()
+        self.engine = StockCheckEngine(
+            workers=CHECK_WORKERS,
+            batch_size=CHECK_BATCH_SIZE,
+            session_pool=self.session_pool,
+            category_index=self.category_index,
+            rate_limiter=self.rate_limiter,
+            breakers=self.breakers,
+            checker_factory=lambda: ImprovedRozetkaChecker(debug=True, delay=0.7, session_pool=self.session_pool,
+                                                           db=self.db, category_index=self.category_index,
+                                                           rate_limiter=self.rate_limiter, breakers=self.breakers)
+        )
+        # Excel будується в окремих процесах (spawn: без копії потоків і з'єднань бота)
+        self.export_executor = ProcessPoolExecutor(max_workers=EXPORT_WORKERS,
+                                                   mp_context=multiprocessing.get_context("spawn"))
+        self._history_lock = asyncio.Lock()
+        self._background_tasks = set()
+        self._export_builds = {}  # ключ версії даних -> побудова файлу /export, що виконується
+        self._exports_in_use = {}  # шлях файлу /export -> скільки відправок його зараз використовують
+        # Версії даних різних баз не порівнюються, тому кожна база має свій каталог кешу
+        db_key = hashlib.sha1(os.path.abspath(self.db.db_path).encode()).hexdigest()[:12]
+        self.export_cache_dir = os.path.join(EXPORT_CACHE_DIR, db_key)
         self.setup_handlers()
         self.db.sync_with_excel()
 
@@ -361,6 +886,7 @@ class RozetkaTelegramBot:
         self.dp.message(Command("check"))(self.cmd_manual_check)
         self.dp.message(Command("export"))(self.cmd_export_table)
         self.dp.message(Command("sync"))(self.cmd_sync_excel)  # Нова команда
+        self.dp.message(Command("stats"))(self.cmd_stats)
         self.dp.message(F.text)(self.handle_text_messages)
         self.dp.callback_query()(self.handle_callback_query)
 
@@ -369,9 +895,13 @@ class RozetkaTelegramBot:
         await message.reply("🔄 Синхронізую з Excel файлом...")
         
         try:
-            self.db.sync_with_excel()
-            products_count = len(self.db.get_products())
-            await message.reply(f"✅ Синхронізація завершена!\n📊 Всього товарів: {products_count}")
+            changed = await asyncio.to_thread(self.db.sync_with_excel)
+            products_count = self.db.count_products()
+            if changed is None:
+                status = "Excel не змінився або відсутній"
+            else:
+                status = f"Змінено записів: {changed}"
+            await message.reply(f"✅ Синхронізація завершена!\n{status}\n📊 Всього товарів: {products_count}")
         except Exception as e:
             await message.reply(f"❌ Помилка синхронізації: {str(e)}")
 
@@ -380,12 +910,14 @@ class RozetkaTelegramBot:
             "🛒 <b>Бот перевірки залишків Rozetka</b>\n\n"
             "📋 Доступні команди:\n"
             "/add - додати товар\n"
-            "/list - список товарів\n"
-            "/remove - видалити товар\n"
+            "/list - список товарів (/list текст - пошук по назві)\n"
+            "/remove - видалити товар (/remove текст - пошук по назві)\n"
             "/schedule - налаштувати розклад\n"
             "/check - ручна перевірка\n"
-            "/export - експорт таблиці\n"
+            "/export - експорт таблиці (/export week або /export month - по тижнях/місяцях, "
+            "/export csv або /export jsonl - вся історія в gzip)\n"
             "/sync - синхронізація з Excel\n"
+            "/stats - швидкість продажів і прогноз залишків (/stats id - по товару)\n"
             "/help - допомога",
             parse_mode="HTML"
         )
@@ -398,7 +930,7 @@ class RozetkaTelegramBot:
             "3. Бот щодня перевірятиме залишки\n"
             "4. Експортуйте дані /export\n"
             "5. Синхронізуйте з Excel /sync\n\n"
-            "⚠️ Формат часу: ГГ:ХХ (наприклад, 09:30)",
+            "⚠️ Формат часу: ГГ:ХХ (наприклад, 09:30), кілька перевірок на день - через кому",
             parse_mode="HTML"
         )
 
@@ -406,43 +938,65 @@ class RozetkaTelegramBot:
         await state.set_state(BotStates.waiting_url)
         await message.reply("🔗 Надішліть посилання на товар Rozetka:")
 
-    async def cmd_list_products(self, message: Message):
-        products = self.db.get_products()
-        if not products:
-            await message.reply("📦 Список товарів порожній")
-            return
-        
-        text = "📋 <b>Список товарів:</b>\n\n"
-        for i, product in enumerate(products, 1):
-            name = product['name']
-            category = product['category']
-            stock = product['last_stock']
-            last_check = product['last_check']
-            
-            text += f"{i}. <b>{name}</b>\n"
-            text += f"   📂 {category}\n"
-            text += f"   📊 Залишки: {stock}\n"
-            text += f"   🕐 Остання перевірка: {last_check}\n"
-            text += f"   🔗 {product['url'][:50]}...\n\n"
+    async def cmd_list_products(self, message: Message, state: FSMContext):
+        await self.show_products_page(message, state, "list")
+
+    async def cmd_remove_product(self, message: Message, state: FSMContext):
+        await self.show_products_page(message, state, "remove")
+
+    async def show_products_page(self, message: Message, state: FSMContext, view: str):
+        """Перша сторінка /list або /remove; текст після команди - пошук по назві (зберігається в FSM)"""
+        parts = (message.text or "").split(maxsplit=1)
+        search = parts[1].strip() if len(parts) > 1 else None
+        await state.update_data(**{f"{view}_search": search})
         
-        await message.reply(text, parse_mode="HTML")
+        text, keyboard = self.render_products_page(view, search)
+        await message.reply(text, parse_mode="HTML", reply_markup=keyboard)
 
-    async def cmd_remove_product(self, message: Message):
-        products = self.db.get_products()
+    def render_products_page(self, view: str, search: Optional[str] = None,
+                             after_id: Optional[int] = None, before_id: Optional[int] = None):
+        """Текст і клавіатура сторінки товарів; кнопки навігації несуть id крайнього товару сторінки"""
+        products, has_prev, has_next = self.db.get_products_page(after_id, before_id, search)
         if not products:
-            await message.reply("📦 Немає товарів для видалення")
-            return
+            if search:
+                return f"🔍 Нічого не знайдено за запитом «{html.escape(search)}»", None
+            return ("📦 Список товарів порожній" if view == "list" else "📦 Немає товарів для видалення"), None
+        
+        total = self.db.count_products_matching(search) if search else self.db.count_products()
+        if view == "list":
+            text = "📋 <b>Список товарів:</b>"
+        else:
+            text = "Оберіть товар для видалення:"
+        if search:
+            text += f"\n🔍 Пошук: «{html.escape(search)}»"
+        text += f"\n📦 Товарів: {total}\n\n"
         
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=f"🗑 {p['name'][:30]}...", 
-                                 callback_data=f"remove_{p['id']}")] for p in products
-        ])
-        await message.reply("Оберіть товар для видалення:", reply_markup=keyboard)
+        rows = []
+        if view == "list":
+            for product in products:
+                text += f"• <b>{html.escape(product['name'][:100])}</b>\n"
+                text += f"   📂 {html.escape(product['category'][:60])}\n"
+                text += f"   📊 Залишки: {product['last_stock']}\n"
+                text += f"   🕐 Остання перевірка: {product['last_check']}\n"
+                text += f"   📈 Статистика: /stats {product['id']}\n"
+                text += f"   🔗 {html.escape(product['url'][:50])}...\n\n"
+        else:
+            rows = [[InlineKeyboardButton(text=f"🗑 {p['name'][:30]}...", callback_data=f"remove_{p['id']}")]
+                    for p in products]
+        
+        navigation = []
+        if has_prev:
+            navigation.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"page:{view}:prev:{products[0]['id']}"))
+        if has_next:
+            navigation.append(InlineKeyboardButton(text="Далі ➡️", callback_data=f"page:{view}:next:{products[-1]['id']}"))
+        if navigation:
+            rows.append(navigation)
+        return text, InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
 
     async def cmd_set_schedule(self, message: Message, state: FSMContext):
         await state.set_state(BotStates.waiting_time)
         current_time = self.db.get_schedule_time()
-        text = "🕐 Введіть час щоденної перевірки (формат ГГ:ХХ):"
+        text = "🕐 Введіть час щоденної перевірки (формат ГГ:ХХ, кілька - через кому, наприклад 09:00, 15:00):"
         if current_time:
             text += f"\n\n⏰ Поточний час: {current_time}"
         await message.reply(text)
@@ -474,257 +1028,388 @@ class RozetkaTelegramBot:
         else:
             await message.reply("✅ Перевірка завершена, але товарів для перевірки немає")
 
+    async def cmd_stats(self, message: Message):
+        """Швидкість продажів по каталогу і товари, що закінчаться найшвидше"""
+        parts = (message.text or "").split()
+        if len(parts) > 1:
+            if not parts[1].isdigit():
+                await message.reply("❌ Використовуйте /stats або /stats id товару (id є в /list)")
+                return
+            await self.cmd_product_stats(message, int(parts[1]))
+            return
+
+        try:
+            stats = await asyncio.to_thread(self.db.load_sales_stats)
+        except Exception as e:
+            logger.error(f"Помилка розрахунку статистики: {e}")
+            await message.reply(f"❌ Помилка розрахунку статистики: {str(e)}")
+            return
+
+        summary = stats.summary()
+        if not summary['tracked']:
+            await message.reply("📊 Ще немає історії залишків для статистики")
+            return
+
+        report = (
+            f"📊 <b>Статистика продажів</b> (вікно {summary['window']} дн., історія {summary['days']} дн.)\n\n"
+            f"📦 Товарів з даними: {summary['tracked']} з {summary['products']}\n"
+            f"🛒 Продаються: {summary['selling']}, немає в наявності: {summary['out_of_stock']}\n"
+            f"📉 Продано за вікно: {summary['sold']} шт. (~{summary['velocity']:.1f} шт./день)\n"
+            f"📈 Поповнень: {summary['restocks']} (+{summary['restocked']} шт.)\n"
+        )
+
+        stockouts = stats.soonest_stockouts(10)
+        if stockouts:
+            report += "\n⏳ <b>Закінчаться найшвидше:</b>\n"
+            for i, row in enumerate(stockouts, 1):
+                report += (f"{i}. {html.escape(row['name'] or 'Без назви')}\n"
+                           f"   Залишок: {row['stock']}, продажі: {row['velocity']}/день, "
+                           f"днів до нуля: ~{row['days_to_stockout']}\n")
+
+        for chunk in split_message(report):
+            await message.reply(chunk, parse_mode="HTML")
+
+    async def cmd_product_stats(self, message: Message, product_id: int):
+        """Метрики одного товару і внутрішньоденні зміни залишку з stock_samples"""
+        product = self.db.get_product_by_id(product_id)
+        if not product:
+            await message.reply(f"❌ Товар з id {product_id} не знайдено")
+            return
+
+        since = datetime.now() - timedelta(hours=SAMPLES_HOURS)
+        try:
+            stats = await asyncio.to_thread(self.db.load_sales_stats)
+            samples = await asyncio.to_thread(self.db.get_stock_samples, product_id, since)
+        except Exception as e:
+            logger.error(f"Помилка розрахунку статистики: {e}")
+            await message.reply(f"❌ Помилка розрахунку статистики: {str(e)}")
+            return
+
+        report = f"📊 <b>{html.escape(product['name'] or 'Без назви')}</b>\n"
+        row = stats.for_product(product_id)
+        if row and row['last_date']:
+            report += (f"📦 Залишок: {row['stock']} (на {row['last_date']})\n"
+                       f"📉 Продажі: {row['velocity'] if row['velocity'] is not None else '—'}/день, "
+                       f"продано за вікно: {row['sold']} шт.\n"
+                       f"📈 Поповнень: {row['restocks']} (+{row['restocked']} шт.)\n")
+            if row['days_to_stockout'] is not None:
+                report += f"⏳ Днів до нуля: ~{row['days_to_stockout']}\n"
+        else:
+            report += "Ще немає історії залишків\n"
+
+        if samples:
+            report += f"\n🕐 <b>Зміни залишку за {SAMPLES_HOURS} год.:</b>\n"
+            if len(samples) > SAMPLES_SHOWN:
+                report += f"(останні {SAMPLES_SHOWN} з {len(samples)})\n"
+            for checked_at, stock in samples[-SAMPLES_SHOWN:]:
+                report += f"{checked_at.strftime('%d.%m %H:%M')} — {stock}\n"
+        else:
+            report += f"\n🕐 За {SAMPLES_HOURS} год. залишок не змінювався\n"
+
+        for chunk in split_message(report):
+            await message.reply(chunk, parse_mode="HTML")
+
     async def cmd_export_table(self, message: Message):
-        await message.reply("📊 Генерую Excel таблицю...")
+        parts = (message.text or "").split()
+        fmt = parts[1].lower() if len(parts) > 1 else "xlsx"
+        if fmt not in ("xlsx",) + HISTORY_PERIODS + HISTORY_EXPORT_FORMATS:
+            await message.reply("❌ Невідомий формат. Використовуйте /export, /export week, /export month, "
+                                "/export csv або /export jsonl")
+            return
+        
+        if fmt in HISTORY_EXPORT_FORMATS:
+            title = f"{fmt.upper()} з історією"
+            filename = f"rozetka_stock_history.{fmt}.gz"
+        elif fmt in HISTORY_PERIODS:
+            title = "Excel таблицю по тижнях" if fmt == "week" else "Excel таблицю по місяцях"
+            filename = f"rozetka_stock_history_{fmt}.xlsx"
+        else:
+            title = "Excel таблицю"
+            filename = "rozetka_stock_history.xlsx"
+        status_msg = await message.reply(f"📊 Генерую {title}...")
         
         try:
-            # Спочатку експортуємо в основний Excel файл
-            self.db.export_to_excel()
-            
-            products = self.db.get_products()
-            if not products:
-                await message.reply("❌ Немає товарів для експорту")
-                return
-            
-            excel_path = await self.generate_excel()
-            
-            if not os.path.exists(excel_path):
-                await message.reply("❌ Помилка створення файлу")
-                return
+            # Основний Excel файл оновлюється паралельно у фоні
+            self.schedule_history_update()
             
-            file_size = os.path.getsize(excel_path)
-            if file_size == 0:
-                await message.reply("❌ Створений файл порожній")
-                os.remove(excel_path)
+            products_count = self.db.count_products()
+            if not products_count:
+                await status_msg.edit_text("❌ Немає товарів для експорту")
                 return
             
-            await message.reply_document(
-                document=FSInputFile(excel_path, filename="rozetka_stock_history.xlsx"),
-                caption=f"📋 Таблиця залишків Rozetka\n📊 Товарів: {len(products)}\n📅 {datetime.now().strftime('%d.%m.%Y %H:%M')}",
-            )
+            async def report_progress(elapsed):
+                try:
+                    await status_msg.edit_text(f"📊 Генерую {title} для {products_count} товарів... {elapsed:.0f} с")
+                except Exception as e:
+                    logger.debug(f"Не вдалося оновити прогрес експорту: {e}")
             
-            os.remove(excel_path)
-            logger.info(f"Експорт виконано для {len(products)} товарів")
+            excel_path = await self.generate_export(fmt, on_progress=report_progress)
+            self._acquire_export(excel_path)
+            try:
+                if not os.path.exists(excel_path):
+                    await message.reply("❌ Помилка створення файлу")
+                    return
+                
+                file_size = os.path.getsize(excel_path)
+                if file_size == 0:
+                    await message.reply("❌ Створений файл порожній")
+                    if os.path.dirname(excel_path) == self.export_cache_dir:
+                        os.remove(excel_path)
+                    return
+                
+                await message.reply_document(
+                    document=FSInputFile(excel_path, filename=filename),
+                    caption=f"📋 Таблиця залишків Rozetka\n📊 Товарів: {products_count}\n📅 {datetime.now().strftime('%d.%m.%Y %H:%M')}",
+                )
+                await status_msg.delete()
+            finally:
+                self._release_export(excel_path)
+            logger.info(f"Експорт виконано для {products_count} товарів")
             
         except Exception as e:
             logger.error(f"Помилка експорту: {e}")
             await message.reply(f"❌ Помилка створення таблиці: {str(e)}")
 
+    def _acquire_export(self, path: str):
+        """Позначити файл /export як той, що відправляється: кеш його не прибирає"""
+        self._exports_in_use[path] = self._exports_in_use.get(path, 0) + 1
+
+    def _release_export(self, path: str):
+        """Завершити відправку; файл поза кешем видаляється після останньої відправки"""
+        count = self._exports_in_use.pop(path, 1) - 1
+        if count > 0:
+            self._exports_in_use[path] = count
+        elif os.path.dirname(path) != self.export_cache_dir:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def run_export(self, fn, *args):
+        """Виконати fn(*args) у процесі експорту без блокування event loop"""
+        return await asyncio.get_running_loop().run_in_executor(self.export_executor, fn, *args)
+
+    async def update_history_file(self):
+        """Оновити основний Excel файл у процесі експорту (по одному оновленню за раз)"""
+        async with self._history_lock:
+            try:
+                await self.run_export(build_history_file, self.db.db_path)
+            except Exception as e:
+                logger.error(f"Помилка експорту в Excel: {e}")
+
+    def schedule_history_update(self):
+        """Запустити update_history_file у фоні"""
+        task = asyncio.create_task(self.update_history_file())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+
+    async def run_check(self, url: str) -> Dict:
+        """Перевірка одного товару в пулі воркерів без блокування event loop"""
+        return await asyncio.wrap_future(self.engine.submit(url))
+
+    async def run_check_all(self, urls: List[str], on_result=None, hints: Optional[Dict] = None) -> List[Dict]:
+        """Перевірка списку товарів у пулі воркерів без блокування event loop"""
+        return await asyncio.to_thread(self.engine.check_all, urls, on_result, hints)
+
+    @staticmethod
+    def stock_hints(products: List[Dict]) -> Dict[str, int]:
+        """Останні відомі залишки товарів - стартова точка для пошуку кількості"""
+        return {p['url']: p['last_stock'] for p in products if p['last_check'] != "Никогда"}
 
     async def check_products_without_saving(self) -> List[Dict]:
         """Перевірка товарів БЕЗ збереження в базу даних (для ручної перевірки)"""
         products = self.db.get_products()
         results = []
-        
-        for i, product in enumerate(products, 1):
-            try:
-                logger.info(f"Ручна перевірка товару {i}/{len(products)}: {product['name']}")
-                
-                result = self.checker.check_product(product['url'])
-                if 'error' not in result:
-                    stock_count = result.get('max_stock', 0)
-                    # ИСПРАВЛЕНИЕ: используем данные из result вместо product
-                    product_name = result.get('title', product['name'])
-                    category_name = result.get('category', 'Без категории')
-                    
-                    results.append({
-                        'name': product_name or 'Без назви',
-                        'category': category_name or 'Без категории', # Добавляем категорию
-                        'success': True,
-                        'stock': stock_count
-                    })
-                    
-                    logger.info(f"Ручна перевірка - Успіх: {product_name}, категория: {category_name}, залишки: {stock_count}")
-                else:
-                    results.append({
-                        'name': product['name'],
-                        'category': 'Помилка',
-                        'success': False,
-                        'error': result['error']
-                    })
-                    logger.error(f"Ручна перевірка - Помилка для товару {product['url']}: {result['error']}")
-                    
-            except Exception as e:
-                logger.error(f"Критична помилка ручної перевірки товару {product['url']}: {e}")
+
+        logger.info(f"Ручна перевірка {len(products)} товарів")
+        check_results = await self.run_check_all([p['url'] for p in products], hints=self.stock_hints(products))
+
+        for product, result in zip(products, check_results):
+            if 'error' not in result:
+                stock_count = result.get('max_stock', 0)
+                # ИСПРАВЛЕНИЕ: используем данные из result вместо product
+                product_name = result.get('title', product['name'])
+                category_name = result.get('category', 'Без категории')
+
+                results.append({
+                    'name': product_name or 'Без назви',
+                    'category': category_name or 'Без категории', # Добавляем категорию
+                    'success': True,
+                    'stock': stock_count
+                })
+
+                logger.info(f"Ручна перевірка - Успіх: {product_name}, категория: {category_name}, залишки: {stock_count}")
+            else:
                 results.append({
                     'name': product['name'],
-                    'category': 'Критична помилка',
+                    'category': 'Помилка',
                     'success': False,
-                    'error': str(e)
+                    'error': result['error']
                 })
-            
-            # Пауза між товарами
-            if i < len(products):
-                await asyncio.sleep(2)
-        
+                logger.error(f"Ручна перевірка - Помилка для товару {product['url']}: {result['error']}")
+
         return results
 
-    async def generate_excel(self) -> str:
-        temp_dir = tempfile.gettempdir()
-        filename = f"rozetka_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        filepath = os.path.join(temp_dir, filename)
+    async def generate_excel(self, on_progress=None) -> str:
+        """Таблиця /export (див. generate_export)"""
+        return await self.generate_export("xlsx", on_progress)
+
+    async def generate_export(self, fmt: str = "xlsx", on_progress=None) -> str:
+        """Файл /export з кешу або побудований в процесі експорту.
+
+        xlsx - таблиця write_history_workbook, week/month - вона ж, зведена по періодах,
+        csv/jsonl - gzip-вивантаження всієї історії.
+        Файл підписується версією даних (таблиці ще й датою - метрики продажів рахуються від сьогодні),
+        тож повторні експорти без нових записів віддаються з диска, а одночасні запити
+        однієї версії чекають на одну побудову. on_progress(секунд) викликається під час очікування.
+        Файл поза кешем (помилка або дані змінилися під час побудови) видаляє _release_export.
+        """
+        version = self.db.get_data_version()
+        stamp = f"{version}_{datetime.now().strftime('%Y%m%d')}"
+        if fmt == "xlsx":
+            key = stamp
+            filename = f"rozetka_export_{stamp}.xlsx"
+            job = (build_export_file,)
+        elif fmt in HISTORY_PERIODS:
+            key = f"{stamp}_{fmt}"
+            filename = f"rozetka_export_{stamp}.{fmt}.xlsx"
+            job = (build_export_file, fmt)
+        else:
+            key = f"{version}_{fmt}"
+            filename = f"rozetka_history_{version}.{fmt}.gz"
+            job = (export_history_stream, fmt)
+        filepath = os.path.join(self.export_cache_dir, filename)
+        if os.path.exists(filepath):
+            logger.info(f"Файл експорту з кешу: {filepath}")
+            return filepath
         
         try:
-            products_data = self.db.get_products_with_history()
+            build = self._export_builds.get(key)
+            if build is None:
+                build = asyncio.ensure_future(self._build_cached_export(filepath, version, *job))
+                self._export_builds[key] = build
+                build.add_done_callback(lambda _: self._export_builds.pop(key, None))
             
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Історія залишків"
-            
-            # Определяем все даты
-            all_dates = set()
-            for product in products_data:
-                all_dates.update(product['all_dates'])
-            
-            sorted_dates = sorted(list(all_dates))
-            
-            # Создаем заголовки с колонками изменений
-            headers = ["Товар", "URL", "Категорія"]
-            for date in sorted_dates:
-                headers.extend([f"{date}\nкількість", f"{date}\nзміни"])
-            
-            # Заполняем заголовки
-            for col, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col, value=header)
-                cell.font = Font(bold=True, color="FFFFFF")
-                cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-                cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-                cell.border = Border(
-                    left=Side(style='thin'),
-                    right=Side(style='thin'),
-                    top=Side(style='thin'),
-                    bottom=Side(style='thin')
-                )
-            
-            # Заполняем данные
-            for row_idx, product in enumerate(products_data, 2):
-                # Основная информация о товаре
-                ws.cell(row=row_idx, column=1, value=product['name'])
-                ws.cell(row=row_idx, column=2, value=product['url'])
-                ws.cell(row=row_idx, column=3, value=product['category'])
-                
-                # Заполняем данные по датам
-                previous_stock = None
-                col_idx = 4
-                
-                for date in sorted_dates:
-                    current_stock = product['history'].get(date, '')
-                    
-                    # Колонка количества
-                    stock_cell = ws.cell(row=row_idx, column=col_idx, value=current_stock)
-                    stock_cell.alignment = Alignment(horizontal="center", vertical="center")
-                    stock_cell.border = Border(
-                        left=Side(style='thin'),
-                        right=Side(style='thin'),
-                        top=Side(style='thin'),
-                        bottom=Side(style='thin')
-                    )
-                    
-                    # Цветовое кодирование для количества
-                    if current_stock and current_stock > 0:
-                        stock_cell.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-                    elif current_stock == 0:
-                        stock_cell.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-                    
-                    # Колонка изменений
-                    change_cell = ws.cell(row=row_idx, column=col_idx + 1)
-                    change_cell.alignment = Alignment(horizontal="center", vertical="center")
-                    change_cell.border = Border(
-                        left=Side(style='thin'),
-                        right=Side(style='thin'),
-                        top=Side(style='thin'),
-                        bottom=Side(style='thin')
-                    )
-                    
-                    # Вычисляем изменения
-                    if previous_stock is not None and current_stock != '' and previous_stock != '':
-                        try:
-                            change = int(current_stock) - int(previous_stock)
-                            if change != 0:
-                                change_cell.value = change
-                                # Цветовое кодирование для изменений
-                                if change > 0:
-                                    change_cell.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-                                    change_cell.font = Font(color="006100", bold=True)
-                                else:
-                                    change_cell.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-                                    change_cell.font = Font(color="9C0006", bold=True)
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    # Обновляем previous_stock для следующей итерации
-                    if current_stock != '':
-                        previous_stock = current_stock
-                    
-                    col_idx += 2
-            
-            # Настройка ширины столбцов
-            ws.column_dimensions['A'].width = 40  # Товар
-            ws.column_dimensions['B'].width = 60  # URL
-            ws.column_dimensions['C'].width = 25  # Категория
-            
-            # Для колонок с датами и изменениями
-            col_idx = 4
-            for _ in sorted_dates:
-                col_letter_qty = openpyxl.utils.get_column_letter(col_idx)
-                col_letter_change = openpyxl.utils.get_column_letter(col_idx + 1)
-                ws.column_dimensions[col_letter_qty].width = 12    # Количество
-                ws.column_dimensions[col_letter_change].width = 10  # Изменения
-                col_idx += 2
-            
-            # Высота строк
-            ws.row_dimensions[1].height = 30  # Заголовок
-            for row in range(2, len(products_data) + 2):
-                ws.row_dimensions[row].height = 25
-            
-            # Закрепляем первые строки и столбцы
-            ws.freeze_panes = 'D2'
-            
-            # Автофильтр
-            max_row = len(products_data) + 1
-            max_col = len(headers)
-            ws.auto_filter.ref = f"A1:{openpyxl.utils.get_column_letter(max_col)}{max_row}"
-            
-            wb.save(filepath)
-            logger.info(f"Excel файл створено: {filepath}")
-            
-            return filepath
+            started = asyncio.get_running_loop().time()
+            while True:
+                done, _ = await asyncio.wait({build}, timeout=EXPORT_PROGRESS_INTERVAL)
+                if done:
+                    break
+                if on_progress:
+                    await on_progress(asyncio.get_running_loop().time() - started)
+            return build.result()
             
         except Exception as e:
-            logger.error(f"Помилка створення Excel: {e}")
-            # Создаем простой файл с ошибкой
+            logger.error(f"Помилка створення файлу експорту: {e}")
+            if fmt != "xlsx":
+                raise
+            # Создаем простой файл с ошибкой (поза кешем)
+            fd, error_path = tempfile.mkstemp(prefix="rozetka_export_", suffix=".xlsx")
+            os.close(fd)
             wb = Workbook()
             ws = wb.active
             ws.title = "Помилка"
             ws.cell(row=1, column=1, value=f"Помилка створення файлу: {str(e)}")
-            wb.save(filepath)
-            return filepath
-            
-
+            wb.save(error_path)
+            return error_path
+
+    async def _build_cached_export(self, filepath: str, version: int, build_fn, *args) -> str:
+        """Будує файл build_fn(db_path, шлях, *args) у процесі експорту, атомарно кладе його в кеш
+        і прибирає старші версії того ж формату.
+
+        Якщо версія даних змінилася під час побудови, файл не відповідає version - він віддається
+        лише поточним запитам як файл поза кешем.
+        """
+        def kind(name):
+            # Формат - все після першої крапки: .xlsx, .week.xlsx, .csv.gz ...
+            return name[name.find("."):]
+        
+        os.makedirs(self.export_cache_dir, exist_ok=True)
+        tmp_path = filepath + ".tmp"
+        count = await self.run_export(build_fn, self.db.db_path, tmp_path, *args)
+        
+        suffix = kind(os.path.basename(filepath))
+        if self.db.get_data_version() != version:
+            fd, one_off_path = tempfile.mkstemp(prefix="rozetka_export_", suffix=suffix)
+            os.close(fd)
+            os.replace(tmp_path, one_off_path)
+            logger.info(f"Дані змінилися під час експорту, файл не кешується: {one_off_path}")
+            return one_off_path
+        
+        os.replace(tmp_path, filepath)
+        logger.info(f"Файл експорту створено: {filepath} (записів: {count})")
+        
+        # Прибираються лише старші за щойно створений файли, які зараз ніхто не відправляє
+        built_at = os.path.getmtime(filepath)
+        older = []
+        for name in os.listdir(self.export_cache_dir):
+            path = os.path.join(self.export_cache_dir, name)
+            if path != filepath and kind(name) == suffix:
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+                if mtime < built_at:
+                    older.append((mtime, path))
+        older.sort(reverse=True)
+        for _, old_path in older[EXPORT_CACHE_KEEP - 1:]:
+            if old_path in self._exports_in_use:
+                continue
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+        return filepath
 
-    async def handle_callback_query(self, callback_query: CallbackQuery):
-        if callback_query.data.startswith("remove_"):
-            product_id = int(callback_query.data.split("_")[1])
+    async def handle_callback_query(self, callback_query: CallbackQuery, state: FSMContext):
+        # Відповідь на callback обов'язкова навіть після помилки, інакше кнопка "крутиться"
+        try:
+            await self.process_callback_query(callback_query, state)
+        finally:
+            await callback_query.answer()
+
+    async def process_callback_query(self, callback_query: CallbackQuery, state: FSMContext):
+        data = callback_query.data or ""
+        if data.startswith("page:"):
+            match = PAGE_CALLBACK_RE.fullmatch(data)
+            if not match:
+                logger.warning(f"Некоректні дані кнопки навігації: {data!r}")
+                return
+            view, direction, product_id = match.group(1), match.group(2), int(match.group(3))
+            search = (await state.get_data()).get(f"{view}_search")
+            text, keyboard = self.render_products_page(
+                view, search,
+                after_id=product_id if direction == "next" else None,
+                before_id=product_id if direction == "prev" else None,
+            )
+            try:
+                await callback_query.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+            except TelegramBadRequest as e:
+                # Повторне натискання тієї ж кнопки дає ту саму сторінку
+                if "message is not modified" not in str(e):
+                    raise
+        
+        elif data.startswith("remove_"):
+            product_id = int(data.split("_")[1])
             product = self.db.get_product_by_id(product_id)
             
             if product:
                 success = self.db.remove_product_by_id(product_id)
                 if success:
                     # Оновлюємо Excel після видалення
-                    self.db.export_to_excel()
+                    self.schedule_history_update()
                     
                     await callback_query.message.edit_text(
                         f"✅ Товар успішно видалено!\n\n"
-                        f"📦 <b>{product['name'] or 'Без назви'}</b>\n"
-                        f"🔗 {product['url'][:50]}...",
+                        f"📦 <b>{html.escape(product['name'] or 'Без назви')}</b>\n"
+                        f"🔗 {html.escape(product['url'][:50])}...",
                         parse_mode="HTML"
                     )
                 else:
                     await callback_query.message.edit_text("❌ Помилка видалення товару")
             else:
                 await callback_query.message.edit_text("❌ Товар не знайдено")
-        
-        await callback_query.answer()
 
     async def handle_text_messages(self, message: Message, state: FSMContext):
         current_state = await state.get_state()
@@ -744,7 +1429,7 @@ class RozetkaTelegramBot:
         processing_msg = await message.reply("⏳ Обробляю товар...")
         
         try:
-            result = self.checker.check_product(url)
+            result = await self.run_check(url)
             
             if 'error' in result:
                 await processing_msg.edit_text(f"❌ Помилка: {result['error']}")
@@ -783,17 +1468,31 @@ class RozetkaTelegramBot:
 
     async def check_all_products(self, manual=False) -> List[Dict]:
         products = self.db.get_products()
-        results = []
+        results = [None] * len(products)
 
         logger.info(f"=== НАЧАЛО АВТОМАТИЧЕСКОЙ ПРОВЕРКИ ===")
         logger.info(f"Режим manual: {manual}")
-        logger.info(f"Всего товаров для проверки: {len(products)}")
+        logger.info(f"Всего товаров для проверки: {len(products)}, воркеров: {self.engine.workers}")
 
-        for i, product in enumerate(products, 1):
-            try:
-                logger.info(f">>> Товар {i}/{len(products)}: {product['name']} (ID: {product['id']})")
+        # Результати накопичуються і пишуться в базу пачками по SAVE_BATCH_SIZE
+        pending_products = []
+        pending_stocks = []
+        saved = {'products': 0, 'stocks': 0, 'failed': 0}
+
+        def flush():
+            if not pending_products and not pending_stocks:
+                return
+            if self.db.save_check_results(pending_products, pending_stocks):
+                saved['products'] += len(pending_products)
+                saved['stocks'] += len(pending_stocks)
+            else:
+                saved['failed'] += len(pending_products) + len(pending_stocks)
+            pending_products.clear()
+            pending_stocks.clear()
 
-                result = self.checker.check_product(product['url'])
+        def handle_result(i, url, result):
+            product = products[i]
+            try:
                 if 'error' not in result:
                     # Оновлюємо інформацію про товар
                     updated_name = result.get('title', product['name'])
@@ -801,69 +1500,64 @@ class RozetkaTelegramBot:
                     stock_count = result.get('max_stock', 0)
 
                     logger.info(
-                        f"    Получен результат: name='{updated_name}', category='{updated_category}', stock={stock_count}")
+                        f">>> Товар {i + 1}/{len(products)} (ID: {product['id']}): "
+                        f"name='{updated_name}', category='{updated_category}', stock={stock_count}, "
+                        f"probes={result.get('probes')}")
 
                     if updated_name != product['name'] or updated_category != product['category']:
-                        logger.info(f"    Обновляем информацию о товаре...")
-                        self.db.add_product(
-                            product['url'],
-                            updated_name,
-                            updated_category
-                        )
+                        pending_products.append((product['id'], updated_name, updated_category))
 
                     # Оновлюємо залишки тільки для автоматичних перевірок
                     if not manual:
-                        logger.info(f"    СОХРАНЯЕМ ОСТАТКИ для товара ID {product['id']}: {stock_count}")
-                        try:
-                            success = self.db.update_product_stock(product['id'], stock_count)
-                            if success:
-                                logger.info(f"    ✅ УСПЕШНО сохранены остатки для товара {product['id']}")
-                            else:
-                                logger.error(f"    ❌ ОШИБКА сохранения остатков для товара {product['id']}")
-                        except Exception as stock_error:
-                            logger.error(
-                                f"    ❌ ИСКЛЮЧЕНИЕ при сохранении остатков товара {product['id']}: {stock_error}")
-                    else:
-                        logger.info(f"    Пропускаем сохранение остатков (manual=True)")
+                        pending_stocks.append((product['id'], stock_count, datetime.now()))
+
+                    if len(pending_products) + len(pending_stocks) >= SAVE_BATCH_SIZE:
+                        flush()
 
-                    results.append({
+                    results[i] = {
                         'name': updated_name or 'Без назви',
                         'success': True,
                         'stock': stock_count
-                    })
-
-                    logger.info(f"    ✅ Товар {i} обработан успешно")
+                    }
                 else:
-                    logger.error(f"    ❌ Ошибка проверки товара {i}: {result['error']}")
-                    results.append({
+                    logger.error(f"    ❌ Ошибка проверки товара {i + 1}: {result['error']}")
+                    results[i] = {
                         'name': product['name'],
                         'success': False,
                         'error': result['error']
-                    })
+                    }
 
             except Exception as e:
-                logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА для товара {i} ({product.get('name', 'Unknown')}): {e}")
+                logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА для товара {i + 1} ({product.get('name', 'Unknown')}): {e}")
                 logger.error(f"   URL: {product.get('url', 'Unknown')}")
                 import traceback
                 logger.error(f"   Traceback: {traceback.format_exc()}")
 
-                results.append({
+                results[i] = {
                     'name': product.get('name', 'Unknown'),
                     'success': False,
                     'error': str(e)
-                })
-
-                # НЕ ПРЕРЫВАЕМ цикл, продолжаем со следующим товаром
+                }
 
-            # Пауза між товарами
-            if i < len(products):
-                logger.info(f"    Пауза перед следующим товаром...")
-                await asyncio.sleep(2)
+        try:
+            await self.run_check_all([p['url'] for p in products], on_result=handle_result,
+                                     hints=self.stock_hints(products))
+        finally:
+            await asyncio.to_thread(flush)
 
+        stats = self.engine.last_stats
         logger.info(f"=== КОНЕЦ АВТОМАТИЧЕСКОЙ ПРОВЕРКИ ===")
         logger.info(f"Обработано товаров: {len(results)}")
+        logger.info(f"Записано в базу: товаров {saved['products']}, остатков {saved['stocks']}")
+        if saved['failed']:
+            logger.error(f"❌ Не удалось сохранить {saved['failed']} записей")
         success_count = sum(1 for r in results if r.get('success', False))
         logger.info(f"Успешно: {success_count}, Ошибок: {len(results) - success_count}")
+        if stats:
+            logger.info(f"Пропускная способность: {stats['per_minute']:.1f} товаров/мин за {stats['elapsed']:.1f} с, "
+                        f"запросов количества: {stats['probes']}")
+            if stats['aborted']:
+                logger.error(f"Проверка прервана предохранителем: {stats['aborted']}")
 
         return results
 
@@ -871,14 +1565,10 @@ class RozetkaTelegramBot:
     async def process_schedule_time(self, message: Message, state: FSMContext):
         time_text = message.text.strip()
         
-        # Проверяем формат времени
-        if not re.match(r'^\d{1,2}:\d{2}$', time_text):
-            await message.reply("❌ Неправильний формат часу. Використовуйте ГГ:ХХ (наприклад, 09:30)")
-            return
-        
         try:
-            # Проверяем валидность времени
-            time.fromisoformat(time_text + ":00")
+            # Проверяем формат и валидность времени
+            times = self.db.parse_schedule_times(time_text)
+            time_text = ", ".join(t.strftime('%H:%M') for t in times)
             
             self.db.set_schedule_time(time_text)
             await message.reply(f"✅ Час щоденної перевірки встановлено: {time_text}")
@@ -889,60 +1579,65 @@ class RozetkaTelegramBot:
         await state.clear()
 
 
+    @staticmethod
+    def due_slot(target_times: List[time], since: datetime, now: datetime) -> Optional[datetime]:
+        """Останній слот розкладу в проміжку (since, now] або None"""
+        due = None
+        day = since.date()
+        while day <= now.date():
+            for slot in target_times:
+                moment = datetime.combine(day, slot)
+                if since < moment <= now and (due is None or moment > due):
+                    due = moment
+            day += timedelta(days=1)
+        return due
+
     async def schedule_checker(self):
-        """Покращений планувальник з більш точною перевіркою часу"""
-        last_check_date = None
+        """Планувальник: запускає перевірку, якщо з минулого разу настав хоча б один слот розкладу.
+
+        Слоти, що настали під час перевірки або паузи, не губляться - вони виконуються
+        одразу після неї (кілька пропущених слотів об'єднуються в одну перевірку).
+        """
+        checked_until = datetime.now()  # слоти до цього моменту вже оброблені
         
         while True:
             try:
                 schedule_time = self.db.get_schedule_time()
                 if schedule_time:
                     now = datetime.now()
-                    current_date = now.date()
-                    current_time = now.time()
                     
                     # Парсимо час з бази
                     try:
-                        target_hour, target_minute = map(int, schedule_time.split(':'))
-                        target_time = time(target_hour, target_minute)
+                        target_times = self.db.parse_schedule_times(schedule_time)
                     except ValueError:
                         logger.error(f"Неправильний формат часу в базі: {schedule_time}")
                         await asyncio.sleep(60)
                         continue
                     
-                    # Перевіряємо чи потрібно запускати перевірку
-                    should_run = (
-                        current_date != last_check_date and  # Не запускали сьогодні
-                        current_time.hour == target_time.hour and 
-                        current_time.minute == target_time.minute
-                    )
+                    slot = self.due_slot(target_times, checked_until, now)
+                    checked_until = now
                     
-                    if should_run:
-                        logger.info(f"🕐 Запуск планової автоматичної перевірки о {schedule_time}")
+                    if slot:
+                        logger.info(f"🕐 Запуск планової автоматичної перевірки о {slot.strftime('%H:%M')}")
                         
                         try:
                             # Запускаємо перевірку всіх товарів
                             results = await self.check_all_products(manual=False)
                             
                             # Експортуємо в Excel після автоматичної перевірки
-                            self.db.export_to_excel()
-                            
-                            # Оновлюємо дату останньої перевірки
-                            last_check_date = current_date
+                            await self.update_history_file()
                             
                             success_count = sum(1 for r in results if r.get('success', False))
                             logger.info(f"✅ Автоматична перевірка завершена: {success_count}/{len(results)} товарів")
                             
                         except Exception as e:
                             logger.error(f"Помилка автоматичної перевірки: {e}")
-                        
-                        # Чекаємо 2 хвилини щоб не запускати повторно
-                        await asyncio.sleep(120)
                     else:
                         # Звичайна пауза
                         await asyncio.sleep(30)
                 else:
-                    # Якщо час не встановлено, чекаємо довше
+                    # Якщо час не встановлено, слоти за цей період не виконуються
+                    checked_until = datetime.now()
                     await asyncio.sleep(300)
                     
             except Exception as e:
@@ -952,7 +1647,10 @@ class RozetkaTelegramBot:
     async def start_bot(self):
         logger.info("Запуск Telegram бота")
         asyncio.create_task(self.schedule_checker())
-        await self.dp.start_polling(self.bot)
+        try:
+            await self.dp.start_polling(self.bot)
+        finally:
+            self.export_executor.shutdown(wait=False, cancel_futures=True)
 
 async def main():
     bot_instance = RozetkaTelegramBot()
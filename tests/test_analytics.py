@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from analytics import (StockMatrix, SalesStats, HistoryBuckets, forward_fill, cumulative_sum,
+                       window_sum, period_starts)
+
+nan = np.nan
+
+
+def days(*values):
+    return np.array(values, dtype='datetime64[D]')
+
+
+def test_forward_fill_keeps_leading_gaps():
+    values = np.array([[nan, 1, nan, 3, nan],
+                       [nan, nan, nan, nan, nan],
+                       [5, nan, nan, 0, nan]])
+    np.testing.assert_array_equal(forward_fill(values), [[nan, 1, 1, 3, 3],
+                                                         [nan, nan, nan, nan, nan],
+                                                         [5, 5, 5, 0, 0]])
+
+
+def test_window_sum_per_row_end_and_clipped_start():
+    cumulative = cumulative_sum(np.array([[1., 2., 3., 4.],
+                                          [10., 20., 30., 40.]]))
+    np.testing.assert_array_equal(window_sum(cumulative, np.array([3, 1]), 2), [7, 30])
+    # Вікно довше за початок рядка обрізається до першої колонки
+    np.testing.assert_array_equal(window_sum(cumulative, np.array([0, 2]), 5), [1, 60])
+
+
+def test_period_starts_week_is_monday():
+    dates = days('2026-10-12', '2026-10-15', '2026-10-18', '2026-10-19', '1970-01-01')
+    np.testing.assert_array_equal(period_starts(dates, 'week'),
+                                  days('2026-10-12', '2026-10-12', '2026-10-12', '2026-10-19', '1969-12-29'))
+
+
+def test_period_starts_month():
+    dates = days('2024-02-29', '2026-01-01', '2026-12-31')
+    np.testing.assert_array_equal(period_starts(dates, 'month'),
+                                  days('2024-02-01', '2026-01-01', '2026-12-01'))
+
+
+def test_period_starts_rejects_unknown_period():
+    with pytest.raises(ValueError):
+        period_starts(days('2026-01-01'), 'year')
+
+
+def test_sales_stats_velocity_skips_gaps_and_counts_restocks():
+    matrix = StockMatrix(np.array([0, 1]), ['a', 'b'], ['u1', 'u2'],
+                         np.arange(np.datetime64('2026-10-01'), np.datetime64('2026-10-06')),
+                         np.array([[10, 8, nan, 4, 9],
+                                   [nan, nan, 7, nan, nan]]))
+    stats = SalesStats(matrix, window=14)
+
+    a = stats.for_product(0)
+    assert (a['stock'], a['sold'], a['restocked'], a['restocks']) == (9, 6, 5, 1)
+    assert a['velocity'] == 1.5  # 6 шт. за 4 дні з даними
+    assert a['days_to_stockout'] == 6.0
+
+    b = stats.for_product(1)
+    assert (b['stock'], b['sold'], b['velocity']) == (7, 0, None)
+
+
+def test_history_buckets_by_week():
+    matrix = StockMatrix.from_histories(
+        ['a'], ['u1'],
+        [{'2026-10-16': 10, '2026-10-17': 6, '2026-10-19': 8, '2026-10-21': 3}])
+    buckets = HistoryBuckets(matrix, 'week')
+
+    assert buckets.labels == ['2026-W42', '2026-W43']
+    # last, min, max, sold для кожного тижня
+    assert buckets.for_product(0) == [6, 6, 10, 4, 3, 3, 8, 5]
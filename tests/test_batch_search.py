@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+from tg import RozetkaStockChecker
+
+
+class FakeCart(RozetkaStockChecker):
+    """Корзина без мережі: позиція з кількістю більше за залишок дає помилку 3002.
+
+    errors - як помилка вказує на позицію: 'purchase' (purchase_id), 'goods' (goods.id),
+    'none' (без прив'язки) або 'mixed' (випадково для кожної помилки).
+    """
+
+    def __init__(self, stocks, errors, seed=0):
+        self.debug = False
+        self.stocks = stocks
+        self.errors = errors
+        self.random = random.Random(seed)
+        self.quantities = {}
+        self.requests = 0
+
+    def add_many_to_cart(self, product_ids):
+        # Товар без залишку в корзину не додається
+        purchase_ids = {pid: 1000 + pid for pid in product_ids if self.stocks[pid] > 0}
+        self.quantities = {purchase_id: 1 for purchase_id in purchase_ids.values()}
+        return {'purchases': {'goods': []}}, purchase_ids
+
+    def update_quantities(self, quantities):
+        self.requests += 1
+        self.quantities.update(quantities)
+        errors = [{'code': 1001, 'message': 'інша помилка'}]
+        for purchase_id, quantity in self.quantities.items():
+            if quantity > self.stocks[purchase_id - 1000]:
+                errors.append(self._error(purchase_id))
+        self.random.shuffle(errors)
+        return {'error_messages': errors}
+
+    def _error(self, purchase_id):
+        kind = self.errors if self.errors != 'mixed' else self.random.choice(['purchase', 'goods', 'none'])
+        if kind == 'purchase':
+            return {'code': 3002, 'purchase_id': purchase_id}
+        if kind == 'goods':
+            return {'code': 3002, 'goods': {'id': purchase_id - 1000}}
+        return {'code': 3002, 'message': 'Недостатньо товару'}
+
+
+def expected(stocks):
+    return {pid: stock if stock > 0 else None for pid, stock in stocks.items()}
+
+
+@pytest.mark.parametrize('errors', ['purchase', 'goods', 'none', 'mixed'])
+@pytest.mark.parametrize('with_hints', [False, True])
+def test_random_batches_find_exact_stock(errors, with_hints):
+    rng = random.Random(f"{errors}-{with_hints}")
+    for seed in range(40):
+        size = rng.randint(1, 6)
+        stocks = {pid: rng.choice([0, 1, 2, rng.randint(3, 300), rng.randint(300, 10000)])
+                  for pid in range(1, size + 1)}
+        hints = None
+        if with_hints:
+            hints = {pid: max(0, stock + rng.randint(-5, 5)) for pid, stock in stocks.items()}
+        cart = FakeCart(stocks, errors, seed)
+
+        results, data = cart.binary_search_batch(list(stocks), hints=hints)
+
+        assert data is not None
+        assert results == expected(stocks), (stocks, hints)
+
+
+def test_attributed_errors_need_one_request_per_step():
+    stocks = {1: 40, 2: 7, 3: 900}
+    cart = FakeCart(stocks, 'purchase')
+    results, _ = cart.binary_search_batch(list(stocks))
+    assert results == expected(stocks)
+    assert cart.requests == max(cart.last_batch_probes.values())
+
+
+def test_unattributed_error_from_finished_item_does_not_mislead_others():
+    # Товар 1 уже знайдено; решта позицій не повинні отримати його помилку
+    stocks = {1: 1, 2: 5000}
+    cart = FakeCart(stocks, 'none')
+    results, _ = cart.binary_search_batch(list(stocks), hints={1: 1, 2: 4990})
+    assert results == expected(stocks)
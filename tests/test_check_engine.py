@@ -0,0 +1,39 @@
+import threading
+import time
+
+from tg import RateLimiter, StockCheckEngine
+
+
+class SlowChecker:
+    def __init__(self, release):
+        self.release = release
+
+    def check_product(self, url, last_stock=None):
+        # Прогін "висить", доки тест не відпустить його; окрема перевірка - миттєва
+        if url.startswith("run"):
+            self.release.wait(5)
+        return {"url": url, "max_stock": 1}
+
+
+def make_engine(release):
+    return StockCheckEngine(workers=2, checker_factory=lambda: SlowChecker(release),
+                            session_pool=object(), category_index=object(), rate_limiter=RateLimiter(rate=10),
+                            breakers={})
+
+
+def test_single_check_does_not_wait_for_running_catalog():
+    release = threading.Event()
+    engine = make_engine(release)
+    run = threading.Thread(target=engine.check_all, args=([f"run{i}" for i in range(20)],))
+    run.start()
+    try:
+        time.sleep(0.1)  # воркери прогону зайняті, решта каталогу в черзі
+        started = time.monotonic()
+        result = engine.submit("single").result(timeout=2)
+        assert result == {"url": "single", "max_stock": 1}
+        assert time.monotonic() - started < 1
+        assert run.is_alive()
+    finally:
+        release.set()
+        run.join()
+        engine.shutdown()
@@ -0,0 +1,100 @@
+import pytest
+
+import tg
+from tg import CircuitBreaker, CircuitOpenError
+
+
+class FakeTime:
+    """Керований годинник: sleep лише зсуває monotonic і запам'ятовує паузи"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(tg, "time", clock)
+    return clock
+
+
+def trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def test_closed_breaker_does_not_wait(clock):
+    breaker = CircuitBreaker("cart", failure_threshold=3, reset_timeout=10)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.before_request()
+    assert clock.sleeps == []
+
+
+def test_threshold_failures_open_with_doubling_pause(clock):
+    breaker = CircuitBreaker("cart", failure_threshold=3, reset_timeout=10, max_open=3)
+    trip(breaker)
+    breaker.before_request()
+    trip(breaker)
+    breaker.before_request()
+    assert clock.sleeps == [10, 20]
+
+
+def test_success_closes_and_cancels_pause(clock):
+    breaker = CircuitBreaker("cart", failure_threshold=3, reset_timeout=10)
+    trip(breaker)
+    breaker.record_success()
+    breaker.before_request()
+    assert clock.sleeps == []
+    assert breaker.open_count == 0
+
+
+def test_fast_fail_then_probe_then_closed(clock):
+    breaker = CircuitBreaker("cart", failure_threshold=1, reset_timeout=10, max_open=2)
+    trip(breaker)
+    breaker.before_request()  # перша пауза, 10 с
+    trip(breaker)  # друга поспіль - запобіжник вимкнено на 20 с
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    clock.now += 20
+
+    breaker.before_request()  # пробний запит
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()  # решта чекають на його результат
+
+    breaker.record_success()
+    breaker.before_request()
+    breaker.before_request()
+    assert clock.sleeps == [10]
+    assert breaker.open_count == 0
+
+
+def test_failed_probe_reopens_immediately(clock):
+    breaker = CircuitBreaker("cart", failure_threshold=5, reset_timeout=10, max_open=1)
+    trip(breaker)
+    clock.now += 10
+    breaker.before_request()  # пробний запит
+
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    clock.now += 10
+    breaker.before_request()
+
+
+def test_reset_clears_pause_before_next_run(clock):
+    breaker = CircuitBreaker("cart", failure_threshold=1, reset_timeout=10, max_open=3)
+    for _ in range(3):
+        trip(breaker)
+    breaker.reset()
+    breaker.before_request()
+    assert clock.sleeps == []
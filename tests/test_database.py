@@ -0,0 +1,112 @@
+from datetime import datetime
+
+import pytest
+
+from main import DatabaseManager
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DatabaseManager(str(tmp_path / "bot.db"))
+    yield db
+    db.close()
+
+
+def add(db, url="https://rozetka.com.ua/p1/", name="Товар"):
+    db.add_product(url, name, "Категорія")
+    return db.get_product_id_by_url(url)
+
+
+def count(db, table):
+    return db._connection().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_results_of_removed_product_are_dropped(db):
+    product_id = add(db)
+    assert db.remove_product_by_id(product_id)
+
+    assert db.save_check_results([(product_id, "Нова назва", "Нова категорія")],
+                                 [(product_id, 5, datetime(2026, 10, 1, 12))])
+    for table in ("products", "stock_history", "stock_samples", "latest_stock"):
+        assert count(db, table) == 0
+
+
+def test_check_results_rename_product_in_place(db):
+    product_id = add(db)
+    db.save_check_results([(product_id, "Нова назва", "Нова категорія")])
+
+    product = db.get_product_by_id(product_id)
+    assert (product["name"], product["category"]) == ("Нова назва", "Нова категорія")
+    assert count(db, "products") == 1
+
+
+def history(db, product_id):
+    return db._connection().execute(
+        "SELECT check_date, stock_count, min_stock, max_stock FROM stock_history "
+        "WHERE product_id = ? ORDER BY check_date", (product_id,)).fetchall()
+
+
+def latest(db, product_id):
+    return db._connection().execute(
+        "SELECT check_date, stock_count FROM latest_stock WHERE product_id = ?", (product_id,)).fetchone()
+
+
+def samples(db, product_id):
+    return [stock for _, stock in db.get_stock_samples(product_id)]
+
+
+def test_same_day_readings_update_daily_row(db):
+    product_id = add(db)
+    for hour, stock in ((9, 10), (12, 4), (18, 7)):
+        db.save_check_results(stocks=[(product_id, stock, datetime(2026, 10, 1, hour))])
+
+    assert history(db, product_id) == [("2026-10-01", 7, 4, 10)]
+    assert latest(db, product_id) == ("2026-10-01", 7)
+
+
+def test_older_date_does_not_override_latest_stock(db):
+    product_id = add(db)
+    db.save_check_results(stocks=[(product_id, 5, datetime(2026, 10, 10, 12))])
+    db.save_check_results(stocks=[(product_id, 8, datetime(2026, 10, 9, 12))])
+
+    assert latest(db, product_id) == ("2026-10-10", 5)
+    assert db.get_products()[0]["last_stock"] == 5
+
+
+def test_delete_recomputes_latest_stock(db):
+    product_id = add(db)
+    db.save_check_results(stocks=[(product_id, 8, datetime(2026, 10, 9, 12)),
+                                  (product_id, 5, datetime(2026, 10, 10, 12))])
+    with db._connection() as conn:
+        conn.execute("DELETE FROM stock_history WHERE product_id = ? AND check_date = '2026-10-10'",
+                     (product_id,))
+    assert latest(db, product_id) == ("2026-10-09", 8)
+
+    with db._connection() as conn:
+        conn.execute("DELETE FROM stock_history WHERE product_id = ?", (product_id,))
+    assert latest(db, product_id) is None
+
+
+def test_noop_writes_do_not_bump_data_version(db):
+    product_id = add(db)
+    db.save_check_results(stocks=[(product_id, 5, datetime(2026, 10, 1, 9))])
+    version = db.get_data_version()
+
+    db.save_check_results(stocks=[(product_id, 5, datetime(2026, 10, 1, 12))])
+    db.add_product("https://rozetka.com.ua/p1/", "Товар", "Категорія")
+    db.save_check_results([(product_id, "Товар", "Категорія")])
+    assert db.get_data_version() == version
+
+    db.save_check_results(stocks=[(product_id, 4, datetime(2026, 10, 1, 15))])
+    assert db.get_data_version() > version
+
+
+def test_unchanged_reading_adds_no_sample(db):
+    product_id = add(db)
+    for hour, stock in ((9, 5), (10, 5), (11, 3), (12, 3), (13, 5)):
+        db.save_check_results(stocks=[(product_id, stock, datetime(2026, 10, 1, hour))])
+    assert samples(db, product_id) == [5, 3, 5]
+
+    # Замір, що прийшов із запізненням, порівнюється з попереднім за часом
+    db.save_check_results(stocks=[(product_id, 5, datetime(2026, 10, 1, 9, 30))])
+    assert samples(db, product_id) == [5, 3, 5]
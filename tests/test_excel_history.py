@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+import tg
+from tg import ExcelHistory, load_existing_excel
+
+
+def item(url, stock, date="2026-10-01"):
+    return {'title': f"Товар {url}", 'url': url, 'category': "Категорія",
+            'last_checked': date, 'max_stock': stock}
+
+
+def source_of(items):
+    """source() для ExcelHistory.update: історія рівно з переданих товарів"""
+    def source():
+        dates = sorted({i['last_checked'] for i in items})
+        return dates, ({'name': i['title'], 'url': i['url'], 'category': i['category'],
+                        'dates': {i['last_checked']: i['max_stock']}} for i in items)
+    return source
+
+
+def urls(path):
+    return sorted(row['url'] for row in load_existing_excel(path))
+
+
+@pytest.fixture
+def history(tmp_path):
+    return ExcelHistory(str(tmp_path / "history.xlsx"))
+
+
+def test_stale_index_with_source_rebuilds_from_source(history):
+    first = [item("u1", 5), item("u2", 7)]
+    history.update(first, source=source_of(first))
+    assert urls(history.path) == ["u1", "u2"]
+
+    # Файл змінено поза ботом, а u2 тим часом видалено з бази
+    os.utime(history.path, ns=(0, 0))
+    current = [item("u1", 4, "2026-10-02")]
+    assert history.update(current, source=source_of(current)) == 1
+    assert urls(history.path) == ["u1"]
+
+
+def test_unchanged_items_do_not_rewrite_file(history):
+    items = [item("u1", 5)]
+    history.update(items, source=source_of(items))
+    stat = os.stat(history.path)
+    assert history.update(items, source=source_of(items)) == 0
+    assert os.stat(history.path).st_mtime_ns == stat.st_mtime_ns
+
+
+def test_failed_save_keeps_previous_file(history, monkeypatch):
+    items = [item("u1", 5)]
+    history.update(items, source=source_of(items))
+    with open(history.path, 'rb') as f:
+        before = f.read()
+
+    save = tg.openpyxl.Workbook.save
+
+    def broken_save(self, filename):
+        # Збереження обривається на півдорозі: на диску лишається обрізаний файл
+        save(self, filename)
+        with open(filename, 'r+b') as f:
+            f.truncate(2)
+        raise OSError("диск переповнено")
+
+    monkeypatch.setattr(tg.openpyxl.Workbook, "save", broken_save)
+    changed = [item("u1", 3, "2026-10-02")]
+    with pytest.raises(OSError):
+        history.update(changed, source=source_of(changed))
+
+    with open(history.path, 'rb') as f:
+        assert f.read() == before
+    assert not os.path.exists(history.path + '.tmp')
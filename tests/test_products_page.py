@@ -0,0 +1,69 @@
+import pytest
+
+from main import DatabaseManager
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DatabaseManager(str(tmp_path / "bot.db"))
+    # Однакові назви перевіряють порядок за id всередині назви
+    for i, name in enumerate(["Banana", "apple", "Cherry", "banana", "Apple", "date", "Elder"]):
+        db.add_product(f"https://rozetka.com.ua/p{i}/", name)
+    yield db
+    db.close()
+
+
+def names(page):
+    return [p['name'] for p in page[0]]
+
+
+def test_forward_pages_cover_all_products_in_order(db):
+    first = db.get_products_page(limit=3)
+    assert names(first) == ["Apple", "Banana", "Cherry"]
+    assert first[1:] == (False, True)
+
+    second = db.get_products_page(after_id=first[0][-1]['id'], limit=3)
+    assert names(second) == ["Elder", "apple", "banana"]
+    assert second[1:] == (True, True)
+
+    last = db.get_products_page(after_id=second[0][-1]['id'], limit=3)
+    assert names(last) == ["date"]
+    assert last[1:] == (True, False)
+
+
+def test_backward_page_returns_previous_page_in_order(db):
+    second = db.get_products_page(after_id=db.get_products_page(limit=3)[0][-1]['id'], limit=3)
+
+    previous = db.get_products_page(before_id=second[0][0]['id'], limit=3)
+    assert names(previous) == ["Apple", "Banana", "Cherry"]
+    assert previous[1:] == (False, True)
+
+    partial = db.get_products_page(before_id=second[0][1]['id'], limit=3)
+    assert names(partial) == ["Banana", "Cherry", "Elder"]
+    assert partial[1:] == (True, True)
+
+
+def test_stale_cursor_falls_back_to_first_page(db):
+    page = db.get_products_page(limit=3)
+    cursor = page[0][-1]['id']
+    assert db.remove_product_by_id(cursor)
+
+    assert names(db.get_products_page(after_id=cursor, limit=3)) == ["Apple", "Banana", "Elder"]
+    assert names(db.get_products_page(before_id=cursor, limit=3)) == ["Apple", "Banana", "Elder"]
+    assert names(db.get_products_page(after_id=10 ** 9, limit=3)) == ["Apple", "Banana", "Elder"]
+
+
+def test_empty_page_after_last_product_falls_back_to_first_page(db):
+    last = db.get_products_page(limit=100)[0][-1]
+    assert names(db.get_products_page(after_id=last['id'], limit=3)) == ["Apple", "Banana", "Cherry"]
+
+
+def test_search_is_case_insensitive_and_paged(db):
+    first = db.get_products_page(search="AN", limit=1)
+    assert names(first) == ["Banana"]
+    assert first[1:] == (False, True)
+
+    second = db.get_products_page(after_id=first[0][0]['id'], search="AN", limit=1)
+    assert names(second) == ["banana"]
+    assert second[1:] == (True, False)
+    assert db.count_products_matching("an") == 2
@@ -0,0 +1,33 @@
+import pytest
+
+from tg import StockSearch
+
+
+def run(search, stock):
+    while (quantity := search.next_quantity()) is not None:
+        assert 1 <= quantity <= search.upper_bound
+        search.record(quantity, quantity <= stock)
+    return search
+
+
+@pytest.mark.parametrize('stock', [0, 1, 2, 37, 500, 9999, 10000])
+def test_bisection_finds_stock(stock):
+    search = run(StockSearch(upper_bound=10000), stock)
+    assert search.result == stock
+    assert search.probes <= 14
+
+
+@pytest.mark.parametrize('hint, stock', [(50, 50), (50, 48), (50, 53), (50, 0), (0, 3), (10, 10000), (20000, 7)])
+def test_gallop_from_hint_finds_stock(hint, stock):
+    search = run(StockSearch(upper_bound=10000, hint=hint), stock)
+    assert search.result == stock
+
+
+def test_unchanged_hint_takes_two_probes():
+    assert run(StockSearch(upper_bound=10000, hint=120), 120).probes == 2
+
+
+def test_small_change_near_hint_is_cheaper_than_bisection():
+    with_hint = run(StockSearch(upper_bound=10000, hint=120), 117)
+    without_hint = run(StockSearch(upper_bound=10000), 117)
+    assert with_hint.probes < without_hint.probes
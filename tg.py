@@ -1,10 +1,20 @@
 import argparse
+import csv
+import gzip
+import json
 import os
+import random
 import re
+import sqlite3
 import sys
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+from analytics import StockMatrix, HistoryBuckets, HISTORY_PERIODS
+
 try:
     import cloudscraper
 except ImportError:
@@ -25,18 +35,485 @@ try:
 except ImportError:
     _HAVE_BS4 = False
 
+class StockSearch:
+    """Стан пошуку максимальної доступної кількості одного товару.
+
+    Без підказки - звичайна бісекція в межах 1..upper_bound.
+    З підказкою (останній відомий залишок) - галоп від підказки з кроком, що подвоюється,
+    доки значення не опиниться між двома межами, а далі бісекція між ними.
+    """
+
+    def __init__(self, upper_bound=10000, hint=None):
+        self.upper_bound = upper_bound
+        self.available = 0              # найбільша підтверджена доступна кількість
+        self.unavailable = upper_bound + 1  # найменша підтверджена недоступна кількість
+        self.probes = 0
+        self.step = 1
+        if hint is None:
+            self.mode = 'bisect'
+            self._next = None
+        else:
+            hint = max(0, min(int(hint), upper_bound))
+            self.mode = 'gallop'
+            self.direction = None
+            self._next = hint if hint > 0 else 1
+
+    @property
+    def done(self):
+        return self.unavailable - self.available <= 1
+
+    @property
+    def result(self):
+        return self.available
+
+    def next_quantity(self):
+        """Наступна кількість для перевірки або None, якщо пошук завершено"""
+        if self.done:
+            return None
+        if self._next is not None:
+            return self._next
+        return (self.available + self.unavailable) // 2
+
+    def record(self, quantity, is_available):
+        """Враховує відповідь корзини на кількість quantity"""
+        self.probes += 1
+        if is_available:
+            self.available = max(self.available, quantity)
+        else:
+            self.unavailable = min(self.unavailable, quantity)
+
+        if self._next is None:
+            return
+
+        # Галоп: перша відповідь задає напрямок, далі крок подвоюється до першої зміни відповіді
+        if self.direction is None:
+            self.direction = 'up' if is_available else 'down'
+        elif (self.direction == 'up') != is_available:
+            self._next = None
+            return
+        else:
+            self.step *= 2
+
+        if self.direction == 'up':
+            candidate = min(self.available + self.step, self.upper_bound)
+        else:
+            candidate = self.unavailable - self.step
+        if candidate <= self.available or candidate >= self.unavailable:
+            self._next = None
+        else:
+            self._next = candidate
+
+
+class CartSession:
+    """Сесія cloudscraper разом з її CSRF токеном (корзина прив'язана до cookies сесії)"""
+
+    def __init__(self, scraper, csrf_token=None):
+        self.scraper = scraper
+        self.csrf_token = csrf_token
+        self.created_at = time.time()
+
+    def expired(self, ttl):
+        return time.time() - self.created_at > ttl
+
+
+class RateLimiter:
+    """Спільний token bucket для всіх запитів до Rozetka з адаптивною швидкістю.
+
+    Поки відповіді здорові, швидкість повільно зростає (адитивно), на 429/403/сторінку
+    перевірки Cloudflare - падає вдвічі і додається пауза (або Retry-After від сервера).
+    """
+
+    THROTTLE_STATUSES = (403, 429, 503)
+    CHALLENGE_MARKERS = ('Just a moment', 'cf-chl', 'challenge-platform')
+
+    def __init__(self, rate=1.0, min_rate=0.2, max_rate=20.0, burst=2, increase=0.05, cooldown=5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, rate)
+        self.burst = burst
+        self.increase = increase
+        self.cooldown = cooldown
+        self.throttled = 0
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Чекає на вільний токен перед запитом"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def is_throttled(self, response):
+        if response.status_code in self.THROTTLE_STATUSES:
+            return True
+        if response.headers.get('cf-mitigated') == 'challenge':
+            return True
+        head = response.text[:2000] if response.status_code != 200 else ''
+        return any(marker in head for marker in self.CHALLENGE_MARKERS)
+
+    def feedback(self, response):
+        """Коригує швидкість за відповіддю сервера"""
+        if self.is_throttled(response):
+            retry_after = response.headers.get('Retry-After', '')
+            pause = float(retry_after) if retry_after.isdigit() else self.cooldown
+            self.slow_down(pause)
+        else:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def slow_down(self, pause=None):
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+            self._blocked_until = max(self._blocked_until, time.monotonic() + (pause or self.cooldown))
+        print(f"[RateLimiter] Сервер обмежує запити, швидкість знижено до {self.rate:.2f} запит/с")
+
+
+class CircuitOpenError(RuntimeError):
+    """Ендпоінт Rozetka вимкнено запобіжником після серії збоїв"""
+
+
+class CircuitBreaker:
+    """Запобіжник для одного ендпоінта, спільний для всіх воркерів.
+
+    Після failure_threshold збоїв поспіль ендпоінт "розмикається": усі запити до нього
+    чекають reset_timeout (пауза всього прогону), потім пробуються знову. Якщо запобіжник
+    розмикається max_open разів поспіль без жодного успіху - запити завершуються CircuitOpenError
+    без очікування, а після паузи пропускається один пробний запит (half-open): успіх замикає
+    запобіжник, збій - знову розмикає на ту ж паузу.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60, max_open=3):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_open = max_open
+        self.failures = 0
+        self.open_count = 0
+        self.opened_until = 0
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """Чекає, поки запобіжник розімкнено; кидає CircuitOpenError, якщо ендпоінт так і не ожив"""
+        with self._lock:
+            now = time.monotonic()
+            if self.open_count >= self.max_open:
+                if now < self.opened_until:
+                    raise CircuitOpenError(f"Ендпоінт '{self.name}' недоступний після {self.open_count} пауз")
+                # Пробний запит; решта отримують CircuitOpenError, поки він не завершиться
+                # (або до кінця ще однієї паузи, якщо результат так і не записано)
+                self.opened_until = now + self._open_timeout()
+                print(f"[CircuitBreaker] '{self.name}': пробний запит після паузи")
+                return
+            wait = self.opened_until - now
+        if wait > 0:
+            print(f"[CircuitBreaker] '{self.name}' розімкнено, пауза {wait:.0f} с")
+            time.sleep(wait)
+
+    def record_success(self):
+        # Успіх (у тому числі пробного запиту) замикає запобіжник і скасовує залишок паузи
+        self.reset()
+
+    def reset(self):
+        """Замкнути запобіжник: без збоїв, розмикань і паузи"""
+        with self._lock:
+            self.failures = 0
+            self.open_count = 0
+            self.opened_until = 0
+
+    def _open_timeout(self):
+        # Кожне наступне розмикання поспіль - удвічі довша пауза (до max_open-го)
+        return self.reset_timeout * 2 ** (min(self.open_count, self.max_open) - 1)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            # Збій пробного запиту одразу розмикає запобіжник знову
+            if self.failures < self.failure_threshold and self.open_count < self.max_open:
+                return
+            self.failures = 0
+            self.open_count = min(self.open_count + 1, self.max_open)
+            timeout = self._open_timeout()
+            self.opened_until = time.monotonic() + timeout
+        print(f"[CircuitBreaker] '{self.name}': {self.failure_threshold} збоїв поспіль, пауза {timeout} с")
+
+
+SESSION_FILENAME = "rozetka_session.json"
+
+
+class SessionPool:
+    """Пул прогрітих сесій з CSRF токенами, спільний для всіх чекерів.
+
+    Сесія видається одному чекеру на час перевірки товару і повертається назад,
+    тож головна сторінка і пошук токена виконуються раз на сесію, а не на кожен товар.
+    Якщо задано store_path, cookies і токен зберігаються у файл і підхоплюються після перезапуску.
+    """
+
+    def __init__(self, ttl=1800, max_idle=8, factory=None, store_path=None, save_interval=60):
+        self.ttl = ttl
+        self.max_idle = max_idle
+        self.factory = factory or cloudscraper.create_scraper
+        self.store_path = store_path
+        self.save_interval = save_interval
+        self._idle = []
+        self._lock = threading.Lock()
+        # Запис файлу сесії і перевірка save_interval - одним потоком за раз
+        self._save_lock = threading.Lock()
+        self._last_saved = 0
+        self._stored = None
+        if store_path:
+            stored = self._load_stored()
+            if stored:
+                self._idle.append(stored)
+                self._stored = stored
+
+    def create(self):
+        """Нова сесія без токена (токен отримає чекер при першому запиті до корзини)"""
+        return CartSession(self.factory())
+
+    def acquire(self):
+        with self._lock:
+            while self._idle:
+                session = self._idle.pop()
+                if not session.expired(self.ttl):
+                    return session
+        return self.create()
+
+    def release(self, session):
+        if session is None or session.expired(self.ttl):
+            return
+        if session.csrf_token:
+            self.save(session, throttle=True)
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(session)
+
+    def discard(self, session):
+        """Сесія з відхиленим токеном більше не повертається в пул"""
+        if session is None:
+            return
+        with self._lock:
+            if session in self._idle:
+                self._idle.remove(session)
+            stored = session is self._stored
+        if stored and self.store_path and os.path.exists(self.store_path):
+            try:
+                os.remove(self.store_path)
+            except OSError:
+                pass
+
+    def save(self, session, throttle=False):
+        """Зберігає cookies і CSRF токен сесії у файл (для теплого старту).
+
+        throttle - не частіше save_interval; якщо файл саме пише інший потік, збереження пропускається.
+        """
+        if not self.store_path or not session.csrf_token:
+            return
+        if not self._save_lock.acquire(blocking=not throttle):
+            return
+        try:
+            if throttle and time.time() - self._last_saved <= self.save_interval:
+                return
+            self._write_session(session)
+        finally:
+            self._save_lock.release()
+
+    def _write_session(self, session):
+        cookies = [
+            {
+                'name': c.name,
+                'value': c.value,
+                'domain': c.domain,
+                'path': c.path,
+                'expires': c.expires,
+                'secure': c.secure,
+            }
+            for c in session.scraper.cookies
+        ]
+        state = {
+            'csrf_token': session.csrf_token,
+            'created_at': session.created_at,
+            'expires_at': session.created_at + self.ttl,
+            'cookies': cookies,
+        }
+        tmp_path = self.store_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.store_path)
+            self._last_saved = time.time()
+            with self._lock:
+                self._stored = session
+        except (OSError, TypeError) as e:
+            print(f"[SessionPool] Не вдалося зберегти сесію: {e}")
+
+    def _load_stored(self):
+        if not os.path.exists(self.store_path):
+            return None
+        try:
+            with open(self.store_path, encoding='utf-8') as f:
+                state = json.load(f)
+            if not state.get('csrf_token') or state.get('expires_at', 0) <= time.time():
+                return None
+
+            scraper = self.factory()
+            for c in state.get('cookies', []):
+                scraper.cookies.set(c['name'], c['value'], domain=c.get('domain'), path=c.get('path') or '/',
+                                    expires=c.get('expires'), secure=c.get('secure', False))
+            session = CartSession(scraper, state['csrf_token'])
+            session.created_at = state.get('created_at', session.created_at)
+            return session
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            print(f"[SessionPool] Не вдалося завантажити збережену сесію: {e}")
+            return None
+
+
+CATEGORY_INDEX_FILENAME = "rozetka_categories.json"
+
+
+class CategoryIndex:
+    """Плоский індекс дерева категорій fat-menu: id -> (назва, шлях батьківських категорій).
+
+    Дерево завантажується не частіше ніж раз на max_age секунд і (якщо задано store_path)
+    зберігається у файл, тож пошук категорії - це звернення до словника.
+    """
+
+    API_URL = "https://common-api.rozetka.com.ua/v2/fat-menu/full?country=UA&lang=ua"
+
+    def __init__(self, store_path=None, max_age=86400):
+        self.store_path = store_path
+        self.max_age = max_age
+        self.categories = {}
+        self.fetched_at = 0
+        self.retry_after = 0
+        self._lock = threading.Lock()
+        if store_path:
+            self._load()
+
+    @property
+    def stale(self):
+        now = time.time()
+        return now - self.fetched_at > self.max_age and now >= self.retry_after
+
+    @staticmethod
+    def flatten(items):
+        """Обхід дерева без рекурсії: {id: (назва, [назви предків від кореня])}"""
+        index = {}
+        stack = [(item, []) for item in reversed(items or [])]
+        while stack:
+            item, path = stack.pop()
+            title = item.get('title', item.get('name', ''))
+            if item.get('id') is not None:
+                index[int(item['id'])] = (title, path)
+            children = item.get('children') or []
+            child_path = path + [title]
+            stack.extend((child, child_path) for child in reversed(children))
+        return index
+
+    def refresh(self, get, debug=False):
+        """Завантажує дерево функцією get(url, **kwargs), якщо індекс застарів (один потік завантажує, решта чекають)"""
+        with self._lock:
+            if not self.stale:
+                return True
+            # Після невдалої спроби не повторюємо завантаження для кожного товару
+            self.retry_after = time.time() + 600
+            try:
+                resp = get(self.API_URL, timeout=10)
+                if resp.status_code != 200:
+                    return False
+                self.categories = self.flatten(resp.json().get('data', []))
+                self.fetched_at = time.time()
+                self._save()
+                if debug:
+                    print(f"[CategoryIndex] Завантажено {len(self.categories)} категорій")
+                return True
+            except Exception as e:
+                if debug:
+                    print(f"[CategoryIndex] Помилка завантаження: {e}")
+                return False
+
+    def lookup(self, category_id):
+        """(назва, шлях) категорії або None"""
+        try:
+            return self.categories.get(int(category_id))
+        except (TypeError, ValueError):
+            return None
+
+    def _save(self):
+        if not self.store_path:
+            return
+        state = {
+            'fetched_at': self.fetched_at,
+            'categories': {str(cid): [title, path] for cid, (title, path) in self.categories.items()},
+        }
+        tmp_path = self.store_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, self.store_path)
+        except OSError as e:
+            print(f"[CategoryIndex] Не вдалося зберегти індекс: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.store_path):
+            return
+        try:
+            with open(self.store_path, encoding='utf-8') as f:
+                state = json.load(f)
+            self.categories = {int(cid): (title, path) for cid, (title, path) in state['categories'].items()}
+            self.fetched_at = state.get('fetched_at', 0)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[CategoryIndex] Не вдалося завантажити індекс: {e}")
+
+
+class ProductPage:
+    """Завантажена сторінка товару; BeautifulSoup-документ будується один раз і лише за потреби"""
+
+    def __init__(self, url, html, status_code):
+        self.url = url
+        self.html = html
+        self.status_code = status_code
+        self.fetched_at = time.time()
+        self._soup = None
+
+    @property
+    def soup(self):
+        if self._soup is None and _HAVE_BS4:
+            self._soup = BeautifulSoup(self.html, 'html.parser')
+        return self._soup
+
+
 class RozetkaStockChecker:
-    def __init__(self, debug=False, delay=2):
-        self.scraper = cloudscraper.create_scraper(
-            browser={
-                'browser': 'chrome',
-                'platform': 'windows',
-                'mobile': False,
-                'desktop': True
-            },
-            delay=10,
-            interpreter='js2py'
-        )
+    # Значення-заглушки parse_category_from_html, які не кешуються
+    UNKNOWN_CATEGORIES = ('Невідома категорія', 'Помилка отримання категорії')
+
+    # Повтори для ендпоінтів корзини і сторінок товарів
+    RETRY_ATTEMPTS = 3
+    RETRY_BASE_DELAY = 1.0
+    RETRY_MAX_DELAY = 30.0
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, debug=False, delay=2, session_pool=None, category_index=None, rate_limiter=None,
+                 breakers=None):
+        self.session_pool = session_pool or SessionPool()
+        self.breakers = breakers if breakers is not None else self.create_breakers()
+        self.category_index = category_index or CategoryIndex()
+        # delay - початковий інтервал між запитами, далі швидкість підлаштовується під відповіді
+        self.rate_limiter = rate_limiter or RateLimiter(rate=1 / delay if delay else RateLimiter().max_rate)
+        self.session = None
         self.base_headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -51,13 +528,107 @@ class RozetkaStockChecker:
         }
         self.debug = debug
         self.delay = delay
+        self.last_probes = 0
+        self.last_batch_probes = {}
+        self.page_cache = OrderedDict()
+        self.page_cache_size = 4
+        self.page_cache_ttl = 600
+        self.category_names = {}
         self.reset_session_state()
 
     def reset_session_state(self):
-        """Очищаємо стан сесії перед перевіркою нового товару"""
-        self.csrf_token = None
+        """Очищаємо стан корзини перед перевіркою нового товару, сесію беремо з пулу"""
+        if self.session is not None:
+            self.session.csrf_token = self.csrf_token
+            self.session_pool.release(self.session)
+        self._use_session(self.session_pool.acquire())
+
+    def _use_session(self, session):
+        self.session = session
+        self.scraper = session.scraper
+        self.csrf_token = session.csrf_token
         self.purchase_id = None
-        self.scraper = cloudscraper.create_scraper()
+
+    def refresh_session(self):
+        """Відкидаємо сесію, чий токен відхилило API корзини, і відкриваємо нову"""
+        if self.debug:
+            print("[CSRF] Токен відхилено, відкриваємо нову сесію")
+        self.session_pool.discard(self.session)
+        self._use_session(self.session_pool.create())
+
+    @staticmethod
+    def create_breakers():
+        """Запобіжники для ендпоінтів з повторами (спільні для всіх чекерів прогону)"""
+        return {'cart': CircuitBreaker('cart'), 'product-page': CircuitBreaker('product-page')}
+
+    def _request(self, method, url, endpoint=None, **kwargs):
+        """Усі запити до Rozetka проходять через спільний обмежувач швидкості.
+
+        Для endpoint ('cart', 'product-page') мережеві помилки, 429 і 5xx повторюються
+        з експоненційною затримкою і джитером, а результат рахується запобіжником ендпоінта.
+        """
+        breaker = self.breakers.get(endpoint) if endpoint else None
+        attempts = self.RETRY_ATTEMPTS if endpoint else 1
+        r = error = None
+
+        for attempt in range(attempts):
+            if breaker:
+                breaker.before_request()
+            self.rate_limiter.acquire()
+            try:
+                r = self.scraper.request(method, url, **kwargs)
+                error = None
+            except Exception as e:
+                r, error = None, e
+            else:
+                self.rate_limiter.feedback(r)
+                if r.status_code not in self.RETRY_STATUSES:
+                    if breaker:
+                        breaker.record_success()
+                    return r
+
+            if attempt < attempts - 1:
+                backoff = min(self.RETRY_MAX_DELAY, self.RETRY_BASE_DELAY * 2 ** attempt)
+                backoff = backoff / 2 + random.uniform(0, backoff / 2)
+                reason = error if error is not None else f"HTTP {r.status_code}"
+                print(f"[retry] {method} {url[:80]}: {reason}, повтор через {backoff:.1f} с "
+                      f"({attempt + 1}/{attempts - 1})")
+                time.sleep(backoff)
+
+        if breaker:
+            breaker.record_failure()
+        if error is not None:
+            raise error
+        return r
+
+    def _get(self, url, **kwargs):
+        return self._request('GET', url, **kwargs)
+
+    def _post(self, url, **kwargs):
+        return self._request('POST', url, **kwargs)
+
+    @staticmethod
+    def _is_token_rejected(r):
+        if r.status_code in (401, 403, 419):
+            return True
+        return r.status_code != 200 and 'csrf' in r.text[:500].lower()
+
+    def _cart_post(self, url, payload, retry_on_reject=True):
+        """POST до API корзини з CSRF токеном поточної сесії.
+
+        Якщо токен відхилено - сесія оновлюється, і (для retry_on_reject) запит повторюється
+        в новій сесії з порожньою корзиною.
+        """
+        headers = self.base_headers.copy()
+        headers['CSRF-Token'] = self.csrf_token
+        r = self._post(url, endpoint='cart', json=payload, headers=headers)
+        if self._is_token_rejected(r):
+            self.refresh_session()
+            if retry_on_reject:
+                self._ensure_csrf()
+                headers['CSRF-Token'] = self.csrf_token
+                r = self._post(url, endpoint='cart', json=payload, headers=headers)
+        return r
 
     def get_csrf_token(self):
         try:
@@ -69,7 +640,7 @@ class RozetkaStockChecker:
                 'Sec-Fetch-Dest': 'document',
                 'Upgrade-Insecure-Requests': '1'
             })
-            resp = self.scraper.get('https://rozetka.com.ua/', headers=headers, timeout=10)
+            resp = self._get('https://rozetka.com.ua/', headers=headers, timeout=10)
             resp.raise_for_status()
 
             cookies = self.scraper.cookies.get_dict()
@@ -101,7 +672,7 @@ class RozetkaStockChecker:
                     return True
 
             test_url = 'https://uss.rozetka.com.ua/session/cart-se/clear?country=UA&lang=ua'
-            test_resp = self.scraper.post(test_url, json={}, headers=self.base_headers, timeout=10)
+            test_resp = self._post(test_url, json={}, headers=self.base_headers, timeout=10)
             cookies = self.scraper.cookies.get_dict()
             for csrf_name in possible_csrf_names:
                 if csrf_name in cookies:
@@ -114,6 +685,8 @@ class RozetkaStockChecker:
                 print("[ДЕБАГ] CSRF токен не найден")
             return False
 
+        except CircuitOpenError:
+            raise
         except Exception as e:
             if self.debug:
                 print(f"[CSRF] Помилка: {e}")
@@ -128,6 +701,8 @@ class RozetkaStockChecker:
         if not self.csrf_token:
             if not self.get_csrf_token():
                 raise RuntimeError("Не вдалось отримати CSRF токен (_uss-csrf)")
+            self.session.csrf_token = self.csrf_token
+            self.session_pool.save(self.session)
 
     def clear_cart(self):
         """Очищаємо корзину перед додаванням нового товару"""
@@ -136,13 +711,12 @@ class RozetkaStockChecker:
                 return
             
             url = 'https://uss.rozetka.com.ua/session/cart-se/clear?country=UA&lang=ua'
-            headers = self.base_headers.copy()
-            headers['CSRF-Token'] = self.csrf_token
-            
-            r = self.scraper.post(url, json={}, headers=headers)
+            r = self._cart_post(url, {}, retry_on_reject=False)
             if self.debug:
                 print("[ДЕБАГ] clear_cart статус:", r.status_code)
                 print("[ДЕБАГ] clear_cart тіло:", r.text[:300])
+        except CircuitOpenError:
+            raise
         except Exception as e:
             if self.debug:
                 print(f"[clear_cart] Помилка: {e}")
@@ -153,12 +727,10 @@ class RozetkaStockChecker:
         self.clear_cart()
         
         url = 'https://uss.rozetka.com.ua/session/cart-se/add?country=UA&lang=ua'
-        headers = self.base_headers.copy()
-        headers['CSRF-Token'] = self.csrf_token
         payload = [{"goods_id": product_id, "quantity": 1}]
         
         try:
-            r = self.scraper.post(url, json=payload, headers=headers)
+            r = self._cart_post(url, payload)
             if self.debug:
                 print(f"[ДЕБАГ] add_to_cart статус для товару {product_id}:", r.status_code)
                 print("[ДЕБАГ] add_to_cart тіло:", r.text[:500])
@@ -180,6 +752,8 @@ class RozetkaStockChecker:
                     print("[ПОПЕРЕДЖЕННЯ] Порожня корзина після додавання")
                     return None
             return None
+        except CircuitOpenError:
+            raise
         except Exception as e:
             print(f"[add_to_cart] Помилка для товару {product_id}: {e}")
             return None
@@ -191,95 +765,266 @@ class RozetkaStockChecker:
             return None
             
         url = 'https://uss.rozetka.com.ua/session/cart-se/edit-quantity?country=UA&lang=ua'
-        headers = self.base_headers.copy()
-        headers['CSRF-Token'] = self.csrf_token
         payload = [{"purchase_id": self.purchase_id, "quantity": quantity}]
         
         try:
-            r = self.scraper.post(url, json=payload, headers=headers)
+            # Позиція корзини прив'язана до сесії, тож у новій сесії повторювати запит немає сенсу
+            r = self._cart_post(url, payload, retry_on_reject=False)
             if self.debug:
                 print(f"[ДЕБАГ] update_quantity({quantity}) статус:", r.status_code)
                 print("[ДЕБАГ] update_quantity тіло:", r.text[:500])
             if r.status_code == 200:
                 return r.json()
             return None
+        except CircuitOpenError:
+            raise
         except Exception as e:
             print(f"[update_quantity] Помилка: {e}")
             return None
 
-    def binary_search_max_stock(self, product_id, max_attempts=100, upper_bound=10000):
+    @staticmethod
+    def _is_not_enough(data, debug=False):
+        """Чи містить відповідь корзини помилку 3002 (недостатньо товару)"""
+        for err in data.get('error_messages') or []:
+            if debug:
+                print(f"[БП] Помилка: {err}")
+            if err.get('code') == 3002:
+                return True
+        return False
+
+    def binary_search_max_stock(self, product_id, max_attempts=100, upper_bound=10000, hint=None):
+        """Пошук максимальної кількості товару в корзині.
+
+        hint - останній відомий залишок товару; якщо задано, пошук починається з нього (галоп).
+        """
         if self.debug:
-            print(f"[БП] Починаємо бінарний пошук для товару {product_id}")
+            print(f"[БП] Починаємо пошук для товару {product_id} (підказка: {hint})")
         
         add_data = self.add_to_cart(product_id)
         if not add_data:
             print(f"[БП] Не вдалося додати товар {product_id} до корзини")
             return None, None
 
-        left, right = 1, upper_bound
-        max_available = 0
+        search = StockSearch(upper_bound=upper_bound, hint=hint)
 
         for attempt in range(max_attempts):
-            if left > right:
+            mid = search.next_quantity()
+            if mid is None:
                 break
                 
-            mid = (left + right) // 2
             if self.debug:
-                print(f"[БП] #{attempt+1} товар {product_id} -> тестуємо кількість {mid}")
+                print(f"[БП] #{attempt+1} товар {product_id} -> тестуємо кількість {mid} ({search.mode})")
                 
             data = self.update_quantity(mid)
             if not data:
-                if self.debug:
-                    print(f"[БП] Не отримано відповіді на {mid}")
-                break
-                
-            time.sleep(self.delay)
+                # Без відповіді межі пошуку невідомі - часткового результату не повертаємо
+                print(f"[БП] Не отримано відповіді на {mid} для товару {product_id}")
+                return None, add_data
             
-            errors = data.get('error_messages') or []
-            not_enough = False
+            not_enough = self._is_not_enough(data, self.debug)
+            search.record(mid, not not_enough)
+
+            if self.debug:
+                if not_enough:
+                    print(f"[БП] Недостатньо товару на {mid}, межі: {search.available}..{search.unavailable}")
+                else:
+                    print(f"[БП] {mid} товарів доступно, межі: {search.available}..{search.unavailable}")
+
+        self.last_probes = search.probes
+        print(f"[БП] Товар {product_id}: {search.result} шт., запитів кількості: {search.probes} (режим: {search.mode})")
             
-            for err in errors:
-                if self.debug:
-                    print(f"[БП] Помилка: {err}")
-                if err.get('code') == 3002:
-                    not_enough = True
+        return search.result, add_data
+
+    def add_many_to_cart(self, product_ids):
+        """Додає кілька товарів в одну корзину, повертає відповідь API та {product_id: purchase_id}"""
+        self._ensure_csrf()
+
+        self.clear_cart()
+
+        url = 'https://uss.rozetka.com.ua/session/cart-se/add?country=UA&lang=ua'
+        payload = [{"goods_id": product_id, "quantity": 1} for product_id in product_ids]
+
+        try:
+            r = self._cart_post(url, payload)
+            if self.debug:
+                print(f"[ДЕБАГ] add_many_to_cart статус для {len(product_ids)} товарів:", r.status_code)
+                print("[ДЕБАГ] add_many_to_cart тіло:", r.text[:500])
+
+            if r.status_code != 200:
+                return None, {}
+            data = r.json()
+            purchase_ids = {}
+            for item in data.get('purchases', {}).get('goods') or []:
+                goods_id = item.get('goods', {}).get('id')
+                if goods_id in product_ids:
+                    purchase_ids[goods_id] = item['id']
+
+            missing = [pid for pid in product_ids if pid not in purchase_ids]
+            if missing:
+                print(f"[ПОПЕРЕДЖЕННЯ] Товари {missing} не знайдено в корзині")
+            return data, purchase_ids
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            print(f"[add_many_to_cart] Помилка для товарів {product_ids}: {e}")
+            return None, {}
+
+    def update_quantities(self, quantities):
+        """Змінює кількість для кількох позицій корзини одним запитом ({purchase_id: quantity})"""
+        if not quantities or not self.csrf_token:
+            return None
+
+        url = 'https://uss.rozetka.com.ua/session/cart-se/edit-quantity?country=UA&lang=ua'
+        payload = [{"purchase_id": purchase_id, "quantity": quantity}
+                   for purchase_id, quantity in quantities.items()]
+
+        try:
+            r = self._cart_post(url, payload, retry_on_reject=False)
+            if self.debug:
+                print(f"[ДЕБАГ] update_quantities({quantities}) статус:", r.status_code)
+                print("[ДЕБАГ] update_quantities тіло:", r.text[:500])
+            if r.status_code == 200:
+                return r.json()
+            return None
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            print(f"[update_quantities] Помилка: {e}")
+            return None
+
+    @staticmethod
+    def _not_enough_purchases(data, purchase_ids):
+        """Розбирає помилки 3002 по позиціях корзини.
+
+        Повертає (множина purchase_id з нестачею, кількість помилок 3002 без прив'язки до позиції).
+        purchase_ids - {product_id: purchase_id} для зіставлення помилок, що посилаються на товар.
+        """
+        by_goods = dict(purchase_ids)
+        known = set(purchase_ids.values())
+        flagged = set()
+        unattributed = 0
+
+        for err in data.get('error_messages') or []:
+            if err.get('code') != 3002:
+                continue
+            purchase = err.get('purchase') if isinstance(err.get('purchase'), dict) else {}
+            goods = err.get('goods') if isinstance(err.get('goods'), dict) else {}
+            candidates = [
+                (err.get('purchase_id'), False),
+                (purchase.get('id'), False),
+                (err.get('id'), False),
+                (err.get('goods_id'), True),
+                (goods.get('id'), True),
+            ]
+            for value, is_goods in candidates:
+                purchase_id = by_goods.get(value) if is_goods else value
+                if purchase_id in known:
+                    flagged.add(purchase_id)
                     break
-                    
-            if not_enough:
-                right = mid - 1
-                if self.debug:
-                    print(f"[БП] Недостатньо товару на {mid}, зменшуємо праву межу до {right}")
             else:
-                max_available = mid
-                left = mid + 1
+                unattributed += 1
+
+        return flagged, unattributed
+
+    def binary_search_batch(self, product_ids, hints=None, max_attempts=100, upper_bound=10000):
+        """Паралельний пошук кількості для кількох товарів в одній корзині.
+
+        На кожному кроці всі незавершені товари отримують свою наступну кількість
+        в одному запиті edit-quantity. Повертає ({product_id: max_stock або None}, add_data).
+        """
+        hints = hints or {}
+        add_data, purchase_ids = self.add_many_to_cart(product_ids)
+        if not add_data:
+            print(f"[БП] Не вдалося додати товари {product_ids} до корзини")
+            return {pid: None for pid in product_ids}, None
+
+        searches = {pid: StockSearch(upper_bound=upper_bound, hint=hints.get(pid)) for pid in purchase_ids}
+        failed = set()
+        requests_sent = 0
+
+        for attempt in range(max_attempts):
+            pending = {pid: search.next_quantity() for pid, search in searches.items() if pid not in failed}
+            pending = {pid: quantity for pid, quantity in pending.items() if quantity is not None}
+            if not pending:
+                break
+
+            data = self.update_quantities({purchase_ids[pid]: q for pid, q in pending.items()})
+            requests_sent += 1
+            if not data:
+                print(f"[БП] Не отримано відповіді на пакет {pending}")
+                failed.update(pending)
+                break
+
+            flagged, unattributed = self._not_enough_purchases(data, purchase_ids)
+            if unattributed:
+                # Помилку не вдалося зіставити з позицією (вона могла прийти і від товару, чий пошук
+                # уже завершено) - перевіряємо кожен товар окремо, а решту позицій корзини повертаємо
+                # до підтвердженої кількості (1 шт. підтверджено додаванням у корзину), тож помилка
+                # у відповіді може належати лише товару, що перевіряється
                 if self.debug:
-                    print(f"[БП] {mid} товарів доступно, збільшуємо ліву межу до {left}")
+                    print(f"[БП] {unattributed} помилок 3002 без позиції, перевіряємо {len(pending)} товарів окремо")
+                safe = {purchase_ids[pid]: max(search.available, 1) for pid, search in searches.items()}
+                for pid, quantity in pending.items():
+                    single = self.update_quantities({**safe, purchase_ids[pid]: quantity})
+                    requests_sent += 1
+                    if not single:
+                        failed.add(pid)
+                        continue
+                    single_flagged, single_unattributed = self._not_enough_purchases(single, purchase_ids)
+                    searches[pid].record(quantity, purchase_ids[pid] not in single_flagged and not single_unattributed)
+                continue
+
+            for pid, quantity in pending.items():
+                searches[pid].record(quantity, purchase_ids[pid] not in flagged)
+
+        results = {pid: None for pid in product_ids}
+        for pid, search in searches.items():
+            if pid not in failed:
+                results[pid] = search.result
+        self.last_batch_probes = {pid: search.probes for pid, search in searches.items()}
+
+        print(f"[БП] Пакет з {len(product_ids)} товарів: запитів кількості {requests_sent}, "
+              f"результати: {results}")
+        return results, add_data
+
+    def fetch_product_page(self, product_url):
+        """Завантажує сторінку товару один раз за перевірку (кеш за URL з обмеженим розміром і TTL)"""
+        page = self.page_cache.get(product_url)
+        if page is not None and time.time() - page.fetched_at < self.page_cache_ttl:
+            self.page_cache.move_to_end(product_url)
+            return page
+
+        # Добавляем больше заголовков для сервера
+        headers = self.base_headers.copy()
+        headers.update({
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Cache-Control': 'no-cache',
+            'Pragma': 'no-cache',
+            'DNT': '1',
+            'Connection': 'keep-alive',
+            'Sec-Fetch-Dest': 'document',
+            'Sec-Fetch-Mode': 'navigate',
+            'Sec-Fetch-Site': 'same-origin'
+        })
+
+        resp = self._get(product_url, endpoint='product-page', headers=headers, timeout=20)
+        resp.raise_for_status()
+        page = ProductPage(product_url, resp.text, resp.status_code)
+
+        self.page_cache[product_url] = page
+        while len(self.page_cache) > self.page_cache_size:
+            self.page_cache.popitem(last=False)
 
         if self.debug:
-            print(f"[БП] Результат для товару {product_id}: {max_available}")
-            
-        return max_available, add_data
+            print(f"[fetch_product_page] HTML получен для {product_url}, размер: {len(page.html)} символов")
+        return page
 
     def parse_category_from_html(self, product_url, category_id):
         """Парсинг категории ТОЛЬКО из HTML без API вызовов"""
         try:
-            # Добавляем больше заголовков для сервера
-            headers = self.base_headers.copy()
-            headers.update({
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Cache-Control': 'no-cache',
-                'Pragma': 'no-cache',
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Sec-Fetch-Dest': 'document',
-                'Sec-Fetch-Mode': 'navigate',
-                'Sec-Fetch-Site': 'same-origin'
-            })
-            
-            resp = self.scraper.get(product_url, headers=headers, timeout=20)
-            resp.raise_for_status()
-            html = resp.text
+            page = self.fetch_product_page(product_url)
+            html = page.html
 
             # Сохраняем HTML для отладки (особенно важно на сервере)
             if self.debug:
@@ -294,12 +1039,12 @@ class RozetkaStockChecker:
 
             if self.debug:
                 print(f"[parse_category] Ищем категорию ID: {category_id} для URL: {product_url}")
-                print(f"[parse_category] Статус ответа: {resp.status_code}")
+                print(f"[parse_category] Статус ответа: {page.status_code}")
 
             # Проверяем, есть ли BeautifulSoup
             if _HAVE_BS4:
                 try:
-                    soup = BeautifulSoup(html, 'html.parser')
+                    soup = page.soup
                     
                     # ПРИОРИТЕТНЫЕ селекторы (в порядке важности)
                     priority_selectors = [
@@ -415,6 +1160,8 @@ class RozetkaStockChecker:
 
             return "Невідома категорія"
             
+        except CircuitOpenError:
+            raise
         except Exception as e:
             if self.debug:
                 print(f"[parse_category] КРИТИЧЕСКАЯ ошибка: {e}")
@@ -422,6 +1169,14 @@ class RozetkaStockChecker:
                 traceback.print_exc()
             return "Помилка отримання категорії"
 
+    def get_cached_category(self, category_id):
+        """Назва категорії з кешу (у базовому класі - кеш у пам'яті чекера)"""
+        return self.category_names.get(category_id)
+
+    def cache_category(self, category_id, name):
+        """Запам'ятовує назву категорії для наступних товарів цієї категорії"""
+        self.category_names[category_id] = name
+
     def get_product_meta(self, product_url, add_data, product_id):
         """ИСПРАВЛЕННАЯ функция получения метаданных товара с дополнительной отладкой"""
         title = None
@@ -458,20 +1213,11 @@ class RozetkaStockChecker:
                 if self.debug:
                     print(f"[get_product_meta] Парсим HTML для получения недостающих данных")
                 
-                headers = self.base_headers.copy()
-                headers.update({
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                    'Cache-Control': 'no-cache'
-                })
-                
-                resp = self.scraper.get(original_url, headers=headers, timeout=20)
-                html = resp.text
-                
-                if self.debug:
-                    print(f"[get_product_meta] HTML получен, размер: {len(html)} символов")
+                page = self.fetch_product_page(original_url)
+                html = page.html
                 
                 if not title and _HAVE_BS4:
-                    soup = BeautifulSoup(html, 'html.parser')
+                    soup = page.soup
                     
                     # Селекторы для названия товара
                     title_selectors = [
@@ -532,6 +1278,8 @@ class RozetkaStockChecker:
                                     print(f"[get_product_meta] category_id найден в HTML: {category_id}")
                                 break
                     
+            except CircuitOpenError:
+                raise
             except Exception as e:
                 if self.debug:
                     print(f"[get_product_meta] Ошибка парсинга HTML: {e}")
@@ -542,15 +1290,30 @@ class RozetkaStockChecker:
             if self.debug:
                 print(f"[get_product_meta] Получаем название категории для ID: {category_id}")
             
-            category_name = self.parse_category_from_html(product_url, category_id)
-            
-            if not category_name or category_name in ['Невідома категорія', 'Помилка отримання категорії']:
+            category_name = self.get_cached_category(category_id)
+            if category_name:
                 if self.debug:
-                    print(f"[get_product_meta] Пробуем альтернативный URL для получения категории")
-                
-                # Пробуем другие URL если есть
-                if product_url != original_url:
+                    print(f"[get_product_meta] Категория из кеша: '{category_name}'")
+            else:
+                found = self.lookup_category(category_id)
+                if found and found[0]:
+                    category_name = found[0]
+                    if self.debug:
+                        print(f"[get_product_meta] Категория из fat-menu: '{category_name}' ({' > '.join(found[1])})")
+                else:
+                    # Сначала страница, которая уже могла быть загружена для названия
                     category_name = self.parse_category_from_html(original_url, category_id)
+                
+                if not category_name or category_name in self.UNKNOWN_CATEGORIES:
+                    if self.debug:
+                        print(f"[get_product_meta] Пробуем альтернативный URL для получения категории")
+                    
+                    # Пробуем другие URL если есть
+                    if product_url != original_url:
+                        category_name = self.parse_category_from_html(product_url, category_id)
+
+                if category_name and category_name not in self.UNKNOWN_CATEGORIES:
+                    self.cache_category(category_id, category_name)
         
         if self.debug:
             print(f"[get_product_meta] ИТОГОВЫЙ результат:")
@@ -561,39 +1324,22 @@ class RozetkaStockChecker:
         return title, category_name
 
 
+    def lookup_category(self, category_id):
+        """(назва, шлях) категорії з індексу fat-menu, індекс оновлюється раз на добу"""
+        if self.category_index.stale:
+            self.category_index.refresh(self._get, self.debug)
+        return self.category_index.lookup(category_id)
+
     def get_category_from_api(self, category_id):
         """Спроба отримати категорію через API Rozetka"""
-        try:
-            api_url = f"https://common-api.rozetka.com.ua/v2/fat-menu/full?country=UA&lang=ua"
-            resp = self.scraper.get(api_url, timeout=10)
-            
-            if resp.status_code == 200:
-                data = resp.json()
-                
-                def find_category_recursive(items, target_id):
-                    for item in items:
-                        if item.get('id') == target_id:
-                            return item.get('title', item.get('name', ''))
-                        
-                        children = item.get('children', [])
-                        if children:
-                            result = find_category_recursive(children, target_id)
-                            if result:
-                                return result
-                    return None
-                
-                result = find_category_recursive(data.get('data', []), category_id)
-                if result:
-                    return result
-                    
-        except Exception as e:
-            if self.debug:
-                print(f"[get_category_from_api] Помилка: {e}")
-        
-        return None
+        found = self.lookup_category(category_id)
+        return found[0] if found else None
 
-    def check_product(self, product_url):
-        """Основная функция проверки товара с улучшенной обработкой ошибок"""
+    def check_product(self, product_url, last_stock=None):
+        """Основная функция проверки товара с улучшенной обработкой ошибок
+
+        last_stock - последний известный остаток товара, ускоряет поиск количества.
+        """
         # Сбрасываем состояние сессии
         self.reset_session_state()
         
@@ -612,13 +1358,18 @@ class RozetkaStockChecker:
         print(f"=== Проверяем товар ID {product_id}: {product_url}")
         
         # Получаем максимальное количество товара
-        max_stock, add_data = self.binary_search_max_stock(product_id)
+        self.last_probes = 0
+        max_stock, add_data = self.binary_search_max_stock(product_id, hint=last_stock)
         if max_stock is None:
             error_msg = "Не удалось определить количество товара"
             if self.debug:
                 print(f"[check_product] ОШИБКА: {error_msg}")
             return {"error": error_msg, "url": product_url, "product_id": product_id}
 
+        return self._build_result(product_url, product_id, max_stock, add_data, self.last_probes)
+
+    def _build_result(self, product_url, product_id, max_stock, add_data, probes):
+        """Добирает метаданные товара и формирует словарь результата проверки"""
         if self.debug:
             print(f"[check_product] Максимальное количество: {max_stock}")
             print(f"[check_product] Получаем метаданные товара...")
@@ -626,6 +1377,8 @@ class RozetkaStockChecker:
         # Получаем метаданные товара
         try:
             title, category_name = self.get_product_meta(product_url, add_data, product_id)
+        except CircuitOpenError:
+            raise
         except Exception as e:
             if self.debug:
                 print(f"[check_product] ОШИБКА получения метаданных: {e}")
@@ -640,6 +1393,7 @@ class RozetkaStockChecker:
             "title": title or 'Без названия',
             "category": category_name or 'Без категории',
             "max_stock": max_stock,
+            "probes": probes,
         }
         
         if self.debug:
@@ -651,11 +1405,182 @@ class RozetkaStockChecker:
         print(f"✅ Результат для товара {product_id}: {max_stock} шт. | {title or 'Без названия'} | {category_name or 'Без категории'}")
         return result
 
+    def check_products_batch(self, product_urls, last_stocks=None):
+        """Проверка нескольких товаров через одну корзину (пакетный бинарный поиск)
+
+        last_stocks - словарь url -> последний известный остаток. Результаты в порядке product_urls.
+        """
+        self.reset_session_state()
+        last_stocks = last_stocks or {}
+
+        results = [None] * len(product_urls)
+        product_ids = {}
+        for i, product_url in enumerate(product_urls):
+            product_id = self.extract_product_id(product_url)
+            if not product_id:
+                results[i] = {"error": "Не удалось извлечь ID товара из URL", "url": product_url}
+            else:
+                product_ids[i] = product_id
+
+        if not product_ids:
+            return results
+
+        print(f"=== Проверяем пакет из {len(product_ids)} товаров: {list(product_ids.values())}")
+        hints = {pid: last_stocks.get(product_urls[i]) for i, pid in product_ids.items()}
+        self.last_batch_probes = {}
+        stocks, add_data = self.binary_search_batch(list(dict.fromkeys(product_ids.values())), hints=hints)
+
+        for i, product_id in product_ids.items():
+            max_stock = stocks.get(product_id)
+            if max_stock is None:
+                results[i] = {"error": "Не удалось определить количество товара",
+                              "url": product_urls[i], "product_id": product_id}
+                continue
+            results[i] = self._build_result(product_urls[i], product_id, max_stock, add_data,
+                                            self.last_batch_probes.get(product_id, 0))
+        return results
+
+class StockCheckEngine:
+    """Паралельна перевірка товарів: кожен воркер має власний чекер (свою сесію, CSRF та корзину)"""
+
+    def __init__(self, workers=4, debug=False, delay=2, checker_factory=None, batch_size=1,
+                 session_pool=None, category_index=None, rate_limiter=None, breakers=None):
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+        self.session_pool = session_pool or SessionPool(max_idle=self.workers, store_path=SESSION_FILENAME)
+        self.category_index = category_index or CategoryIndex(store_path=CATEGORY_INDEX_FILENAME)
+        # Один обмежувач на всіх воркерів: стартова швидкість - по одному запиту на delay секунд на воркер
+        self.rate_limiter = rate_limiter or RateLimiter(rate=self.workers / delay if delay else 20.0)
+        self.breakers = breakers if breakers is not None else RozetkaStockChecker.create_breakers()
+        self.checker_factory = checker_factory or (
+            lambda: RozetkaStockChecker(debug=debug, delay=delay, session_pool=self.session_pool,
+                                        category_index=self.category_index, rate_limiter=self.rate_limiter,
+                                        breakers=self.breakers))
+        self.last_stats = None
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='rozetka-check')
+        # Окремі перевірки (/add) мають свій потік: черга check_all може містити весь каталог
+        self._single_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rozetka-single')
+
+    def _get_checker(self):
+        """Чекер поточного потоку (створюється при першому зверненні)"""
+        checker = getattr(self._local, 'checker', None)
+        if checker is None:
+            checker = self.checker_factory()
+            self._local.checker = checker
+        return checker
+
+    @staticmethod
+    def _aborted_result(url, reason):
+        return {"error": f"Перевірку зупинено: {reason}", "url": url}
+
+    @staticmethod
+    def _abort(run, error):
+        """Зупиняє прогін check_all (run - його стан); окрема перевірка (run=None) просто завершується помилкою"""
+        if run is not None:
+            # Ендпоінт так і не ожив - решта каталогу не витрачає запити даремно
+            run['abort_reason'] = str(error)
+            print(f"[engine] {error}, решта товарів пропускається")
+        return str(error)
+
+    def _check(self, url, hint=None, run=None):
+        if run is not None and run['abort_reason']:
+            return self._aborted_result(url, run['abort_reason'])
+        try:
+            return self._get_checker().check_product(url, last_stock=hint)
+        except CircuitOpenError as e:
+            return self._aborted_result(url, self._abort(run, e))
+        except Exception as e:
+            print(f"[engine] Помилка перевірки {url}: {e}")
+            return {"error": str(e), "url": url}
+
+    def _check_batch(self, urls, hints, run=None):
+        if run is not None and run['abort_reason']:
+            return [self._aborted_result(url, run['abort_reason']) for url in urls]
+        try:
+            return self._get_checker().check_products_batch(urls, last_stocks=hints)
+        except CircuitOpenError as e:
+            reason = self._abort(run, e)
+            return [self._aborted_result(url, reason) for url in urls]
+        except Exception as e:
+            print(f"[engine] Помилка перевірки пакета {urls}: {e}")
+            return [{"error": str(e), "url": url} for url in urls]
+
+    def submit(self, url, hint=None):
+        """Перевірка одного товару в окремому потоці (не чекає на прогін check_all),
+        повертає Future з результатом check_product"""
+        return self._single_executor.submit(self._check, url, hint)
+
+    def check_all(self, urls, on_result=None, hints=None):
+        """Перевіряє всі URL паралельно, результати повертаються в порядку вхідного списку.
+
+        on_result(index, url, result) викликається в потоці, що викликав check_all,
+        одразу після завершення кожного товару. hints - словник url -> останній відомий залишок.
+        """
+        urls = list(urls)
+        hints = hints or {}
+        results = [None] * len(urls)
+        started = time.monotonic()
+        # Стан саме цього прогону: зупинка не зачіпає окремі перевірки (/add) і наступні прогони
+        run = {'abort_reason': None}
+        for breaker in self.breakers.values():
+            breaker.reset()
+
+        if self.batch_size > 1:
+            # Пакетний режим: одна корзина і спільні запити edit-quantity на batch_size товарів
+            futures = {}
+            for start in range(0, len(urls), self.batch_size):
+                chunk = urls[start:start + self.batch_size]
+                chunk_hints = {url: hints[url] for url in chunk if url in hints}
+                future = self._executor.submit(self._check_batch, chunk, chunk_hints, run)
+                futures[future] = list(range(start, start + len(chunk)))
+        else:
+            futures = {self._executor.submit(self._check, url, hints.get(url), run): [i]
+                       for i, url in enumerate(urls)}
+
+        for future in as_completed(futures):
+            indexes = futures[future]
+            chunk_results = future.result() if self.batch_size > 1 else [future.result()]
+            for i, result in zip(indexes, chunk_results):
+                results[i] = result
+                if on_result:
+                    try:
+                        on_result(i, urls[i], result)
+                    except Exception as e:
+                        print(f"[engine] Помилка обробки результату {urls[i]}: {e}")
+
+        elapsed = time.monotonic() - started
+        errors = sum(1 for r in results if 'error' in r)
+        probes = sum(r.get('probes', 0) for r in results)
+        self.last_stats = {
+            'probes': probes,
+            'total': len(urls),
+            'success': len(urls) - errors,
+            'errors': errors,
+            'workers': self.workers,
+            'batch_size': self.batch_size,
+            'rate': self.rate_limiter.rate,
+            'throttled': self.rate_limiter.throttled,
+            'aborted': run['abort_reason'],
+            'elapsed': elapsed,
+            'per_minute': len(urls) / elapsed * 60 if elapsed > 0 else 0.0,
+        }
+        print(f"[engine] Перевірено {len(urls)} товарів за {elapsed:.1f} с "
+              f"({self.last_stats['per_minute']:.1f} товарів/хв, воркерів: {self.workers}, помилок: {errors}, "
+              f"запитів кількості: {probes}, швидкість: {self.rate_limiter.rate:.2f} запит/с)")
+        return results
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+        self._single_executor.shutdown(wait=wait)
+
 EXCEL_FILENAME = "rozetka_stock_history.xlsx"
 EXCEL_FIELDS = ["name", "url", "category", "last_checked", "max_stock"]
+# Заголовки "широкого" формату, який пише save_excel_with_formatting (далі - колонки з датами)
+EXCEL_WIDE_HEADERS = ["Назва", "URL", "Категорія"]
 
-def load_existing_excel(path: str):
-    """Загружает данные из Excel в список словарей"""
+def load_existing_excel(path: str, raise_errors: bool = False):
+    """Загружает данные из Excel в список словарей (raise_errors - не глушить ошибки чтения)"""
     if not os.path.exists(path):
         return []
     
@@ -674,6 +1599,11 @@ def load_existing_excel(path: str):
         if not headers:
             return []
         
+        if headers[:len(EXCEL_WIDE_HEADERS)] == EXCEL_WIDE_HEADERS:
+            data = _load_wide_rows(worksheet, headers)
+            workbook.close()
+            return data
+        
         data = []
         for row in worksheet.iter_rows(min_row=2, values_only=True):
             if not any(row):
@@ -694,18 +1624,127 @@ def load_existing_excel(path: str):
         return data
         
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"[ПОПЕРЕДЖЕННЯ] Не вдалося завантажити існуючий Excel файл: {e}")
         print("Створюємо новий файл...")
         return []
 
-def save_excel_with_formatting(path: str, data_list):
-    """Сохраняет список словарей в Excel с форматированием"""
-    if not data_list:
-        print("[ПОПЕРЕДЖЕННЯ] Список даних порожній, створюємо файл тільки з заголовками")
-        data_list = []
+def _load_wide_rows(worksheet, headers):
+    """Розгортає широкий формат (товар x дати) в рядки EXCEL_FIELDS, по одному на замір"""
+    dates = []
+    for header in headers[len(EXCEL_WIDE_HEADERS):]:
+        dates.append(header.strftime('%Y-%m-%d') if hasattr(header, 'strftime') else str(header).split(' ')[0])
     
+    data = []
+    for row in worksheet.iter_rows(min_row=2, values_only=True):
+        if not row or not any(row):
+            continue
+        name, url, category = (list(row[:3]) + [None] * 3)[:3]
+        if not url:
+            continue
+        base = {'name': name or '', 'url': url, 'category': category or ''}
+        readings = row[3:3 + len(dates)]
+        added = False
+        for date, value in zip(dates, readings):
+            if value is None or value == '':
+                continue
+            data.append(dict(base, last_checked=date, max_stock=value))
+            added = True
+        if not added:
+            data.append(dict(base, last_checked='', max_stock=''))
+    return data
+
+# Іменовані стилі таблиць: реєструються один раз на workbook, клітинки посилаються на них за назвою
+EXCEL_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+EXCEL_GREEN = 'C6EFCE'
+EXCEL_RED = 'FFC7CE'
+EXCEL_STRIPE = 'F2F2F2'
+EXCEL_STYLES = {
+    'rz_header': dict(font=Font(name='Arial', size=12, bold=True, color='FFFFFF'),
+                      fill=PatternFill(start_color='366092', end_color='366092', fill_type='solid'),
+                      alignment=Alignment(horizontal='center', vertical='center', wrap_text=True)),
+    'rz_text': dict(font=Font(name='Arial', size=11),
+                    alignment=Alignment(horizontal='left', vertical='center', wrap_text=True)),
+    'rz_value': dict(font=Font(name='Arial', size=11),
+                     alignment=Alignment(horizontal='center', vertical='center')),
+    'rz_in_stock': dict(font=Font(name='Arial', size=11),
+                        fill=PatternFill(start_color=EXCEL_GREEN, end_color=EXCEL_GREEN, fill_type='solid'),
+                        alignment=Alignment(horizontal='center', vertical='center')),
+    'rz_out_of_stock': dict(font=Font(name='Arial', size=11),
+                            fill=PatternFill(start_color=EXCEL_RED, end_color=EXCEL_RED, fill_type='solid'),
+                            alignment=Alignment(horizontal='center', vertical='center')),
+    'rz_stripe': dict(font=Font(name='Arial', size=11),
+                      fill=PatternFill(start_color=EXCEL_STRIPE, end_color=EXCEL_STRIPE, fill_type='solid'),
+                      alignment=Alignment(horizontal='center', vertical='center')),
+    'rz_increase': dict(font=Font(name='Arial', size=11, bold=True, color='006100'),
+                        fill=PatternFill(start_color=EXCEL_GREEN, end_color=EXCEL_GREEN, fill_type='solid'),
+                        alignment=Alignment(horizontal='center', vertical='center')),
+    'rz_decrease': dict(font=Font(name='Arial', size=11, bold=True, color='9C0006'),
+                        fill=PatternFill(start_color=EXCEL_RED, end_color=EXCEL_RED, fill_type='solid'),
+                        alignment=Alignment(horizontal='center', vertical='center')),
+}
+
+def create_streaming_workbook():
+    """Workbook у write-only режимі з зареєстрованими EXCEL_STYLES.
+
+    Рядки пишуться через ws.append і одразу скидаються на диск, тому пам'ять не росте з розміром таблиці.
+    """
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    for name, attrs in EXCEL_STYLES.items():
+        wb.add_named_style(NamedStyle(name=name, border=EXCEL_BORDER, **attrs))
+    return wb
+
+def excel_cell(ws, value, style):
+    """Клітинка write-only аркуша з іменованим стилем"""
+    from openpyxl.cell import WriteOnlyCell
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
+
+def excel_stock_style(value, stripe=False):
+    """Стиль клітинки залишку: зелений - є в наявності, червоний - 0, інакше смуга через рядок"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if value > 0:
+            return 'rz_in_stock'
+        if value == 0:
+            return 'rz_out_of_stock'
+    return 'rz_stripe' if stripe else 'rz_value'
+
+def setup_excel_sheet(ws, widths, freeze, header_height=None):
+    """Ширини колонок, висота рядків і закріплення - до запису рядків (write-only)"""
+    for col_idx, width in enumerate(widths, 1):
+        ws.column_dimensions[openpyxl.utils.get_column_letter(col_idx)].width = width
+    # Висота задається один раз для всього аркуша замість циклу по рядках
+    ws.sheet_format.defaultRowHeight = 25
+    ws.sheet_format.customHeight = True
+    if header_height:
+        ws.row_dimensions[1].height = header_height
+    ws.freeze_panes = freeze
+
+# Підписи колонок періоду у зведених таблицях (порядок - analytics.BUCKET_FIELDS)
+EXCEL_BUCKET_HEADERS = ["залишок", "мін", "макс", "продано"]
+
+def bucket_headers(buckets: HistoryBuckets):
+    """Заголовки колонок зведеної історії: по EXCEL_BUCKET_HEADERS на кожен період"""
+    return [f"{label}\n{name}" for label in buckets.labels for name in EXCEL_BUCKET_HEADERS]
+
+def bucket_cells(ws, values, stripe=False):
+    """Клітинки зведеної історії товару (HistoryBuckets.row)"""
+    cells = []
+    for i, value in enumerate(values):
+        if value is None:
+            cells.append(excel_cell(ws, '', 'rz_stripe' if stripe else 'rz_value'))
+        elif i % len(EXCEL_BUCKET_HEADERS) == len(EXCEL_BUCKET_HEADERS) - 1:
+            cells.append(excel_cell(ws, value, 'rz_decrease' if value else ('rz_stripe' if stripe else 'rz_value')))
+        else:
+            cells.append(excel_cell(ws, value, excel_stock_style(value, stripe)))
+    return cells
+
+def group_excel_rows(data_list):
+    """Рядки EXCEL_FIELDS -> {url: {'name', 'category', 'url', 'dates': {дата: залишок}}}"""
     products_history = {}
-    all_dates = set()
     
     for row in data_list:
         url = row.get('url', '')
@@ -721,90 +1760,95 @@ def save_excel_with_formatting(path: str, data_list):
         if date:
             date_only = date.split(' ')[0] if ' ' in date else date
             products_history[url]['dates'][date_only] = row.get('max_stock', 0)
-            all_dates.add(date_only)
-    
-    sorted_dates = sorted(list(all_dates))
+    return products_history
+
+def save_excel_with_formatting(path: str, data_list):
+    """Сохраняет список словарей в Excel с форматированием"""
+    if not data_list:
+        print("[ПОПЕРЕДЖЕННЯ] Список даних порожній, створюємо файл тільки з заголовками")
+        data_list = []
     
-    from openpyxl import Workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Істория залишків"
+    products_history = group_excel_rows(data_list)
+    sorted_dates = sorted({date for product in products_history.values() for date in product['dates']})
+    write_wide_history(path, sorted_dates, products_history.values())
 
-    headers = ["Назва", "URL", "Категорія"] + sorted_dates
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num, value=header)
-        
-        cell.font = Font(name='Arial', size=12, bold=True, color='FFFFFF')
-        cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        cell.border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-
-    row_num = 2
-    for product_data in products_history.values():
-        cell = ws.cell(row=row_num, column=1, value=product_data['name'])
-        cell.font = Font(name='Arial', size=11)
-        cell.alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
-        cell.border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-        
-        cell = ws.cell(row=row_num, column=2, value=product_data['url'])
-        cell.font = Font(name='Arial', size=11)
-        cell.alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
-        cell.border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-        
-        cell = ws.cell(row=row_num, column=3, value=product_data['category'])
-        cell.font = Font(name='Arial', size=11)
-        cell.alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
-        cell.border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-        
-        for col_idx, date in enumerate(sorted_dates, 4):
-            stock_value = product_data['dates'].get(date, '')
-            cell = ws.cell(row=row_num, column=col_idx, value=stock_value)
-            
-            cell.font = Font(name='Arial', size=11)
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-            
-            if stock_value and stock_value > 0:
-                cell.fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
-            elif stock_value == 0:
-                cell.fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
-            
-            if row_num % 2 == 0:
-                if not cell.fill.start_color or cell.fill.start_color.rgb == '00000000':
-                    cell.fill = PatternFill(start_color='F2F2F2', end_color='F2F2F2', fill_type='solid')
-        
-        row_num += 1
+def write_wide_history(path: str, sorted_dates, products) -> int:
+    """Пише таблицю товари x дати в write-only режимі.
 
-    ws.column_dimensions['A'].width = 40
-    ws.column_dimensions['B'].width = 60
-    ws.column_dimensions['C'].width = 25
-    
-    for col_idx in range(4, len(headers) + 1):
-        col_letter = openpyxl.utils.get_column_letter(col_idx)
-        ws.column_dimensions[col_letter].width = 12
+    products - ітерований {'name', 'url', 'category', 'dates': {дата: залишок}}, читається
+    по одному товару, тож викликач може віддавати їх прямо з курсора бази.
+    Файл пишеться в path.tmp і замінює path лише після успішного збереження.
+    Повертає кількість товарів.
+    """
+    wb = create_streaming_workbook()
+    ws = wb.create_sheet("Істория залишків")
 
-    for row in ws.iter_rows():
-        ws.row_dimensions[row[0].row].height = 25
+    headers = EXCEL_WIDE_HEADERS + list(sorted_dates)
+    setup_excel_sheet(ws, [40, 60, 25] + [12] * len(sorted_dates), 'A2')
 
-    ws.freeze_panes = 'A2'
-    
-    max_row = len(products_history) + 1
-    max_col = len(headers)
-    ws.auto_filter.ref = f"A1:{openpyxl.utils.get_column_letter(max_col)}{max_row}"
+    ws.append([excel_cell(ws, header, 'rz_header') for header in headers])
+
+    row_num = 1
+    for row_num, product_data in enumerate(products, 2):
+        stripe = row_num % 2 == 0
+        row = [
+            excel_cell(ws, product_data['name'], 'rz_text'),
+            excel_cell(ws, product_data['url'], 'rz_text'),
+            excel_cell(ws, product_data['category'], 'rz_text'),
+        ]
+        for date in sorted_dates:
+            stock_value = product_data['dates'].get(date, '')
+            row.append(excel_cell(ws, stock_value, excel_stock_style(stock_value, stripe)))
+        ws.append(row)
+    ws.auto_filter.ref = f"A1:{openpyxl.utils.get_column_letter(len(headers))}{row_num}"
 
+    tmp_path = path + '.tmp'
     try:
-        wb.save(path)
+        wb.save(tmp_path)
+        os.replace(tmp_path, path)
     except Exception as e:
         print(f"[ОШИБКА] Не удалось сохранить Excel файл: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         raise
+    return row_num - 1
 
-def upsert_rows(existing_data, new_items):
-    """Обновляет список данных новыми элементами"""
+def save_excel_summary(path: str, data_list, period: str) -> int:
+    """Зведена таблиця історії по тижнях або місяцях (див. analytics.HistoryBuckets).
+
+    Агрегати рахуються NumPy до запису клітинок, тож ширина таблиці - 4 колонки на період
+    замість колонки на кожен день. Повертає кількість товарів.
+    """
+    products_history = group_excel_rows(data_list)
+    products = list(products_history.values())
+    matrix = StockMatrix.from_histories([product['name'] for product in products],
+                                        [product['url'] for product in products],
+                                        [product['dates'] for product in products])
+    buckets = HistoryBuckets(matrix, period)
+    
+    wb = create_streaming_workbook()
+    ws = wb.create_sheet("Історія по тижнях" if period == "week" else "Історія по місяцях")
+    
+    headers = EXCEL_WIDE_HEADERS + bucket_headers(buckets)
+    setup_excel_sheet(ws, [40, 60, 25] + [10] * (len(headers) - 3), 'D2', header_height=30)
+    ws.auto_filter.ref = f"A1:{openpyxl.utils.get_column_letter(len(headers))}{len(products) + 1}"
+    ws.append([excel_cell(ws, header, 'rz_header') for header in headers])
+    
+    for i, product in enumerate(products):
+        stripe = i % 2 == 0
+        row = [
+            excel_cell(ws, product['name'], 'rz_text'),
+            excel_cell(ws, product['url'], 'rz_text'),
+            excel_cell(ws, product['category'], 'rz_text'),
+        ]
+        row.extend(bucket_cells(ws, buckets.row(i), stripe))
+        ws.append(row)
+    
+    wb.save(path)
+    return len(products)
+
+def excel_rows(new_items):
+    """Результати перевірки -> рядки EXCEL_FIELDS (помилки пропускаються)"""
     now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     new_rows = []
     
@@ -816,20 +1860,187 @@ def upsert_rows(existing_data, new_items):
             'name': item.get('title', ''),
             'url': item.get('url', ''),
             'category': item.get('category', ''),
-            'last_checked': now_str,
+            'last_checked': item.get('last_checked', now_str),
             'max_stock': item.get('max_stock', 0),
         })
+    return new_rows
+
+def upsert_rows(existing_data, new_items):
+    """Обновляет список данных новыми элементами.
+
+    Замір ідентифікується парою (url, дата): нові рядки замінюють існуючі за ту ж дату,
+    історія за інші дати зберігається. last_checked елемента (якщо є) зберігає дату заміру.
+    """
+    new_rows = excel_rows(new_items)
     
     if not existing_data:
         existing_data = []
     
-    new_urls = [row['url'] for row in new_rows]
-    filtered_existing = [row for row in existing_data if row.get('url', '') not in new_urls]
+    def reading_key(row):
+        return row.get('url', ''), str(row.get('last_checked') or '').split(' ')[0]
+    
+    new_keys = {reading_key(row) for row in new_rows}
+    new_urls = {row['url'] for row in new_rows}
+    # Порожній рядок-заглушку товару без замірів замінюють будь-які нові дані про нього
+    filtered_existing = [row for row in existing_data
+                         if reading_key(row) not in new_keys
+                         and not (row.get('url', '') in new_urls and not reading_key(row)[1])]
     
     filtered_existing.extend(new_rows)
     
     return filtered_existing
 
+class ExcelHistory:
+    """Excel-історія (формат save_excel_with_formatting) з індексом останніх замірів.
+
+    Поруч із файлом зберігається індекс: розмір/mtime файлу і для кожного URL останній
+    записаний замір. Оновлення порівнює нові заміри з індексом (dict по URL) і, якщо змін
+    немає, файл не відкривається взагалі. Якщо зміни є (або індекс застарів), файл переписується
+    потоково: з source() - історії, яку віддає викликач (бот читає її з бази, старий файл
+    не розбирається), а без source - злиттям існуючого файлу з новими рядками (rebuild).
+    """
+    INDEX_VERSION = 2
+
+    def __init__(self, path: str = EXCEL_FILENAME, index_path: str = None):
+        self.path = path
+        self.index_path = index_path or os.path.splitext(path)[0] + '.index.json'
+
+    @staticmethod
+    def _file_stat(path):
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    @staticmethod
+    def _reading(row):
+        """Рядок -> [назва, категорія, дата, залишок] - те, що індекс пам'ятає про товар"""
+        date = str(row.get('last_checked') or '').split(' ')[0]
+        stock = row.get('max_stock', '') if date else ''
+        return [row.get('name', ''), row.get('category', ''), date, stock if stock is not None else '']
+
+    def _is_changed(self, entry, row):
+        if entry is None:
+            return True
+        name, category, date, stock = self._reading(row)
+        if not date:
+            return entry[:2] != [name, category]
+        return entry != [name, category, date, stock]
+
+    def _load_index(self):
+        if not os.path.exists(self.path) or not os.path.exists(self.index_path):
+            return None
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') != self.INDEX_VERSION:
+                return None
+            if index.get('file') != self._file_stat(self.path):
+                print("[ExcelHistory] Файл змінено поза ботом, перебудовуємо")
+                return None
+            return index
+        except (OSError, ValueError) as e:
+            print(f"[ExcelHistory] Не вдалося завантажити індекс: {e}")
+            return None
+
+    def _save_index(self, rows):
+        index = {'version': self.INDEX_VERSION, 'file': self._file_stat(self.path), 'rows': rows}
+        tmp_path = self.index_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"[ExcelHistory] Не вдалося зберегти індекс: {e}")
+
+    def update(self, new_items, source=None) -> int:
+        """Записує результати перевірки; повертає кількість змінених товарів.
+
+        source() -> (дати, товари для write_wide_history) - повна історія, якщо new_items
+        охоплюють увесь каталог; товари з індексу, яких немає в new_items, тоді вважаються видаленими.
+        """
+        new_rows = excel_rows(new_items)
+        index = self._load_index()
+        if index is None:
+            # Немає індексу або файл змінено поза ботом: без source зберігаємо дані файлу злиттям,
+            # з source - база головна, і видалені з неї товари у файл не повертаються
+            if source is None:
+                return self.rebuild(new_rows)
+            changed = len(new_rows)
+        else:
+            indexed = index['rows']
+            changed = sum(1 for row in new_rows if self._is_changed(indexed.get(row['url']), row))
+            if source is not None:
+                changed += len(set(indexed) - {row['url'] for row in new_rows})
+            if not changed:
+                return 0
+            if source is None:
+                return self.rebuild(new_rows)
+
+        dates, products = source()
+        write_wide_history(self.path, dates, products)
+        self._save_index({row['url']: self._reading(row) for row in new_rows})
+        return changed
+
+    def rebuild(self, new_rows) -> int:
+        """Повна перебудова файлу з існуючими даними і новими рядками"""
+        existing = load_existing_excel(self.path)
+        merged = upsert_rows(existing, [dict(row, title=row['name']) for row in new_rows])
+        save_excel_with_formatting(self.path, merged)
+
+        # Останній замір кожного URL - для порівняння при наступному оновленні
+        latest = {}
+        for row in merged:
+            reading = self._reading(row)
+            current = latest.get(row['url'])
+            if current is None or reading[2] >= current[2]:
+                latest[row['url']] = reading
+        self._save_index(latest)
+        return len(new_rows)
+
+DB_FILENAME = "rozetka_bot.db"
+HISTORY_EXPORT_FORMATS = ("csv", "jsonl")
+HISTORY_EXPORT_FIELDS = ["product_id", "name", "url", "category", "check_date", "stock_count", "min_stock", "max_stock"]
+
+def export_history_stream(db_path: str, path: str, fmt: str = "csv", chunk_size: int = 5000) -> int:
+    """Вивантажує stock_history у довгому форматі (рядок на товар і дату) в gzip CSV або JSONL.
+
+    Рядки читаються з SQLite пачками по chunk_size і одразу пишуться в gzip-потік,
+    тож пам'ять не залежить від розміру історії. Пише прямо в path (тимчасовий файл
+    і перейменування - справа того, хто викликає). Повертає кількість записаних рядків.
+    """
+    if fmt not in HISTORY_EXPORT_FORMATS:
+        raise ValueError(f"Невідомий формат експорту: {fmt}")
+
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        # min/max з'явилися пізніше - для старих баз віддаємо NULL
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(stock_history)")}
+        min_max = "sh.min_stock, sh.max_stock" if "min_stock" in columns else "NULL, NULL"
+        cursor = conn.execute(f"""
+            SELECT p.id, p.name, p.url, p.category, sh.check_date, sh.stock_count, {min_max}
+            FROM stock_history sh
+            JOIN products p ON p.id = sh.product_id
+            ORDER BY sh.product_id, sh.check_date
+        """)
+
+        count = 0
+        with gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=6) as f:
+            if fmt == "csv":
+                writer = csv.writer(f)
+                writer.writerow(HISTORY_EXPORT_FIELDS)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                if fmt == "csv":
+                    writer.writerows(rows)
+                else:
+                    f.writelines(json.dumps(dict(zip(HISTORY_EXPORT_FIELDS, row)), ensure_ascii=False) + "\n"
+                                 for row in rows)
+                count += len(rows)
+        return count
+    finally:
+        conn.close()
+
 def read_urls_from_file(fname):
     urls = []
     with open(fname, encoding='utf-8') as f:
@@ -896,13 +2107,51 @@ def parse_cli():
     p.add_argument('-f', '--file', help='Файл зі списком URL (по 1 в рядку)')
     p.add_argument('--interactive', action='store_true', help='Інтерактивний режим для вводу URL')
     p.add_argument('--debug', action='store_true', help='Дебаг вивід')
-    p.add_argument('--delay', type=float, default=0.7, help='Затримка між запитами під час бінарного пошуку')
+    p.add_argument('--delay', type=float, default=0.7, help='Початкова затримка між запитами (далі швидкість підлаштовується автоматично)')
+    p.add_argument('--workers', type=int, default=4, help='Кількість паралельних воркерів перевірки')
+    p.add_argument('--batch-size', type=int, default=1, help='Кількість товарів в одній корзині (пакетний пошук)')
+    p.add_argument('--export', choices=HISTORY_EXPORT_FORMATS,
+                   help='Замість перевірки вивантажити історію залишків з бази бота в gzip CSV/JSONL')
+    p.add_argument('--db', default=DB_FILENAME, help='База даних бота для --export')
+    p.add_argument('--period', choices=HISTORY_PERIODS,
+                   help=f'Замість перевірки зібрати з {EXCEL_FILENAME} зведену таблицю по тижнях або місяцях')
+    p.add_argument('-o', '--output', help='Файл для --export/--period (за замовчуванням rozetka_stock_history.<формат>.gz '
+                                          'або rozetka_stock_history_<період>.xlsx)')
     return p.parse_args()
 
+def export_history_cli(args):
+    if not os.path.exists(args.db):
+        print(f"❌ Базу даних не знайдено: {args.db}")
+        return
+    output = args.output or f"rozetka_stock_history.{args.export}.gz"
+    print(f"📤 Вивантажуємо історію з {args.db} у {output}...")
+    started = time.monotonic()
+    tmp_path = output + ".tmp"
+    count = export_history_stream(args.db, tmp_path, args.export)
+    os.replace(tmp_path, output)
+    print(f"✅ Записано {count} рядків за {time.monotonic() - started:.1f} с "
+          f"({os.path.getsize(output) / 1024 / 1024:.1f} МБ)")
+
+def summary_cli(args):
+    data = load_existing_excel(EXCEL_FILENAME)
+    if not data:
+        print(f"❌ Немає історії в {EXCEL_FILENAME}")
+        return
+    output = args.output or f"rozetka_stock_history_{args.period}.xlsx"
+    started = time.monotonic()
+    count = save_excel_summary(output, data, args.period)
+    print(f"✅ Зведена таблиця {output}: {count} товарів за {time.monotonic() - started:.1f} с")
+
 def main():
     print("🚀 Запуск Rozetka Stock Checker...")
     
     args = parse_cli()
+    if args.export:
+        export_history_cli(args)
+        return
+    if args.period:
+        summary_cli(args)
+        return
     urls = list(args.urls)
     
     if args.file:
@@ -920,28 +2169,24 @@ def main():
     print(f"\n🎯 Знайдено {len(urls)} товарів для перевірки")
     print("⏳ Починаємо перевірку залишків...\n")
 
-    checker = RozetkaStockChecker(debug=args.debug, delay=args.delay)
-    results = []
-    
-    for i, url in enumerate(urls, 1):
-        print(f"[{i}/{len(urls)}] Перевіряємо товар...")
-        res = checker.check_product(url)
-        results.append(res)
-        
-        if i < len(urls):
-            print("⏱️  Пауза між запитами...")
-            time.sleep(2)
+    engine = StockCheckEngine(workers=args.workers, debug=args.debug, delay=args.delay,
+                              batch_size=args.batch_size)
 
-    existing = load_existing_excel(EXCEL_FILENAME)
-    merged = upsert_rows(existing, results)
-    
-    save_excel_with_formatting(EXCEL_FILENAME, merged)
+    def report_progress(index, url, result):
+        print(f"[{index + 1}/{len(urls)}] Перевірено товар: {url}")
+
+    try:
+        results = engine.check_all(urls, on_result=report_progress)
+    finally:
+        engine.shutdown()
+
+    changed = ExcelHistory(EXCEL_FILENAME).update(results)
 
     print("\n" + "="*70)
     print("✅ ГОТОВО! Результати перевірки:")
     print("="*70)
     print(f"📊 Файл збережено: {os.path.abspath(EXCEL_FILENAME)}")
-    print(f"📈 Всього записів в таблиці: {len(merged)}")
+    print(f"📈 Оновлено рядків у таблиці: {changed}")
     print("-"*70)
     
     success_count = 0